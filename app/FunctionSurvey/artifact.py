@@ -0,0 +1,167 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+from .survey import FunctionDecl, VarDecl, SurveySummary
+
+# format of survey artifact (changed when the record layout is changed)
+_Format = "clang-analyzer-survey"
+_Version = 1
+
+
+def ArtifactPath(ArtifactDir:str, SourceFile:str, Compress:bool=False) -> Path:
+    """get artifact file of the source file
+
+    The file name is the source file name and the hash of its absolute path,
+    so a survey of the same tree overwrites the artifacts.
+
+    Args:
+        ArtifactDir (str): artifact directory
+        SourceFile (str): source file
+        Compress (bool, optional): gzip compressed artifact (Defaults to False).
+
+    Returns:
+        Path: artifact file (.jsonl or .jsonl.gz)
+    """
+    digest = hashlib.sha1(os.path.abspath(SourceFile).encode()).hexdigest()[:12]
+    return Path(ArtifactDir) / f"{Path(SourceFile).name}-{digest}.jsonl{'.gz' if Compress else ''}"
+
+
+def _Open(ArtifactFile:Path, Mode:str, Compress:bool):
+    """open artifact file"""
+    if Compress:
+        return gzip.open(ArtifactFile, Mode + "t", encoding="utf-8", compresslevel=6)
+
+    return open(ArtifactFile, Mode, encoding="utf-8")
+
+
+def WriteArtifact(ArtifactFile:Path, SourceFile:str, ClangArgs:str, Records) -> SurveySummary:
+    """write record stream of a source file to artifact file (JSON Lines)
+
+    The first line is the header {"format", "version", "source", "clang_args"},
+    followed by ["F", function] and ["V", variable] lines (the slot values of the
+    records) and ["S", summary] at the end. The file paths are written as surveyed.
+    The artifact is written to a temporary file and renamed, so a failed survey
+    (SurveyError from the stream) leaves no artifact.
+
+    Args:
+        ArtifactFile (Path): artifact file (.gz: gzip compressed)
+        SourceFile (str): source file
+        ClangArgs (str): command-line option to clang
+        Records (iterable): FunctionDecl, VarDecl and SurveySummary of the source file
+
+    Returns:
+        SurveySummary: summary of the survey
+    """
+    ArtifactFile.parent.mkdir(parents=True, exist_ok=True)
+    temp = ArtifactFile.with_name(f".{ArtifactFile.name}.{os.getpid()}")
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    summary = None
+    try:
+        with _Open(temp, "w", ArtifactFile.suffix == ".gz") as f:
+            f.write(dumps({"format": _Format, "version": _Version, "source": SourceFile, "clang_args": ClangArgs}) + "\n")
+            for record in Records:
+                if isinstance(record, FunctionDecl):
+                    f.write(dumps(["F", record.ToJson()]) + "\n")
+
+                elif isinstance(record, VarDecl):
+                    f.write(dumps(["V", record.ToJson()]) + "\n")
+
+                else:
+                    summary = record
+                    f.write(dumps(["S", {
+                        "Includes"          : summary.Includes,
+                        "HeaderFunctions"   : {name: func.ToJson() for name, func in summary.HeaderFunctions.items()},
+                        "Stats"             : summary.Stats,
+                    }]) + "\n")
+
+        os.replace(temp, ArtifactFile)
+
+    finally:
+        if temp.exists():
+            temp.unlink()
+
+    return summary
+
+
+def ReadArtifactHeader(ArtifactFile:Path) -> dict:
+    """read header of artifact file
+
+    Args:
+        ArtifactFile (Path): artifact file
+
+    Raises:
+        ValueError: not a survey artifact of this version
+
+    Returns:
+        dict: {"format", "version", "source", "clang_args"}
+    """
+    with _Open(Path(ArtifactFile), "r", Path(ArtifactFile).suffix == ".gz") as f:
+        header = json.loads(f.readline() or "null")
+
+    if not isinstance(header, dict) or header.get("format") != _Format or header.get("version") != _Version:
+        raise ValueError(f"{ArtifactFile} is not a survey artifact of version {_Version}")
+
+    return header
+
+
+def ArtifactRecords(ArtifactFile:Path):
+    """read record stream of artifact file (same as the record stream of the survey)
+
+    Args:
+        ArtifactFile (Path): artifact file
+
+    Raises:
+        ValueError: not a survey artifact of this version, or the summary is missing
+
+    Yields:
+        FunctionDecl | VarDecl | SurveySummary: records, and the summary at the end
+    """
+    ArtifactFile = Path(ArtifactFile)
+    ReadArtifactHeader(ArtifactFile)
+
+    with _Open(ArtifactFile, "r", ArtifactFile.suffix == ".gz") as f:
+        f.readline()
+        for line in f:
+            kind, values = json.loads(line)
+            if kind == "F":
+                record = FunctionDecl.FromJson(values)
+                record.Name = sys.intern(record.Name)
+                yield record
+
+            elif kind == "V":
+                yield VarDecl.FromJson(values)
+
+            else:
+                yield SurveySummary(
+                    values["Includes"],
+                    {sys.intern(name): FunctionDecl.FromJson(func) for name, func in values["HeaderFunctions"].items()},
+                    values["Stats"])
+                return
+
+    raise ValueError(f"{ArtifactFile} has no summary")
+
+
+def FindArtifacts(Targets:list) -> list:
+    """find artifact files
+
+    Args:
+        Targets (list): artifact files or directories (searched recursively)
+
+    Returns:
+        list: artifact files (sorted in each directory)
+    """
+    artifacts = []
+    for target in Targets:
+        path = Path(target)
+        if path.is_dir():
+            artifacts += sorted(file for pattern in ("*.jsonl", "*.jsonl.gz") for file in path.rglob(pattern))
+
+        else:
+            artifacts.append(path)
+
+    return list(dict.fromkeys(artifacts))
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import shlex
+from pathlib import Path
+
+logger = logging.getLogger('Survey')
+
+# file hash memo in this process {path: (mtime_ns, size, sha256)}
+_FileHashMemo = {}
+
+
+def FileHash(FilePath:str) -> str:
+    """get sha256 of the file
+
+    The hash is memorized while the file's mtime and size are not changed,
+    so a header included from many source files is read only once.
+
+    Args:
+        FilePath (str): file path
+
+    Returns:
+        str: sha256 hex digest (None: the file doesn't exist)
+    """
+    try:
+        stat = os.stat(FilePath)
+    except OSError:
+        return None
+
+    memo = _FileHashMemo.get(FilePath)
+    if memo is not None and memo[0] == stat.st_mtime_ns and memo[1] == stat.st_size:
+        return memo[2]
+
+    sha = hashlib.sha256()
+    with open(FilePath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+
+    _FileHashMemo[FilePath] = (stat.st_mtime_ns, stat.st_size, sha.hexdigest())
+    return sha.hexdigest()
+
+
+def NormalizeClangArgs(ClangArgs:str) -> list:
+    """normalize command-line option to clang
+
+    Separated option values ("-I dir", "-D NAME") are joined to the option,
+    and include directories are made absolute. The order is kept because
+    it changes the include search.
+
+    Args:
+        ClangArgs (str): command-line option to clang
+
+    Returns:
+        list: normalized options
+    """
+    args = []
+    tokens = shlex.split(ClangArgs)
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token in ("-I", "-D", "-U", "-include", "-isystem") and index + 1 < len(tokens):
+            index += 1
+            token = token + tokens[index]
+
+        for option in ("-I", "-isystem"):
+            if token.startswith(option) and len(token) > len(option):
+                token = option + os.path.abspath(token[len(option):])
+                break
+
+        args.append(token)
+        index += 1
+
+    return args
+
+
+class ParseCache():
+    """persistent cache of survey result
+
+    A cache entry is stored per (source file, clang args, survey options).
+    The entry is valid while the hashes of the source file and every
+    transitively included header are not changed.
+    """
+    _Version = 3
+
+    def __init__(self, CacheDir:str):
+        """initialize
+
+        Args:
+            CacheDir (str): cache directory
+        """
+        self._CacheDir = Path(CacheDir)
+        self._CacheDir.mkdir(parents=True, exist_ok=True)
+
+    def _EntryPath(self, TargetSourceFile:str, ClangArgs:str, Options:list=None) -> Path:
+        """get cache entry file
+
+        Args:
+            TargetSourceFile (str): source file
+            ClangArgs (str): command-line option to clang
+            Options (list, optional): survey options which change the result (Defaults to None).
+
+        Returns:
+            Path: cache entry file
+        """
+        key = [os.path.abspath(TargetSourceFile), NormalizeClangArgs(ClangArgs)]
+        if Options:
+            key.append(Options)
+
+        key = json.dumps(key)
+        return self._CacheDir / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+    def Get(self, TargetSourceFile:str, ClangArgs:str, Options:list=None) -> dict:
+        """get cached survey result
+
+        Args:
+            TargetSourceFile (str): source file
+            ClangArgs (str): command-line option to clang
+            Options (list, optional): survey options which change the result (Defaults to None).
+
+        Returns:
+            dict: survey result of JSON value (None: cache miss)
+        """
+        entry_path = self._EntryPath(TargetSourceFile, ClangArgs, Options)
+        try:
+            with open(entry_path, "r") as f:
+                entry = json.load(f)
+
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("Version") != self._Version:
+            return None
+
+        # check the source file and included headers
+        if FileHash(TargetSourceFile) != entry["Source"]:
+            logger.debug(f"cache miss (source changed) {TargetSourceFile}")
+            return None
+
+        for include, sha in entry["Includes"].items():
+            if FileHash(include) != sha:
+                logger.debug(f"cache miss ({include} changed) {TargetSourceFile}")
+                return None
+
+        logger.debug(f"cache hit {TargetSourceFile}")
+        return entry["Result"]
+
+    def Put(self, TargetSourceFile:str, ClangArgs:str, Includes:list, Result:dict, Options:list=None):
+        """store survey result
+
+        Args:
+            TargetSourceFile (str): source file
+            ClangArgs (str): command-line option to clang
+            Includes (list): transitively included headers
+            Result (dict): survey result of JSON value
+            Options (list, optional): survey options which change the result (Defaults to None).
+        """
+        entry = {
+            "Version"   : self._Version,
+            "Source"    : FileHash(TargetSourceFile),
+            "Args"      : NormalizeClangArgs(ClangArgs),
+            "Includes"  : {include: FileHash(include) for include in Includes},
+            "Result"    : Result,
+        }
+
+        # write to temporary file and replace, since the other workers may read the entry
+        entry_path = self._EntryPath(TargetSourceFile, ClangArgs, Options)
+        temp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, entry_path)
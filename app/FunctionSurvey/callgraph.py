@@ -0,0 +1,455 @@
+from array import array
+from collections import namedtuple
+import json
+import logging
+import mmap
+import struct
+import sys
+
+logger = logging.getLogger('Survey')
+
+
+class CallGraph():
+    """in-memory call graph of a project
+
+    Function names are interned to integer ids (0 .. N-1), and the call edges
+    are held in CSR (compressed sparse row) arrays for both directions:
+    the callees of function i are _CalleeIndex[_CalleeOffset[i]:_CalleeOffset[i + 1]].
+    """
+
+    def __init__(self, Names:list, Attributes:list, Edges:list):
+        """initialize
+
+        Args:
+            Names (list): function names (index is function id)
+            Attributes (list): function attributes {"static", "return_type"} (index is function id)
+            Edges (list): call edges [(call from id, call to id)]
+        """
+        self._Names = Names
+        self._Attributes = Attributes
+        self._Ids = {name: index for index, name in enumerate(Names)}
+
+        edges = sorted(set(Edges))
+        self._CalleeOffset, self._CalleeIndex = self._MakeCSR(len(Names), edges)
+        self._CallerOffset, self._CallerIndex = self._MakeCSR(len(Names), sorted((to, fr) for fr, to in edges))
+
+    @staticmethod
+    def _MakeCSR(Count:int, Edges:list) -> tuple:
+        """make CSR arrays
+
+        Args:
+            Count (int): number of functions
+            Edges (list): sorted edges [(source id, destination id)]
+
+        Returns:
+            tuple: (offset array, index array)
+        """
+        offset = array("l", [0] * (Count + 1))
+        index = array("l", [dst for src, dst in Edges])
+        for src, dst in Edges:
+            offset[src + 1] += 1
+
+        for i in range(Count):
+            offset[i + 1] += offset[i]
+
+        return offset, index
+
+    @classmethod
+    def FromDatabase(cls, ProjectName:str) -> "CallGraph":
+        """load call graph of the project from database
+
+        The functions and the relations are read by one query each.
+
+        Args:
+            ProjectName (str): project name
+
+        Returns:
+            CallGraph: call graph
+        """
+        from .models import Function, FunctionRelation
+
+        names = []
+        attributes = []
+        ids = {}
+        func_ids = {}
+        for pk, name, static, return_type in Function.objects.filter(project__name = ProjectName).order_by("id").values_list("id", "name", "static", "return_type"):
+            # the function of the same name (static functions in other files) is merged
+            if name not in ids:
+                ids[name] = len(names)
+                names.append(name)
+                attributes.append({"static": static, "return_type": return_type})
+
+            func_ids[pk] = ids[name]
+
+        edges = [
+            (func_ids[call_from], func_ids[call_to])
+            for call_from, call_to in FunctionRelation.objects.filter(project__name = ProjectName, call_from__isnull = False).values_list("call_from_id", "call_to_id")
+        ]
+
+        logger.debug(f"call graph {len(names)} function(s), {len(edges)} relation(s)")
+        return cls(names, attributes, edges)
+
+    @classmethod
+    def FromSnapshot(cls, Snapshot:"CallGraphSnapshot") -> "CallGraph":
+        """load call graph from snapshot file
+
+        Args:
+            Snapshot (CallGraphSnapshot): snapshot
+
+        Returns:
+            CallGraph: call graph
+        """
+        names = []
+        attributes = []
+        ids = {}
+        func_ids = []
+        for index in range(Snapshot.FunctionCount):
+            name = Snapshot.FunctionName(index)
+            if name not in ids:
+                ids[name] = len(names)
+                names.append(name)
+                attributes.append({"static": Snapshot.IsStatic(index), "return_type": Snapshot.ReturnType(index)})
+
+            func_ids.append(ids[name])
+
+        edges = [(func_ids[call_from], func_ids[call_to]) for call_from, call_to in Snapshot.Relations() if call_from >= 0]
+
+        logger.debug(f"call graph {len(names)} function(s), {len(edges)} relation(s) (snapshot of {Snapshot.Project})")
+        return cls(names, attributes, edges)
+
+    @property
+    def EdgeCount(self) -> int:
+        """number of call edges"""
+        return len(self._CalleeIndex)
+
+    def __len__(self):
+        return len(self._Names)
+
+    def Id(self, FunctionName:str) -> int:
+        """get function id
+
+        Args:
+            FunctionName (str): function name
+
+        Returns:
+            int: function id (None: not registered)
+        """
+        return self._Ids.get(FunctionName)
+
+    def Name(self, FunctionId:int) -> str:
+        """get function name
+
+        Args:
+            FunctionId (int): function id
+
+        Returns:
+            str: function name
+        """
+        return self._Names[FunctionId]
+
+    def Attribute(self, FunctionId:int) -> dict:
+        """get function attributes
+
+        Args:
+            FunctionId (int): function id
+
+        Returns:
+            dict: {"static", "return_type"}
+        """
+        return self._Attributes[FunctionId]
+
+    def Callees(self, FunctionId:int):
+        """get called functions
+
+        Args:
+            FunctionId (int): function id
+
+        Returns:
+            array: ids of called functions
+        """
+        return self._CalleeIndex[self._CalleeOffset[FunctionId]:self._CalleeOffset[FunctionId + 1]]
+
+    def Callers(self, FunctionId:int):
+        """get calling functions
+
+        Args:
+            FunctionId (int): function id
+
+        Returns:
+            array: ids of calling functions
+        """
+        return self._CallerIndex[self._CallerOffset[FunctionId]:self._CallerOffset[FunctionId + 1]]
+
+    def Trace(self, FunctionName:str, Depth:int, Upper:bool) -> dict:
+        """trace function tree
+
+        A function which is already on the path is not expanded again and marked
+        as "recursive". The subtree of (function, remaining depth) is memorized
+        and shared while it doesn't depend on the functions above it, and it is
+        reused only on a path which has none of the functions in the subtree.
+
+        Args:
+            FunctionName (str): target function
+            Depth (int): trace level
+            Upper (bool): True: trace calling functions, False: trace called functions
+
+        Returns:
+            dict: {"name", "recursive", "next": [...]}
+        """
+        FunctionId = self.Id(FunctionName)
+        if FunctionId is None:
+            return {"name": FunctionName, "recursive": False, "next": []}
+
+        neighbors = self.Callers if Upper else self.Callees
+        memo = {}
+        path = {}
+
+        def trace(func_id:int, depth:int) -> tuple:
+            # returns (tree, shallowest path level where the recursion was cut, functions in the tree)
+            hit = memo.get((func_id, depth))
+            if hit is not None and hit[1].isdisjoint(path):
+                return hit[0], len(path), hit[1]
+
+            level = len(path)
+            element = {"name": self._Names[func_id], "recursive": False, "next": []}
+            cut = level + 1
+            functions = {func_id}
+            if depth > 0:
+                path[func_id] = level
+                for next_id in neighbors(func_id):
+                    if next_id in path:
+                        element["next"].append({"name": self._Names[next_id], "recursive": True, "next": []})
+                        cut = min(cut, path[next_id])
+                        continue
+
+                    next_element, next_cut, next_functions = trace(next_id, depth - 1)
+                    element["next"].append(next_element)
+                    cut = min(cut, next_cut)
+                    functions |= next_functions
+
+                del path[func_id]
+
+            # the subtree which was cut only inside itself is same on every path without its functions
+            functions = frozenset(functions)
+            if cut >= level:
+                memo[(func_id, depth)] = (element, functions)
+
+            return element, cut, functions
+
+        return trace(FunctionId, Depth)[0]
+
+
+# function record read from snapshot (same attribute names as Function model)
+SnapshotFunction = namedtuple("SnapshotFunction", [
+    "id", "name", "return_type", "arguments", "file", "line", "end_line", "static", "const", "is_prototype"
+])
+
+
+class CallGraphSnapshot():
+    """call graph snapshot file
+
+    The functions and the relations of a project are saved in a binary file,
+    which is opened by mmap without database connection.
+
+    layout (native byte order, every section is 8 byte aligned):
+        header          : magic, byte order, project string id, string count, function count, relation count, string blob size
+        string offset   : int64[string count + 1]
+        string blob     : utf-8
+        function        : int32[function count][7] (name, return type, arguments(json), file, line, end line, flags)
+        relation        : int32[relation count][2] (call from function index (-1: function pointer), call to function index)
+    """
+    _Magic = b"CASNAP01"
+    _Header = struct.Struct("=8s8sqqqqq")
+    _FunctionFields = 7
+    _FlagStatic = 1
+    _FlagConst = 2
+    _FlagPrototype = 4
+
+    def __init__(self, SnapshotFile:str):
+        """open snapshot file
+
+        Args:
+            SnapshotFile (str): snapshot file
+        """
+        with open(SnapshotFile, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, byteorder, project, string_count, function_count, relation_count, blob_size = self._Header.unpack_from(self._mmap, 0)
+        if magic != self._Magic:
+            raise ValueError(f"{SnapshotFile} is not a call graph snapshot")
+
+        byteorder = byteorder.rstrip(b"\0").decode()
+        if byteorder != sys.byteorder:
+            raise ValueError(f"{SnapshotFile} was made on {byteorder} endian machine")
+
+        view = memoryview(self._mmap)
+        offset = self._Align(self._Header.size)
+        self._StringOffset = view[offset:offset + 8 * (string_count + 1)].cast("q")
+        offset = self._Align(offset + 8 * (string_count + 1))
+        self._StringBlob = view[offset:offset + blob_size]
+        offset = self._Align(offset + blob_size)
+        self._Function = view[offset:offset + 4 * self._FunctionFields * function_count].cast("i")
+        offset = self._Align(offset + 4 * self._FunctionFields * function_count)
+        self._Relation = view[offset:offset + 4 * 2 * relation_count].cast("i")
+
+        self.FunctionCount = function_count
+        self.RelationCount = relation_count
+        self.Project = self.String(project)
+        self._FunctionIds = None
+
+    @staticmethod
+    def _Align(Offset:int) -> int:
+        """align section offset to 8 bytes"""
+        return (Offset + 7) & ~7
+
+    @classmethod
+    def Write(cls, ProjectName:str, SnapshotFile:str) -> tuple:
+        """write snapshot of the project from database
+
+        Args:
+            ProjectName (str): project name
+            SnapshotFile (str): snapshot file
+
+        Returns:
+            tuple: (function count, relation count)
+        """
+        from .models import Function, FunctionRelation
+
+        strings = {}
+        def intern(value:str) -> int:
+            return strings.setdefault(value, len(strings))
+
+        project = intern(ProjectName)
+
+        functions = array("i")
+        func_index = {}
+        for row in Function.objects.filter(project__name = ProjectName).order_by("id").values_list(
+                "id", "name", "return_type", "arguments", "file", "line", "end_line", "static", "const", "is_prototype").iterator():
+            pk, name, return_type, arguments, file, line, end_line, static, const, is_prototype = row
+            func_index[pk] = len(func_index)
+            functions.extend([
+                intern(name),
+                intern(return_type),
+                intern(json.dumps(arguments, ensure_ascii=False)),
+                intern(file),
+                line,
+                end_line if end_line is not None else -1,
+                (cls._FlagStatic if static else 0) | (cls._FlagConst if const else 0) | (cls._FlagPrototype if is_prototype else 0),
+            ])
+
+        relations = array("i")
+        for call_from, call_to in FunctionRelation.objects.filter(project__name = ProjectName).values_list("call_from_id", "call_to_id").distinct().iterator():
+            relations.extend([func_index[call_from] if call_from is not None else -1, func_index[call_to]])
+
+        # make string table
+        blob = bytearray()
+        string_offset = array("q", [0])
+        for value in strings:
+            blob += value.encode()
+            string_offset.append(len(blob))
+
+        with open(SnapshotFile, "wb") as f:
+            def write_section(data:bytes):
+                f.write(data)
+                f.write(b"\0" * (cls._Align(f.tell()) - f.tell()))
+
+            write_section(cls._Header.pack(cls._Magic, sys.byteorder.encode(), project, len(strings), len(func_index), len(relations) // 2, len(blob)))
+            write_section(string_offset.tobytes())
+            write_section(bytes(blob))
+            write_section(functions.tobytes())
+            write_section(relations.tobytes())
+
+        return len(func_index), len(relations) // 2
+
+    def String(self, StringId:int) -> str:
+        """get string from string table
+
+        Args:
+            StringId (int): string id
+
+        Returns:
+            str: string
+        """
+        return str(self._StringBlob[self._StringOffset[StringId]:self._StringOffset[StringId + 1]], "utf-8")
+
+    def FunctionName(self, Index:int) -> str:
+        """get function name
+
+        Args:
+            Index (int): function index
+
+        Returns:
+            str: function name
+        """
+        return self.String(self._Function[Index * self._FunctionFields])
+
+    def ReturnType(self, Index:int) -> str:
+        """get return type of function
+
+        Args:
+            Index (int): function index
+
+        Returns:
+            str: return type
+        """
+        return self.String(self._Function[Index * self._FunctionFields + 1])
+
+    def IsStatic(self, Index:int) -> bool:
+        """check static function
+
+        Args:
+            Index (int): function index
+
+        Returns:
+            bool: True when static function
+        """
+        return bool(self._Function[Index * self._FunctionFields + 6] & self._FlagStatic)
+
+    def Function(self, Index:int) -> SnapshotFunction:
+        """get function record
+
+        Args:
+            Index (int): function index
+
+        Returns:
+            SnapshotFunction: function record
+        """
+        name, return_type, arguments, file, line, end_line, flags = self._Function[Index * self._FunctionFields:(Index + 1) * self._FunctionFields]
+        return SnapshotFunction(
+            id          = Index,
+            name        = self.String(name),
+            return_type = self.String(return_type),
+            arguments   = json.loads(self.String(arguments)),
+            file        = self.String(file),
+            line        = line,
+            end_line    = end_line if end_line >= 0 else None,
+            static      = bool(flags & self._FlagStatic),
+            const       = bool(flags & self._FlagConst),
+            is_prototype= bool(flags & self._FlagPrototype),
+        )
+
+    def FunctionIndexes(self, FunctionName:str) -> list:
+        """get function indexes by name
+
+        Args:
+            FunctionName (str): function name
+
+        Returns:
+            list: function indexes
+        """
+        if self._FunctionIds is None:
+            self._FunctionIds = {}
+            for index in range(self.FunctionCount):
+                self._FunctionIds.setdefault(self.FunctionName(index), []).append(index)
+
+        return self._FunctionIds.get(FunctionName, [])
+
+    def Relations(self):
+        """get relations
+
+        Yields:
+            tuple: (call from function index (-1: function pointer), call to function index)
+        """
+        relation = self._Relation
+        for index in range(0, len(relation), 2):
+            yield relation[index], relation[index + 1]
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import shlex
+from collections import namedtuple
+
+logger = logging.getLogger('Survey')
+
+
+# compile command of a source file
+#  File: absolute source file path
+#  Directory: working directory of the compile
+#  ClangArgs: command-line option to clang (compiler, output and input files are removed)
+CompileCommand = namedtuple("CompileCommand", ["File", "Directory", "ClangArgs"])
+
+# options which take a separated value
+_ValueOptions = {
+    "-I", "-D", "-U", "-include", "-imacros", "-isystem", "-iquote", "-idirafter", "-isysroot", "--sysroot",
+    "-x", "-Xclang", "-target", "-arch", "-MF", "-MT", "-MQ", "-o",
+}
+
+# options whose value is a path relative to the working directory
+_PathOptions = ("-I", "-include", "-imacros", "-isystem", "-iquote", "-idirafter", "-isysroot", "--sysroot")
+
+# options whose value can be joined (joined in the result, so the same flags have the same spelling)
+_JoinableOptions = {"-I", "-D", "-U", "-include", "-imacros", "-isystem", "-iquote", "-idirafter", "-isysroot"}
+
+# options which are not used for parsing
+_DropOptions = {"-c", "-M", "-MM", "-MD", "-MMD", "-MP", "-MG"}
+_DropValueOptions = {"-o", "-MF", "-MT", "-MQ"}
+
+
+def _AbsolutePath(Directory:str, Path:str) -> str:
+    """make path absolute from the working directory"""
+    return os.path.normpath(os.path.join(Directory, Path))
+
+
+def _ClangArgs(Arguments:list, Directory:str, File:str) -> list:
+    """make command-line option to clang from compile command
+
+    The compiler (and wrapper such as ccache), output options and input files
+    are removed, and the paths are made absolute, so the same flags of
+    different directories are grouped.
+
+    Args:
+        Arguments (list): compile command
+        Directory (str): working directory of the compile
+        File (str): absolute source file path
+
+    Returns:
+        list: command-line option to clang
+    """
+    # skip compiler and wrapper
+    index = 0
+    while index < len(Arguments) and not Arguments[index].startswith("-"):
+        index += 1
+
+    args = []
+    while index < len(Arguments):
+        arg = Arguments[index]
+        index += 1
+
+        if arg in _DropOptions:
+            continue
+
+        if arg in _DropValueOptions:
+            index += 1
+            continue
+
+        if arg.startswith("-o") or arg.startswith("-MF"):
+            continue
+
+        # option and separated value
+        if arg in _ValueOptions and index < len(Arguments):
+            value = Arguments[index]
+            index += 1
+            if arg in _PathOptions:
+                value = _AbsolutePath(Directory, value)
+
+            if arg in _JoinableOptions:
+                args.append(arg + value)
+
+            else:
+                args += [arg, value]
+            continue
+
+        # option and joined value
+        if arg.startswith("-"):
+            for option in _PathOptions:
+                if arg.startswith(option) and len(arg) > len(option):
+                    value = arg[len(option):]
+                    if option == "--sysroot" and value.startswith("="):
+                        option, value = option + "=", value[1:]
+
+                    arg = option + _AbsolutePath(Directory, value)
+                    break
+
+            args.append(arg)
+            continue
+
+        # input file
+        if _AbsolutePath(Directory, arg) != File:
+            logger.debug(f"  ignore input file {arg} in compile command of {File}")
+
+    return args
+
+
+def LoadCompileCommands(DatabaseFile:str) -> list:
+    """read compilation database (compile_commands.json)
+
+    Args:
+        DatabaseFile (str): compilation database file
+
+    Returns:
+        list: CompileCommand of each source file (the first command is used for a file compiled twice)
+    """
+    with open(DatabaseFile, "r") as f:
+        entries = json.load(f)
+
+    commands = {}
+    for entry in entries:
+        directory = entry.get("directory", os.path.dirname(os.path.abspath(DatabaseFile)))
+        file = _AbsolutePath(directory, entry["file"])
+        if file in commands:
+            continue
+
+        arguments = entry["arguments"] if "arguments" in entry else shlex.split(entry["command"])
+        commands[file] = CompileCommand(
+            File = file,
+            Directory = directory,
+            ClangArgs = shlex.join(_ClangArgs(arguments, directory, file)),
+        )
+
+    return list(commands.values())
+
+
+def GroupCompileCommands(Commands:list) -> dict:
+    """group source files by their flags
+
+    Args:
+        Commands (list): CompileCommand list
+
+    Returns:
+        dict: {clang args: [source files]} (in order of first appearance)
+    """
+    groups = {}
+    for command in Commands:
+        groups.setdefault(command.ClangArgs, []).append(command.File)
+
+    return groups
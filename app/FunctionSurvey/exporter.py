@@ -0,0 +1,305 @@
+import abc
+import csv
+import datetime
+import itertools
+import json
+import logging
+import sqlite3
+from pathlib import Path
+
+from .models import Function, FunctionRelation, Variable
+
+logger = logging.getLogger('Survey')
+
+
+# exported tables {table name: (model, [(column name, lookup, type)])}
+#  type: "int", "str", "bool", "json", "datetime"
+EXPORT_TABLES = {
+    "function": (Function, [
+        ("id",              "id",               "int"),
+        ("project",         "project__name",    "str"),
+        ("name",            "name",             "str"),
+        ("return_type",     "return_type",      "str"),
+        ("arguments",       "arguments",        "json"),
+        ("file",            "file",             "str"),
+        ("line",            "line",             "int"),
+        ("end_line",        "end_line",         "int"),
+        ("static",          "static",           "bool"),
+        ("const",           "const",            "bool"),
+        ("is_prototype",    "is_prototype",     "bool"),
+        ("include_for",     "include_for",      "bool"),
+        ("include_if",      "include_if",       "bool"),
+        ("include_switch",  "include_switch",   "bool"),
+        ("include_while",   "include_while",    "bool"),
+        ("include_do",      "include_do",       "bool"),
+        ("created",         "created",          "datetime"),
+        ("modified",        "modified",         "datetime"),
+    ]),
+    "function_relation": (FunctionRelation, [
+        ("id",              "id",               "int"),
+        ("project",         "project__name",    "str"),
+        ("call_from_id",    "call_from_id",     "int"),
+        ("call_from",       "call_from__name",  "str"),
+        ("call_to_id",      "call_to_id",       "int"),
+        ("call_to",         "call_to__name",    "str"),
+        ("file",            "file",             "str"),
+        ("line",            "line",             "int"),
+        ("created",         "created",          "datetime"),
+        ("modified",        "modified",         "datetime"),
+    ]),
+    "variable": (Variable, [
+        ("id",              "id",               "int"),
+        ("project",         "project__name",    "str"),
+        ("scope_id",        "scope_id",         "int"),
+        ("scope",           "scope__name",      "str"),
+        ("type",            "type",             "str"),
+        ("name",            "name",             "str"),
+        ("file",            "file",             "str"),
+        ("line",            "line",             "int"),
+        ("static",          "static",           "bool"),
+        ("const",           "const",            "bool"),
+        ("is_pointer",      "is_pointer",       "bool"),
+        ("is_prototype",    "is_prototype",     "bool"),
+        ("created",         "created",          "datetime"),
+        ("modified",        "modified",         "datetime"),
+    ]),
+}
+
+
+class TableWriter(abc.ABC):
+    """base class of table export writer
+
+    The rows of a table are given in chunks between Begin() and End().
+    Close() is called even if the export is aborted in a table.
+    """
+    Suffix = ""
+
+    def __init__(self, SaveAs:Path):
+        """initialize
+
+        Args:
+            SaveAs (Path): save file (without suffix)
+        """
+        self._SaveAs = SaveAs
+
+    def _TablePath(self, Table:str) -> Path:
+        """get export file of the table
+
+        Args:
+            Table (str): table name
+
+        Returns:
+            Path: export file
+        """
+        return self._SaveAs.with_name(f"{self._SaveAs.name}.{Table}{self.Suffix}")
+
+    def Begin(self, Table:str, Columns:list):
+        """begin table
+
+        Args:
+            Table (str): table name
+            Columns (list): [(column name, lookup, type)]
+        """
+        self._Columns = Columns
+
+    @abc.abstractmethod
+    def Write(self, Rows:list):
+        """write rows
+
+        Args:
+            Rows (list): chunk of rows (tuple of column values)
+        """
+
+    def End(self):
+        """end table"""
+        pass
+
+    def Close(self):
+        """close writer"""
+        pass
+
+    def _ToText(self, Row:tuple) -> list:
+        """convert json and datetime values to text
+
+        Args:
+            Row (tuple): row
+
+        Returns:
+            list: converted row
+        """
+        values = list(Row)
+        for index, (name, lookup, type) in enumerate(self._Columns):
+            if values[index] is None:
+                continue
+
+            if type == "json":
+                values[index] = json.dumps(values[index], ensure_ascii=False)
+
+            elif type == "datetime":
+                values[index] = values[index].isoformat()
+
+        return values
+
+
+class TextFileWriter(TableWriter):
+    """base class of text writer (one file per table)"""
+    _File = None
+
+    def End(self):
+        self._File.close()
+
+    def Close(self):
+        # the file of the aborted table
+        if self._File is not None:
+            self._File.close()
+
+
+class CsvWriter(TextFileWriter):
+    """CSV writer (one file per table)"""
+    Suffix = ".csv"
+
+    def Begin(self, Table:str, Columns:list):
+        super().Begin(Table, Columns)
+        self._File = open(self._TablePath(Table), "w", newline="", encoding="utf-8")
+        self._Writer = csv.writer(self._File)
+        self._Writer.writerow([name for name, lookup, type in Columns])
+
+    def Write(self, Rows:list):
+        self._Writer.writerows(self._ToText(row) for row in Rows)
+
+
+class JsonLinesWriter(TextFileWriter):
+    """JSON Lines writer (one file per table)"""
+    Suffix = ".jsonl"
+
+    def Begin(self, Table:str, Columns:list):
+        super().Begin(Table, Columns)
+        self._Names = [name for name, lookup, type in Columns]
+        self._File = open(self._TablePath(Table), "w", encoding="utf-8")
+
+    def Write(self, Rows:list):
+        for row in Rows:
+            self._File.write(json.dumps(dict(zip(self._Names, row)), ensure_ascii=False, default=datetime.datetime.isoformat))
+            self._File.write("\n")
+
+
+class ParquetWriter(TableWriter):
+    """Parquet writer (one file per table, one row group per chunk)
+
+    pyarrow is required.
+    """
+    Suffix = ".parquet"
+    _Writer = None
+
+    def __init__(self, SaveAs:Path):
+        super().__init__(SaveAs)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)") from None
+
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+
+    def Begin(self, Table:str, Columns:list):
+        super().Begin(Table, Columns)
+        types = {
+            "int"       : self._pa.int64(),
+            "str"       : self._pa.string(),
+            "bool"      : self._pa.bool_(),
+            "json"      : self._pa.string(),
+            "datetime"  : self._pa.timestamp("us", tz="UTC"),
+        }
+        self._Schema = self._pa.schema([(name, types[type]) for name, lookup, type in Columns])
+        self._Writer = self._pq.ParquetWriter(self._TablePath(Table), self._Schema)
+
+    def Write(self, Rows:list):
+        columns = list(zip(*[
+            [json.dumps(value, ensure_ascii=False) if type == "json" and value is not None else value for value, (name, lookup, type) in zip(row, self._Columns)]
+            for row in Rows
+        ]))
+        self._Writer.write_batch(self._pa.record_batch([list(column) for column in columns], schema=self._Schema))
+
+    def End(self):
+        self._Writer.close()
+
+    def Close(self):
+        # the file of the aborted table (closing twice is ignored)
+        if self._Writer is not None:
+            self._Writer.close()
+
+
+class SQLiteWriter(TableWriter):
+    """SQLite writer (all tables in one database file)"""
+    Suffix = ".sqlite3"
+
+    def __init__(self, SaveAs:Path):
+        super().__init__(SaveAs)
+        path = SaveAs.with_name(SaveAs.name + self.Suffix)
+        path.unlink(missing_ok=True)
+        self._Connection = sqlite3.connect(path)
+
+    def Begin(self, Table:str, Columns:list):
+        super().Begin(Table, Columns)
+        types = {"int": "INTEGER", "str": "TEXT", "bool": "INTEGER", "json": "TEXT", "datetime": "TEXT"}
+        self._Connection.execute(f"CREATE TABLE {Table} ({', '.join(f'{name} {types[type]}' for name, lookup, type in Columns)})")
+        self._Insert = f"INSERT INTO {Table} VALUES ({', '.join(['?'] * len(Columns))})"
+
+    def Write(self, Rows:list):
+        self._Connection.executemany(self._Insert, (self._ToText(row) for row in Rows))
+
+    def End(self):
+        self._Connection.commit()
+
+    def Close(self):
+        self._Connection.close()
+
+
+WRITERS = {
+    "csv"       : CsvWriter,
+    "jsonl"     : JsonLinesWriter,
+    "parquet"   : ParquetWriter,
+    "sqlite"    : SQLiteWriter,
+}
+
+
+def ExportTables(ProjectName:str, Format:str, SaveAs:str, ChunkSize:int=5000) -> dict:
+    """export tables of the project
+
+    The records are read from database in chunks and written chunk by chunk,
+    so the whole table is never held in memory.
+
+    Args:
+        ProjectName (str): project name
+        Format (str): export format (csv, jsonl, parquet, sqlite)
+        SaveAs (str): save file (the suffix is replaced by the table name and format)
+        ChunkSize (int, optional): rows per chunk (Defaults to 5000).
+
+    Returns:
+        dict: {table name: exported row count}
+    """
+    writer = WRITERS[Format.lower()](Path(SaveAs).with_suffix(""))
+
+    counts = {}
+    try:
+        for table, (model, columns) in EXPORT_TABLES.items():
+            rows = model.objects.filter(project__name = ProjectName).order_by("id").values_list(
+                *[lookup for name, lookup, type in columns]).iterator(chunk_size = ChunkSize)
+
+            writer.Begin(table, columns)
+            counts[table] = 0
+            while True:
+                chunk = list(itertools.islice(rows, ChunkSize))
+                if len(chunk) == 0:
+                    break
+
+                writer.Write(chunk)
+                counts[table] += len(chunk)
+
+            writer.End()
+
+    finally:
+        writer.Close()
+
+    return counts
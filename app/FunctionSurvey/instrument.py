@@ -0,0 +1,281 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.db import connections
+
+logger = logging.getLogger('Survey')
+
+
+class Instrument():
+    """per-phase instrumentation of a command run
+
+    A phase is a named timer: the seconds, the number of times it was entered and
+    the database queries issued in it are accumulated under the name. The phases
+    may be nested (the seconds are inclusive, and a query is counted in the innermost
+    phase only). Counters are named integers (e.g. functions, relations, AST nodes).
+    The run can also be captured by cProfile and tracemalloc.
+
+    The report of a run is a JSON object, so the reports of many runs (e.g. one
+    funcsurvey per file) can be aggregated by MergeReports.
+    """
+    _TopAllocations = 10
+
+    def __init__(self, Command:str, ReportFile:str=None, ProfileFile:str=None, TraceMemory:bool=False):
+        """initialize
+
+        Args:
+            Command (str): command name
+            ReportFile (str, optional): JSON report file, or directory to write a report
+                named by command, time and pid (Defaults to None: no report).
+            ProfileFile (str, optional): cProfile stats file (Defaults to None: not profiled).
+            TraceMemory (bool, optional): trace memory allocations by tracemalloc (Defaults to False).
+        """
+        self.Command = Command
+        self._ReportFile = ReportFile
+        self._ProfileFile = ProfileFile
+        self._TraceMemory = TraceMemory
+
+        # {phase name: [seconds, calls, queries]}
+        self._Phases = {}
+        self._Counters = {}
+        self._Stack = []
+        self._Queries = 0
+        self._Profiler = None
+        self._Tracing = False
+        self._Memory = None
+        self._Hooks = None
+        self._Started = None
+        self._Start = None
+        self._Elapsed = 0.0
+
+    @classmethod
+    def FromOptions(cls, Command:str, Options:dict) -> "Instrument":
+        """make instrument from command options (see AddArguments)"""
+        return cls(
+            Command,
+            ReportFile = Options.get("report"),
+            ProfileFile = Options.get("cprofile"),
+            TraceMemory = Options.get("trace_memory", False))
+
+    @staticmethod
+    def AddArguments(parser):
+        """regist instrumentation arguments of command
+
+        Args:
+            parser (_type_): argument parser
+        """
+        parser.add_argument('--report', nargs='?', default=None, type=str, help="write JSON report of phase timings and counters to the file (or directory)")
+        parser.add_argument('--cprofile', nargs='?', default=None, type=str, help="write cProfile stats of the run to the file")
+        parser.add_argument('--trace-memory', action='store_true', help="trace memory allocations by tracemalloc (peak and top allocations in the report)")
+
+    def Start(self):
+        """start the run (timer, query counter, cProfile and tracemalloc)"""
+        self._Started = datetime.datetime.now()
+        self._Start = time.perf_counter()
+
+        # count the queries of every database connection
+        self._Hooks = contextlib.ExitStack()
+        for connection in connections.all():
+            self._Hooks.enter_context(connection.execute_wrapper(self._CountQuery))
+
+        if self._TraceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._Tracing = True
+
+        if self._ProfileFile:
+            self._Profiler = cProfile.Profile()
+            self._Profiler.enable()
+
+    def Stop(self):
+        """stop the run"""
+        if self._Start is None:
+            return
+
+        if self._Profiler is not None:
+            self._Profiler.disable()
+            self._Profiler.dump_stats(self._ProfileFile)
+            self._Profiler = None
+
+        if self._Tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:self._TopAllocations]
+            tracemalloc.stop()
+            self._Tracing = False
+            self._Memory = {
+                "current"   : current,
+                "peak"      : peak,
+                "top"       : [{"location": str(stat.traceback[0]), "size": stat.size, "count": stat.count} for stat in top],
+            }
+
+        self._Hooks.close()
+        self._Elapsed = time.perf_counter() - self._Start
+        self._Start = None
+
+    def _CountQuery(self, execute, sql, params, many, context):
+        """database execute wrapper"""
+        self._Queries += 1
+        if self._Stack:
+            self._Stack[-1][2] += 1
+
+        return execute(sql, params, many, context)
+
+    @contextlib.contextmanager
+    def Phase(self, Name:str):
+        """time a phase
+
+        Args:
+            Name (str): phase name
+        """
+        phase = self._Phases.setdefault(Name, [0.0, 0, 0])
+        self._Stack.append(phase)
+        start = time.perf_counter()
+        try:
+            yield phase
+
+        finally:
+            phase[0] += time.perf_counter() - start
+            phase[1] += 1
+            self._Stack.pop()
+
+    def AddPhase(self, Name:str, Seconds:float, Calls:int=1):
+        """add the time of a phase measured elsewhere (e.g. in a worker process)
+
+        Args:
+            Name (str): phase name
+            Seconds (float): seconds
+            Calls (int, optional): times of the phase (Defaults to 1).
+        """
+        phase = self._Phases.setdefault(Name, [0.0, 0, 0])
+        phase[0] += Seconds
+        phase[1] += Calls
+
+    def Count(self, Name:str, Value:int=1):
+        """add to a counter
+
+        Args:
+            Name (str): counter name
+            Value (int, optional): value added (Defaults to 1).
+        """
+        self._Counters[Name] = self._Counters.get(Name, 0) + Value
+
+    def Report(self) -> dict:
+        """make report of the run
+
+        Returns:
+            dict: report (JSON value)
+        """
+        report = {
+            "command"   : self.Command,
+            "started"   : self._Started.isoformat() if self._Started is not None else None,
+            "pid"       : os.getpid(),
+            "elapsed"   : self._Elapsed if self._Start is None else time.perf_counter() - self._Start,
+            "queries"   : self._Queries,
+            "phases"    : {name: {"seconds": seconds, "calls": calls, "queries": queries} for name, (seconds, calls, queries) in self._Phases.items()},
+            "counters"  : dict(self._Counters),
+        }
+
+        if self._Memory is not None:
+            report["memory"] = self._Memory
+
+        if self._ProfileFile:
+            report["cprofile"] = str(self._ProfileFile)
+
+        return report
+
+    def Log(self):
+        """log the phases and counters"""
+        for name, (seconds, calls, queries) in self._Phases.items():
+            logger.debug(f" phase {name}: {seconds:.3f} s, {calls} time(s), {queries} quer{'y' if queries == 1 else 'ies'}")
+
+        for name, value in self._Counters.items():
+            logger.debug(f" count {name}: {value}")
+
+        logger.debug(f" {self._Queries} database quer{'y' if self._Queries == 1 else 'ies'}")
+
+    def Save(self) -> Path:
+        """write report to the report file
+
+        Returns:
+            Path: report file (None: no report file)
+        """
+        if not self._ReportFile:
+            return None
+
+        path = Path(self._ReportFile)
+        if path.is_dir() or self._ReportFile.endswith(os.sep):
+            path.mkdir(parents=True, exist_ok=True)
+            started = self._Started or datetime.datetime.now()
+            path = path / f"{self.Command}-{started.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json"
+
+        with open(path, "w") as f:
+            json.dump(self.Report(), f, ensure_ascii=False, indent=1)
+
+        logger.info(f" report: {path}")
+        return path
+
+    def Finish(self):
+        """stop the run, log the phases and write the report
+
+        An error of the report is logged, so it doesn't hide the result of the command.
+        """
+        try:
+            self.Stop()
+            self.Log()
+            self.Save()
+
+        except Exception as e:
+            logger.error(f"report failed {e}", exc_info=True)
+
+
+def MergeReports(Reports:list) -> dict:
+    """aggregate reports of many runs
+
+    The elapsed time, queries, phases and counters are summed per command.
+
+    Args:
+        Reports (list): reports (Instrument.Report)
+
+    Returns:
+        dict: {command: {"runs", "elapsed", "queries", "phases", "counters", "peak"}}
+    """
+    merged = {}
+    for report in Reports:
+        total = merged.setdefault(report["command"], {"runs": 0, "elapsed": 0.0, "queries": 0, "phases": {}, "counters": {}, "peak": 0})
+        total["runs"] += 1
+        total["elapsed"] += report["elapsed"]
+        total["queries"] += report["queries"]
+
+        for name, phase in report["phases"].items():
+            summed = total["phases"].setdefault(name, {"seconds": 0.0, "calls": 0, "queries": 0})
+            for key in summed:
+                summed[key] += phase[key]
+
+        for name, value in report["counters"].items():
+            total["counters"][name] = total["counters"].get(name, 0) + value
+
+        if "memory" in report:
+            total["peak"] = max(total["peak"], report["memory"]["peak"])
+
+    return merged
+
+
+if __name__ == "__main__":
+    # aggregate report files (or directories of report files)
+    #  python -m FunctionSurvey.instrument REPORT [REPORT ...]
+    reports = []
+    for arg in sys.argv[1:]:
+        paths = sorted(Path(arg).glob("*.json")) if Path(arg).is_dir() else [Path(arg)]
+        for path in paths:
+            with open(path, "r") as f:
+                reports.append(json.load(f))
+
+    json.dump(MergeReports(reports), sys.stdout, ensure_ascii=False, indent=1)
+    print()
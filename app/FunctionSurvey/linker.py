@@ -0,0 +1,220 @@
+import logging
+import sys
+from collections import namedtuple
+
+from .survey import FunctionDecl, VarDecl, SurveySummary
+
+logger = logging.getLogger('Survey')
+
+
+# records of a translation unit gathered by SymbolTable.Add
+#  Functions: {function key: FunctionDecl (path adjusted, without call sites)}
+#  Calls: [(caller key, callee name, line)]
+#  Pointers: (function name, file of the pointer variable) referred by function pointers
+#  Includes: included headers (path adjusted)
+#  Variables: [(key of scope function or None: global, VarDecl (path adjusted))]
+TranslationUnitSymbols = namedtuple("TranslationUnitSymbols", ["Functions", "Calls", "Pointers", "Includes", "Variables"])
+
+# result of SymbolTable.Link
+#  Functions: {function key: FunctionDecl} to write (definitions and referred declarations)
+#  Calls: [(caller key, callee key, line, file of caller)]
+#  Pointers: keys of the functions referred by function pointers
+#  Unresolved: number of call sites whose callee is not declared in any file
+#  Variables: [(key of scope function or None: global, VarDecl)] to write
+LinkResult = namedtuple("LinkResult", ["Functions", "Calls", "Pointers", "Unresolved", "Variables"])
+
+
+def FunctionKey(Name:str, Static:bool, File:str) -> tuple:
+    """get unique key of function (same as the unique constraints of Function)
+
+    Args:
+        Name (str): function name
+        Static (bool): static function
+        File (str): file path
+
+    Returns:
+        tuple: (function name, file path of static function or "")
+    """
+    return (Name, str(File) if Static else "")
+
+
+def IsVariableOf(Var:VarDecl, Func:FunctionDecl) -> bool:
+    """check that the variable is an argument or a local variable of the function definition
+
+    The arguments of a prototype have the same scope name as the definition, so the
+    variable must be in the extent of the definition.
+
+    Args:
+        Var (VarDecl): variable (path adjusted)
+        Func (FunctionDecl): function of the scope name (path adjusted) or None
+
+    Returns:
+        bool: True when the variable is in the function definition
+    """
+    return Func is not None and Func.IsPrototype == False and Var.File == Func.File and Func.Line <= Var.Line <= Func.EndLine
+
+
+class SymbolTable():
+    """global symbol table of the translation units of a survey run
+
+    The functions and call sites of every translation unit are gathered first
+    (Add), and the calls are resolved at once after all files are surveyed (Link),
+    so a call to a function defined in another file is linked even if no prototype
+    was included. A static function is linked only from its own translation unit
+    (the file which defines it, or a file including the header which defines it).
+    """
+
+    def __init__(self):
+        """initialize"""
+        # {source file: TranslationUnitSymbols}
+        self._Units = {}
+
+    def __len__(self):
+        return len(self._Units)
+
+    def Add(self, SourceFile:str, Records, AdjustPath) -> SurveySummary:
+        """gather the records of a translation unit
+
+        The unit is added after the stream is consumed to the end, so a failed
+        survey (SurveyError) adds nothing.
+
+        Args:
+            SourceFile (str): source file
+            Records (iterable): FunctionDecl, VarDecl and SurveySummary of the source file
+            AdjustPath (callable): convert file path to the path written to database
+
+        Returns:
+            SurveySummary: summary of the survey
+        """
+        functions = {}
+        calls = []
+        pointers = set()
+        variables = []
+        summary = None
+        for record in Records:
+            if isinstance(record, FunctionDecl):
+                # the record may be cached, so it is not changed
+                func = record.Copy(File = sys.intern(AdjustPath(record.File)))
+                func.ClearCallFunctions()
+
+                # a redeclaration doesn't replace the definition
+                key = FunctionKey(func.Name, func.IsStatic, func.File)
+                former = functions.get(key)
+                if former is None or former.IsPrototype or not func.IsPrototype:
+                    functions[key] = func
+
+                if func.IsPrototype == False:
+                    calls.extend((key, name, line) for name, line in zip(record.CallNames, record.CallLines))
+
+            elif isinstance(record, VarDecl):
+                file = sys.intern(AdjustPath(record.File))
+                if record.FunctionPointer:
+                    pointers.update((name, file) for name in record.FunctionPointer)
+
+                variables.append(record.Copy(File = file))
+
+            else:
+                summary = record
+
+        includes = set(sys.intern(AdjustPath(include)) for include in summary.Includes)
+
+        # scope of the variables (the arguments of prototypes are not written)
+        definitions = {func.Name: key for key, func in functions.items() if func.IsPrototype == False}
+        scoped = []
+        for var in variables:
+            if var.Scope is None:
+                scoped.append((None, var))
+
+            elif var.Scope in definitions and IsVariableOf(var, functions[definitions[var.Scope]]):
+                scoped.append((definitions[var.Scope], var))
+
+        self._Units[SourceFile] = TranslationUnitSymbols(functions, calls, pointers, includes, scoped)
+        return summary
+
+    def Link(self, SourceFiles:list=None) -> LinkResult:
+        """resolve the calls and function pointers of all translation units
+
+        A global function is the last definition in SourceFiles order, or the first
+        declaration if it is not defined. A call is resolved to a static function of
+        the translation unit, a static function of an included header, and a global
+        function in this order. The variables of a file are taken from the last unit
+        which surveyed the file (a header may be surveyed by many units).
+
+        Args:
+            SourceFiles (list, optional): order of the translation units (Defaults to None: the order added)
+
+        Returns:
+            LinkResult: functions, calls and function pointers to write
+        """
+        units = [self._Units[file] for file in (SourceFiles or self._Units) if file in self._Units]
+
+        # global and static symbols {name: key}, {name: {file: key}}
+        functions = {}
+        globals_ = {}
+        statics = {}
+        for unit in units:
+            for key, func in unit.Functions.items():
+                former = functions.get(key)
+                if former is not None:
+                    # a declaration doesn't replace the former declaration or definition
+                    if func.IsPrototype:
+                        continue
+
+                    # the same header may be extracted by many units
+                    if former.IsPrototype == False and (former.File, former.Line) != (func.File, func.Line):
+                        logger.warning(f"  {func.Name} is defined in {former.File} and {func.File}")
+
+                functions[key] = func
+                if func.IsStatic:
+                    statics.setdefault(func.Name, {})[func.File] = key
+                else:
+                    globals_[func.Name] = key
+
+        def resolve(unit:TranslationUnitSymbols, file:str, name:str) -> tuple:
+            candidates = statics.get(name)
+            if candidates is not None:
+                if file in candidates:
+                    return candidates[file]
+
+                for header, key in candidates.items():
+                    if header in unit.Includes:
+                        return key
+
+            return globals_.get(name)
+
+        written = {}
+        calls = []
+        pointers = {}
+        unresolved = 0
+        for unit in units:
+            for key, func in unit.Functions.items():
+                if func.IsPrototype == False:
+                    written[key] = functions[key]
+
+            for caller, name, line in unit.Calls:
+                file = unit.Functions[caller].File
+                callee = resolve(unit, file, name)
+                if callee is None:
+                    logger.warning(f"  skip {caller[0]} -> {name}")
+                    unresolved += 1
+                    continue
+
+                written[callee] = functions[callee]
+                calls.append((caller, callee, line, file))
+
+            for name, file in unit.Pointers:
+                key = resolve(unit, file, name)
+                if key is not None:
+                    written[key] = functions[key]
+                    pointers[key] = None
+
+        # variables {file: [(scope key, VarDecl)]}
+        variables = {}
+        for unit in units:
+            files = {}
+            for scope, var in unit.Variables:
+                files.setdefault(var.File, []).append((scope, var))
+
+            variables.update(files)
+
+        return LinkResult(written, calls, list(pointers), unresolved, [variable for file in variables.values() for variable in file])
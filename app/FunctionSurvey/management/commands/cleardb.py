@@ -1,5 +1,8 @@
 from django.core.management.base import BaseCommand
-from ...models import Project, Function, FunctionRelation, Variable
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from ...models import Project, Function, FunctionRelation, Variable, SourceFile
+from ...instrument import Instrument
 
 import logging
 import datetime
@@ -8,7 +11,7 @@ logger = logging.getLogger('Survey')
 
 
 class Command(BaseCommand):
-    """exportdb command class
+    """cleardb command class
 
     Args:
         BaseCommand (_type_): Django base command class
@@ -16,21 +19,97 @@ class Command(BaseCommand):
 
     help = "DBクリア"
 
+    # the tables referring the others first
+    _Tables = [FunctionRelation, Variable, SourceFile, Function, Project]
+
+    def _DeleteChunks(self, Model, Column:str, Values:list, ChunkSize:int) -> int:
+        """delete records by DELETE statements in chunks of primary keys
+
+        The records are deleted by SQL without the cascade collector of Django (only
+        the primary keys of a chunk are loaded), so the referring records must be
+        deleted before. All chunks of the table are deleted in one transaction.
+
+        Args:
+            Model (_type_): model class
+            Column (str): column to select the records (e.g. project_id)
+            Values (list): values of the column
+            ChunkSize (int): records per DELETE
+
+        Returns:
+            int: number of deleted records
+        """
+        quote = connection.ops.quote_name
+        sql = f"DELETE FROM {quote(Model._meta.db_table)} WHERE {quote(Model._meta.pk.column)} IN"
+        records = Model.objects.filter(**{f"{Column}__in": Values}).values_list("pk", flat = True)
+
+        deleted = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            while True:
+                chunk = list(records[:ChunkSize])
+                if len(chunk) == 0:
+                    return deleted
+
+                cursor.execute(f"{sql} ({', '.join(['%s'] * len(chunk))})", chunk)
+                deleted += cursor.rowcount
+
+    def _ClearProject(self, Instrument:Instrument, Name:str, ChunkSize:int):
+        """delete the records of a project
+
+        Each table is deleted in its own transaction, from the tables referring the
+        others, so an interrupted clear is completed by running it again.
+
+        Args:
+            Instrument (Instrument): instrument of the command
+            Name (str): project name
+            ChunkSize (int): records per DELETE
+        """
+        projects = list(Project.objects.filter(name = Name).values_list("pk", flat = True))
+        if len(projects) == 0:
+            logger.warning(f" project {Name} is not found")
+            return
+
+        for table in self._Tables:
+            name = table._meta.model_name
+            with Instrument.Phase(f"delete_{name}"):
+                if table is Project:
+                    deleted = self._DeleteChunks(Project, "id", projects, ChunkSize)
+                else:
+                    deleted = self._DeleteChunks(table, "project_id", projects, ChunkSize)
+
+            Instrument.Count(f"{name}_rows", deleted)
+            logger.info(f" {table._meta.db_table}: {deleted} record(s)")
+
+    def _ClearAll(self, Instrument:Instrument):
+        """truncate all tables (DELETE on the backends without TRUNCATE)
+
+        Args:
+            Instrument (Instrument): instrument of the command
+        """
+        tables = [table._meta.db_table for table in self._Tables]
+        with Instrument.Phase("truncate"):
+            connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables, reset_sequences = True))
+
+        logger.info(f" {', '.join(tables)}: truncated")
+
     def handle(self, *args, **options):
         """command entry point
 
         """        
+        instrument = Instrument.FromOptions("cleardb", options)
         try:
             start_time = datetime.datetime.now()
-
-            delete_table = [FunctionRelation, Variable, Function, Project]
+            instrument.Start()
 
             logger.info("Database Clear Start")
             logger.info(f" {start_time.strftime('%Y/%m/%d %H:%M:%S')}")
+            logger.info(f" Project    : {options['project']}")
+
+            # delete the records of the project, or all records
+            if options["project"] is not None:
+                self._ClearProject(instrument, options["project"], options["chunk_size"])
 
-            # delete all records
-            for table in delete_table:
-                table.objects.all().delete()
+            else:
+                self._ClearAll(instrument)
 
 
             
@@ -39,5 +118,16 @@ class Command(BaseCommand):
 
 
         finally:
+            instrument.Finish()
             logger.debug(f" elapsed time {(datetime.datetime.now() - start_time).total_seconds()}")
 
+    def add_arguments(self, parser):
+        """regist command arguments
+
+        Args:
+            parser (_type_): argument parser
+        """        
+
+        parser.add_argument('--project', nargs='?', default=None, type=str, help="clear only the records of the project (default: truncate all tables)")
+        parser.add_argument('--chunk-size', nargs='?', default=10000, type=int, help="records per DELETE with --project")
+        Instrument.AddArguments(parser)
@@ -1,16 +1,21 @@
 from django.core.management.base import BaseCommand
+from django.db.models import Count, Min, QuerySet
 from ...models import Project, Function, FunctionRelation
+from ...exporter import WRITERS, ExportTables
+from ...instrument import Instrument
 
 import openpyxl
 from openpyxl import load_workbook
-from openpyxl.styles import Alignment
-from openpyxl.worksheet.table import Table, TableStyleInfo
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import NamedStyle
+from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
 from openpyxl.utils import get_column_letter
 
 import logging
 import datetime
 import pathlib
 import copy
+import warnings
 
 logger = logging.getLogger('Survey')
 
@@ -23,197 +28,264 @@ class Command(BaseCommand):
     """    
     help = "Export Database"
     _template = "template_exportdb.xlsx"
+    _DefaultStyle = "template_default"
+    _ChunkSize = 2000
+    _FunctionListHeader = ["No.", "プロジェクト", "const", "static", "戻り値型", "関数名", "引数", "for", "if", "switch", "while", "do", "ファイル", "先頭行番号", "末尾行番号"]
+    _FunctionRelationListHeader = ["No.", "プロジェクト", "const\n(呼び出し元)", "static\n(呼び出し元)", "戻り値\n(呼び出し元)", "関数名\n(呼び出し元)", "const\n(呼び出し先)", "static\n(呼び出し先)",  "戻り値\n(呼び出し先)","関数名\n(呼び出し先)", "ファイル", "行番号"]
 
-    def _MakeFunctionList(self, ProjectName:str, ws:openpyxl.worksheet.worksheet.Worksheet):
-        """Make function list
+    def _Summary(self, Records:QuerySet, ProjectName:str, CountName:str) -> dict:
+        """Make summary of list by one aggregate query
 
         Args:
+            Records (QuerySet): exported records
             ProjectName (str): Project name
-            ws (openpyxl.worksheet.worksheet.Worksheet): Excel worksheet
+            CountName (str): placeholder of record count
 
         Returns:
-            _type_: Registered function count
-        """        
-        Functions = Function.objects.filter(project__name=ProjectName)
+            dict: summary placeholders (None: no record)
+        """
+        aggregate = Records.aggregate(count=Count("id"), modified=Min("modified"))
 
-        if Functions.count() == 0:
-            return 0
+        if aggregate["count"] == 0:
+            return None
         
-        # make summary
-        summary = {
+        return {
             "{作成日時}"      : datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S'),
-            "{解析完了日時}"  : Functions.order_by("modified").first().modified.astimezone().strftime('%Y/%m/%d %H:%M:%S'),
+            "{解析完了日時}"  : aggregate["modified"].astimezone().strftime('%Y/%m/%d %H:%M:%S'),
             "{プロジェクト}"  : ProjectName,
-            "{関数数}"        : Functions.count(),
+            CountName         : aggregate["count"],
             }
 
+    def _FunctionSummary(self, ProjectName:str) -> dict:
+        """Make summary of function list
 
-        # make function list
-        no = 1
-        func_list = [["No.", "プロジェクト", "const", "static", "戻り値型", "関数名", "引数", "for", "if", "switch", "while", "do", "ファイル", "先頭行番号", "末尾行番号"],]
-        for obj in Functions:
-            args = "\n".join([f"{ag['Type']} {ag['Name']}" for ag in obj.arguments])
-            func_list.append([
-                no,                                     # No.
-                obj.project.name,                       # プロジェクト
-                "✓" if obj.const   else "",            # (呼び出し元) const
-                "✓" if obj.static  else "",            # (呼び出し元) const
-                obj.return_type,                        # 戻り値型
-                obj.name,                               # 関数名
-                args,                                   # 引数
-                "✓" if obj.include_for     else "",    # for
-                "✓" if obj.include_if      else "",    # if
-                "✓" if obj.include_switch  else "",    # switch
-                "✓" if obj.include_while   else "",    # while
-                "✓" if obj.include_do      else "",    # do
-                obj.file,                               # ファイル
-                obj.line,                               # 先頭行番号
-                obj.end_line,                           # 末尾行番号
-                ])
-            
-            no += 1
-
-        # scan template and set data
-        for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=1, max_col=ws.max_column):
-            for cell in row:
-                # search and replace summary
-                if cell.value is not None and cell.value in summary.keys():
-                    cell.value = summary[cell.value]
-                
-                # get base row of function list
-                if cell.value is not None and cell.value == "{関数一覧}":
-                    func_list_row = cell.row
-                    func_list_col = cell.column
-
-        # write header
-        for index, header in enumerate(func_list[0]):
-            ws.cell(row=func_list_row, column=func_list_col + index).value = header
-
-        # write function list
-        for row_index, row in enumerate(func_list[1:], start=1):
-            for col_index, col in enumerate(row):
-                # get cells
-                currentcell = ws.cell(row=func_list_row + row_index, column=func_list_col + col_index)
-                belowcell = ws.cell(row=func_list_row + row_index + 1, column=func_list_col + col_index)
-
-                # copy format to below cell
-                belowcell.font = copy.copy(currentcell.font)
-                belowcell.number_format = copy.copy(currentcell.number_format)
-                belowcell.alignment = copy.copy(currentcell.alignment)        
+        Args:
+            ProjectName (str): Project name
 
-                # set item
-                currentcell.value = col
+        Returns:
+            dict: summary placeholders (None: no function)
+        """
+        return self._Summary(Function.objects.filter(project__name=ProjectName), ProjectName, "{関数数}")
 
-        # get all records
-        func_table = Table(displayName='関数一覧',
-                           ref=f"{get_column_letter(func_list_col)}{func_list_row}:{get_column_letter(func_list_col + len(func_list[0]) - 1)}{func_list_row + len(func_list) - 1}")
-        func_table.tableStyleInfo = TableStyleInfo(name='TableStyleMedium8', showRowStripes=True)
-        ws.add_table(func_table)
+    def _FunctionRows(self, ProjectName:str):
+        """Make function list rows
 
-        return Functions.count()
+        The needed columns are read by one query.
 
+        Args:
+            ProjectName (str): Project name
 
-    def _MakeFunctionRelationList(self, ProjectName:str, ws:openpyxl.worksheet.worksheet.Worksheet):
-        """Make function relation list
+        Yields:
+            list: function list row
+        """
+        Functions = Function.objects.filter(project__name=ProjectName).order_by("id").values_list(
+            "const", "static", "return_type", "name", "arguments",
+            "include_for", "include_if", "include_switch", "include_while", "include_do",
+            "file", "line", "end_line")
+
+        for no, (const, static, return_type, name, arguments, include_for, include_if, include_switch, include_while, include_do, file, line, end_line) in enumerate(Functions.iterator(chunk_size=self._ChunkSize), start=1):
+            args = "\n".join([f"{ag['Type']} {ag['Name']}" for ag in arguments])
+            yield [
+                no,                                     # No.
+                ProjectName,                            # プロジェクト
+                "✓" if const   else "",                # (呼び出し元) const
+                "✓" if static  else "",                # (呼び出し元) const
+                return_type,                            # 戻り値型
+                name,                                   # 関数名
+                args,                                   # 引数
+                "✓" if include_for     else "",        # for
+                "✓" if include_if      else "",        # if
+                "✓" if include_switch  else "",        # switch
+                "✓" if include_while   else "",        # while
+                "✓" if include_do      else "",        # do
+                file,                                   # ファイル
+                line,                                   # 先頭行番号
+                end_line,                               # 末尾行番号
+                ]
+
+    def _FunctionRelationSummary(self, ProjectName:str) -> dict:
+        """Make summary of function relation list
 
         Args:
             ProjectName (str): Project name
-            ws (openpyxl.worksheet.worksheet.Worksheet): Excel worksheet
 
         Returns:
-            _type_: Registered function relation count.
-        """        
-        FunctionRelations = FunctionRelation.objects.filter(project__name=ProjectName)
+            dict: summary placeholders (None: no function relation)
+        """
+        return self._Summary(FunctionRelation.objects.filter(project__name=ProjectName), ProjectName, "{呼び出し数}")
 
-        if FunctionRelations.count() == 0:
-            return 0
-        
-        # make summary
-        summary = {
-            "{作成日時}"      : datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S'),
-            "{解析完了日時}"  : FunctionRelations.order_by("modified").first().modified.astimezone().strftime('%Y/%m/%d %H:%M:%S'),
-            "{プロジェクト}"  : ProjectName,
-            "{呼び出し数}"      : FunctionRelations.count(),
-            }
+    def _FunctionRelationRows(self, ProjectName:str):
+        """Make function relation list rows
+
+        The caller and callee columns are joined in one query.
 
+        Args:
+            ProjectName (str): Project name
 
-        # make function list
-        no = 1
-        func_list = [["No.", "プロジェクト", "const\n(呼び出し元)", "static\n(呼び出し元)", "戻り値\n(呼び出し元)", "関数名\n(呼び出し元)", "const\n(呼び出し先)", "static\n(呼び出し先)",  "戻り値\n(呼び出し先)","関数名\n(呼び出し先)", "ファイル", "行番号"],]
-        for obj in FunctionRelations:
-            func_list.append([
+        Yields:
+            list: function relation list row
+        """
+        FunctionRelations = FunctionRelation.objects.filter(project__name=ProjectName).order_by("id").values_list(
+            "call_from__const", "call_from__static", "call_from__return_type", "call_from__name",
+            "call_to__const", "call_to__static", "call_to__return_type", "call_to__name",
+            "file", "line")
+
+        for no, row in enumerate(FunctionRelations.iterator(chunk_size=self._ChunkSize), start=1):
+            # the caller of function pointer is not registered (None)
+            from_const, from_static, from_return_type, from_name, to_const, to_static, to_return_type, to_name, file, line = row
+            yield [
                 no,                                         # No.
-                obj.project.name,                           # プロジェクト
-                "✓" if obj.call_from.const else "",     # (呼び出し元) const
-                "✓" if obj.call_from.static else "",    # (呼び出し元) static
-                obj.call_from.return_type,               # (呼び出し元) 戻り値型
-                obj.call_from.name,                      # (呼び出し元) 関数名
-                "✓" if obj.call_to.const else "",       # (呼び出し先) const
-                "✓" if obj.call_to.static else "",      # (呼び出し先) static
-                obj.call_to.return_type,                # (呼び出し先) 戻り値型
-                obj.call_to.name,                        # (呼び出し先) 関数名
-                obj.file,                                   # ファイル
-                obj.line,                                   # 行番号
-                ])
-            
-            no += 1
+                ProjectName,                                # プロジェクト
+                "✓" if from_const else "",              # (呼び出し元) const
+                "✓" if from_static else "",             # (呼び出し元) static
+                from_return_type or "",                     # (呼び出し元) 戻り値型
+                from_name or "",                            # (呼び出し元) 関数名
+                "✓" if to_const else "",                # (呼び出し先) const
+                "✓" if to_static else "",               # (呼び出し先) static
+                to_return_type,                             # (呼び出し先) 戻り値型
+                to_name,                                    # (呼び出し先) 関数名
+                file,                                       # ファイル
+                line,                                       # 行番号
+                ]
+
+    def _CopyStyle(self, Source:Cell, Destination:Cell):
+        """copy cell style
 
-        # scan template and set summary data
-        for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=1, max_col=ws.max_column):
-            for cell in row:
-                # search and replace summary
-                if cell.value is not None and cell.value in summary.keys():
-                    cell.value = summary[cell.value]
-                
-                # get base row of function list
-                if cell.value is not None and cell.value == "{呼び出し一覧}":
-                    func_list_row = cell.row
-                    func_list_col = cell.column
+        Args:
+            Source (Cell): template cell
+            Destination (Cell): written cell
+        """
+        if Source.has_style:
+            Destination.font = copy.copy(Source.font)
+            Destination.border = copy.copy(Source.border)
+            Destination.fill = copy.copy(Source.fill)
+            Destination.number_format = Source.number_format
+            Destination.alignment = copy.copy(Source.alignment)
+            Destination.protection = copy.copy(Source.protection)
 
-        # write header
-        for index, header in enumerate(func_list[0]):
-            ws.cell(row=func_list_row, column=func_list_col + index).value = header
+        else:
+            Destination.style = self._DefaultStyle
 
-        # write function relation list
-        for row_index, row in enumerate(func_list[1:], start=1):
-            for col_index, col in enumerate(row):
-                # get cells
-                currentcell = ws.cell(row=func_list_row + row_index, column=func_list_col + col_index)
-                belowcell = ws.cell(row=func_list_row + row_index + 1, column=func_list_col + col_index)
+    def _WriteSheet(self, wb:openpyxl.Workbook, Template:openpyxl.worksheet.worksheet.Worksheet, Summary:dict, ListName:str, Header:list, Rows) -> int:
+        """write list sheet in write-only workbook
 
-                # copy format to below cell
-                belowcell.font = copy.copy(currentcell.font)
-                belowcell.number_format = copy.copy(currentcell.number_format)
-                belowcell.alignment = copy.copy(currentcell.alignment)        
+        The rows above the list placeholder are copied from the template with the summary
+        placeholders replaced, and the list rows are streamed with shared named styles.
 
-                # set item
-                currentcell.value = col
+        Args:
+            wb (openpyxl.Workbook): write-only workbook
+            Template (openpyxl.worksheet.worksheet.Worksheet): template worksheet
+            Summary (dict): summary placeholders (None: no record, the template is copied as is)
+            ListName (str): list placeholder name (and table name)
+            Header (list): list header
+            Rows (_type_): list rows
 
-        # get all records
-        func_table = Table(displayName='呼び出し一覧',
-                           ref=f"{get_column_letter(func_list_col)}{func_list_row}:{get_column_letter(func_list_col + len(func_list[0]) - 1)}{func_list_row + len(func_list) - 1}")
-        func_table.tableStyleInfo = TableStyleInfo(name='TableStyleMedium8', showRowStripes=True)
-        ws.add_table(func_table)
+        Returns:
+            int: written row count
+        """
+        ws = wb.create_sheet(Template.title)
 
+        # get base row of list
+        list_row, list_col = Template.max_row + 1, 1
+        for row in Template.iter_rows():
+            for cell in row:
+                if cell.value == "{" + ListName + "}":
+                    list_row, list_col = cell.row, cell.column
+
+        # sheet layout must be set before writing rows
+        for key, dimension in Template.column_dimensions.items():
+            ws.column_dimensions[key].width = dimension.width
+        for key, dimension in Template.row_dimensions.items():
+            ws.row_dimensions[key].height = dimension.height
+        for merged in Template.merged_cells.ranges:
+            ws.merged_cells.add(str(merged))
+
+        # copy template and set summary data
+        for row in Template.iter_rows(min_row=1, max_row=list_row - 1, max_col=Template.max_column):
+            cells = []
+            for cell in row:
+                value = cell.value
+                if Summary is not None and value in Summary:
+                    value = Summary[value]
 
-        return FunctionRelations.count()
+                out = WriteOnlyCell(ws, value=value)
+                self._CopyStyle(cell, out)
+                cells.append(out)
+            ws.append(cells)
 
+        if Summary is None:
+            return 0
 
+        # write header
+        cells = [None] * (list_col - 1)
+        for index, header in enumerate(Header):
+            out = WriteOnlyCell(ws, value=header)
+            self._CopyStyle(Template.cell(row=list_row, column=list_col + index), out)
+            cells.append(out)
+        ws.append(cells)
+
+        # named style of each column is taken from the first list row of template
+        styles = []
+        for index in range(len(Header)):
+            template_cell = Template.cell(row=list_row + 1, column=list_col + index)
+            style = NamedStyle(
+                name = f"{ListName}_{index}",
+                font = copy.copy(template_cell.font),
+                number_format = template_cell.number_format,
+                alignment = copy.copy(template_cell.alignment))
+            wb.add_named_style(style)
+            styles.append(style.name)
+
+        # write list
+        count = 0
+        for row in Rows:
+            cells = [None] * (list_col - 1)
+            for index, value in enumerate(row):
+                out = WriteOnlyCell(ws, value=value)
+                out.style = styles[index]
+                cells.append(out)
+            ws.append(cells)
+            count += 1
+
+        # get all records (table columns aren't read from cells in write-only mode)
+        table = Table(displayName=ListName,
+                      ref=f"{get_column_letter(list_col)}{list_row}:{get_column_letter(list_col + len(Header) - 1)}{list_row + count}",
+                      tableColumns=[TableColumn(id=index + 1, name=header) for index, header in enumerate(Header)])
+        table.tableStyleInfo = TableStyleInfo(name='TableStyleMedium8', showRowStripes=True)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            ws.add_table(table)
+
+        return count
 
     def _ToExcel(self, ProjectName:str, SaveAs:str):
         """export to Excel file
 
+        The workbook is written in write-only mode, so the memory doesn't grow with the project size.
+
         Args:
             ProjectName (str): Project Name
             SaveAs (str): Save file
+
+        Returns:
+            dict: {table name: exported row count}
         """        
         # open template file
-        wb = load_workbook(pathlib.Path(__file__).resolve().parent / self._template)
+        template = load_workbook(pathlib.Path(__file__).resolve().parent / self._template)
+        wb = openpyxl.Workbook(write_only=True)
+
+        # unstyled cells of the template are written with the default font of the template
+        wb.add_named_style(NamedStyle(name=self._DefaultStyle, font=copy.copy(Cell(template.worksheets[0]).font)))
 
 
         # export functions
-        ws = wb["関数一覧"]
-        funccnt = self._MakeFunctionList(ProjectName, ws)
+        funccnt = self._WriteSheet(
+            wb, template["関数一覧"],
+            Summary = self._FunctionSummary(ProjectName),
+            ListName = "関数一覧",
+            Header = self._FunctionListHeader,
+            Rows = self._FunctionRows(ProjectName))
 
         if funccnt == 0:
             logger.info(" No function exported")
@@ -222,9 +294,14 @@ class Command(BaseCommand):
             logger.info(f" {funccnt} functions exported")
 
         # export function relations
-        ws = wb["呼び出し一覧"]
-        funcrelcnt = self._MakeFunctionRelationList(ProjectName, ws)
-        if funccnt == 0:
+        funcrelcnt = self._WriteSheet(
+            wb, template["呼び出し一覧"],
+            Summary = self._FunctionRelationSummary(ProjectName),
+            ListName = "呼び出し一覧",
+            Header = self._FunctionRelationListHeader,
+            Rows = self._FunctionRelationRows(ProjectName))
+
+        if funcrelcnt == 0:
             logger.info(" No function relations exported")
 
         else:
@@ -233,24 +310,39 @@ class Command(BaseCommand):
         
         wb.save(filename=SaveAs)
 
+        return {"function": funccnt, "function_relation": funcrelcnt}
+
     def handle(self, *args, **options):
         """command entry point
 
         """        
+        instrument = Instrument.FromOptions("exportdb", options)
         try:
             start_time = datetime.datetime.now()
+            instrument.Start()
 
             logger.info("Export database Start")
             logger.info(f" {start_time.strftime('%Y/%m/%d %H:%M:%S')}")
             
 
-            self._ToExcel(ProjectName=options['project'], SaveAs=options['save_as'])
+            with instrument.Phase(f"export_{options['format']}"):
+                if options['format'] == "excel":
+                    counts = self._ToExcel(ProjectName=options['project'], SaveAs=options['save_as'])
+
+                else:
+                    counts = ExportTables(ProjectName=options['project'], Format=options['format'], SaveAs=options['save_as'])
+                    for table, count in counts.items():
+                        logger.info(f" {table} {count} row(s)")
+
+            for table, count in counts.items():
+                instrument.Count(f"{table}_rows", count)
             
         except Exception as e:
             logger.error(f"exception {e}", exc_info=True)
 
 
         finally:
+            instrument.Finish()
             logger.debug(f" elapsed time {(datetime.datetime.now() - start_time).total_seconds()}")
 
     def add_arguments(self, parser):
@@ -261,5 +353,6 @@ class Command(BaseCommand):
         """        
 
         parser.add_argument('--project', nargs='?', default=None, type=str)
-        parser.add_argument('--format', nargs='?', default="Excel", type=str)
+        parser.add_argument('--format', nargs='?', default="Excel", type=str.lower, choices=["excel"] + list(WRITERS.keys()))
         parser.add_argument('--save-as', nargs='?', default="clangAnalyzer.xlsx", type=str)
+        Instrument.AddArguments(parser)
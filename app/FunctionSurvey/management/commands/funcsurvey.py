@@ -1,14 +1,27 @@
-from django.db import transaction
+from django.db import transaction, connections
+from django.db.models import Q
+from django.utils import timezone
 from django.core.management.base import BaseCommand
-from ...models import Project, Function, FunctionRelation
-from ...survey import Survey
+from ...models import Project, Function, FunctionRelation, Variable, SourceFile
+from ...survey import StreamFile, ResultRecords, ClearOwnedHeaders, PathFilter, PARSE_PROFILES
+from ...survey import FunctionDecl, VarDecl, SurveySummary, SurveyError
+from ...cache import FileHash
+from ...compdb import CompileCommand, LoadCompileCommands, GroupCompileCommands
+from ...pch import PchManager
+from ...worker import SurveyWorkerPool
+from ...instrument import Instrument
+from ...linker import SymbolTable, LinkResult, FunctionKey, IsVariableOf
+from ...artifact import ArtifactPath, WriteArtifact
 
 import logging
 import datetime
+import glob
+import os
 from pathlib import Path
 
 logger = logging.getLogger('Survey')
 
+
 class Command(BaseCommand):
     """funcsurvey command class
 
@@ -18,193 +31,966 @@ class Command(BaseCommand):
     help = "関数調査"
     _Project = None
     _Functions = {}
-    _Variables = []
+    _HeaderFunctions = {}
+    _Includes = []
+    _Dependents = set()
+    _BatchSize = 1000
+    _DeleteChunkSize = 500
+    _Instrument = Instrument("funcsurvey")
+    _UpdateFields = [
+        "return_type", "arguments", "file", "file_key", "line", "end_line", "static", "const", "is_prototype",
+        "include_for", "include_if", "include_switch", "include_while", "include_do", "created",
+    ]
 
-    def _write_db(self):
-        """write project to database
+    def _FetchFunctions(self, ProjectProfile:Project, Names:list) -> dict:
+        """get function records by name
 
-        """        
+        Args:
+            ProjectProfile (Project): project record
+            Names (list): function names
+
+        Returns:
+            dict: {function key: function record}
+        """
+        functions = {}
+        for index in range(0, len(Names), self._BatchSize):
+            for func in Function.objects.filter(project = ProjectProfile, name__in = Names[index:index + self._BatchSize]):
+                functions[FunctionKey(func.name, func.static, func.file)] = func
+
+        return functions
+
+    def _FetchRelations(self, ProjectProfile:Project, FunctionIds:list) -> set:
+        """get registered function relations
+
+        Args:
+            ProjectProfile (Project): project record
+            FunctionIds (list): function record ids (call to)
+
+        Returns:
+            set: {(call from id, call to id, line)}
+        """
+        relations = set()
+        for index in range(0, len(FunctionIds), self._BatchSize):
+            relations.update(
+                FunctionRelation.objects.filter(
+                    project = ProjectProfile,
+                    call_to_id__in = FunctionIds[index:index + self._BatchSize]
+                ).values_list("call_from_id", "call_to_id", "line")
+            )
+
+        return relations
+
+    def _WriteRecords(self, Records, RemovePathPrefix:Path) -> SurveySummary:
+        """write record stream of a source file to database
+
+        The records are written by bulk_create / bulk_update in batches of _BatchSize
+        while the stream is consumed, so the call sites and variables of the whole file
+        are never held. Only the functions of the file are kept to resolve the calls.
+        A prototype is written when it is called by a function defined in the file
+        or referred as function pointer. The calls to the functions not declared yet
+        and the function pointer relations are written at the end of the file.
+        The global variables and the variables of the functions defined in the file are
+        written with their scope function (the arguments of prototypes are not written).
+
+        Args:
+            Records (iterable): FunctionDecl, VarDecl and SurveySummary of a source file
+            RemovePathPrefix (Path): path prefix removed from file path
+
+        Returns:
+            SurveySummary: summary of the survey
+        """
         # write project table
         project_profile, created = Project.objects.get_or_create(
             name = self._Project,
             defaults = {}
         )
 
-        func_pointer = list(set([
-            func
-            for var in self._Variables
-            if var.get("FunctionPointer")  # None や空リストをスキップ
-            for func in var["FunctionPointer"]
-        ]))
-
-        # select write functions
-        # fillter non-prototype functions
-        write_func = []
-        for func in self._Functions:
-            # target function
-            if self._Functions[func]["IsPrototype"] == False:
-
-                # add call functions from target function
-                for call_to_func in self._Functions[func]["CallFunctions"]:
-                    # skip non-registed function
-                    if call_to_func["Name"] not in self._Functions.keys():
-                        logger.warning(f"  skip {func} -> {call_to_func['Name']}")    
-                        continue
-
-                    if call_to_func["Name"] not in write_func:
-                        write_func.append(call_to_func["Name"])
-                
-                # add target function
-                if func not in write_func:
-                    # skip non-registed function
-                    if func not in self._Functions.keys():
-                        logger.warning(f"  skip {func}")    
-                        continue
-
-                    write_func.append(func)
-
-            elif func in func_pointer:
-                write_func.append(func)
-
-        # atomic session
+        # functions of the file {name: FunctionDecl (path adjusted, without call sites)}
+        self._Functions = {}
+        # written function records {name: Function}
+        self._Written = {}
+        # functions, calls (call from, call to, line) and variables (scope, VarDecl) to write in the next batch
+        self._PendingFunctions = {}
+        self._PendingCalls = []
+        self._PendingVariables = []
+        self._VariableFiles = set()
+        self._WriteCount = [0, 0, 0]
+        # headers included by the file (path adjusted, set by the summary)
+        self._Includes = []
+
+        func_pointer = set()
+        unresolved = []
+        summary = None
+        variables = 0
+        calls = 0
+        for record in Records:
+            if isinstance(record, FunctionDecl):
+                # the record may be cached, so it is not changed
+                with self._Instrument.Phase("adjust_path"):
+                    func = record.Copy(File = self._AdjustPath(record.File, RemovePathPrefix))
+                func.ClearCallFunctions()
+                self._Functions[func.Name] = func
+
+                # target function and the functions called from it
+                if func.IsPrototype == False:
+                    self._PendingFunctions[func.Name] = func
+                    calls += len(record.CallNames)
+                    for call in record.CallFunctions:
+                        if self._ReferFunction(call.Name):
+                            self._PendingCalls.append((func.Name, call.Name, call.Line))
+
+                        else:
+                            unresolved.append((func.Name, call.Name, call.Line))
+
+            elif isinstance(record, VarDecl):
+                variables += 1
+                for func in record.FunctionPointer:
+                    func_pointer.add(func)
+                    self._ReferFunction(func)
+
+                with self._Instrument.Phase("adjust_path"):
+                    var = record.Copy(File = self._AdjustPath(record.File, RemovePathPrefix))
+                if record.Scope is None or IsVariableOf(var, self._Functions.get(record.Scope)):
+                    self._PendingVariables.append((record.Scope, var))
+
+            else:
+                summary = record
+
+            if len(self._PendingFunctions) + len(self._PendingCalls) + len(self._PendingVariables) >= self._BatchSize:
+                with self._Instrument.Phase("write_batch"):
+                    self._WriteBatch(project_profile)
+
+        self._Includes = [self._AdjustPath(include, RemovePathPrefix) for include in summary.Includes]
+        self._MergeHeaderFunctions(summary.HeaderFunctions, RemovePathPrefix)
+
+        # calls to the functions declared after the call or in the headers of the former files
+        for call_from, call_to, line in unresolved:
+            if not self._ReferFunction(call_to):
+                logger.warning(f"  skip {call_from} -> {call_to}")
+                continue
+
+            self._PendingCalls.append((call_from, call_to, line))
+
+        for func in func_pointer:
+            self._ReferFunction(func)
+
+        with self._Instrument.Phase("write_batch"):
+            self._WriteBatch(project_profile)
+
+        # function pointer relations (at the line of the last function record)
+        pointers = [self._Written[func] for func in func_pointer if func in self._Written]
+        registered = self._FetchRelations(project_profile, [func.pk for func in pointers])
+        create_relation = [
+            FunctionRelation(project = project_profile, call_from = None, call_to = func, line = int(func.line), file = self._Functions[func.name].File)
+            for func in pointers
+            if (None, func.pk, int(func.line)) not in registered
+        ]
+        self._BulkCreate(FunctionRelation, create_relation)
+        self._WriteCount[1] += len(create_relation)
+
+        self._CountSurvey(summary)
+        self._Instrument.Count("functions", self._WriteCount[0])
+        self._Instrument.Count("relations", self._WriteCount[1])
+        self._Instrument.Count("calls", calls)
+        self._Instrument.Count("variables", variables)
+        self._Instrument.Count("variable_rows", self._WriteCount[2])
+
+        logger.info(f" {self._WriteCount[0]} function(s), {self._WriteCount[1]} new relation(s), {self._WriteCount[2]} variable(s)")
+        return summary
+
+    def _CountSurvey(self, Summary:SurveySummary):
+        """add the survey stats to the instrument
+
+        The survey is timed by the survey itself (may be in a worker process).
+
+        Args:
+            Summary (SurveySummary): summary of the survey
+        """
+        self._Instrument.AddPhase("parse", Summary.Stats.get("parse", 0.0))
+        self._Instrument.AddPhase("walk", Summary.Stats.get("walk", 0.0))
+        self._Instrument.Count("nodes", Summary.Stats.get("nodes", 0))
+        self._Instrument.Count("cache_hits", Summary.Stats.get("cache_hit", 0))
+
+    def _WriteLinked(self, Linked:LinkResult):
+        """write linked functions and calls of all files (see SymbolTable.Link)
+
+        The functions are written by one bulk pass, and the registered functions and
+        relations are read by a few queries instead of per file. The variables are
+        written in batches after their scope functions.
+
+        Args:
+            Linked (LinkResult): linked functions, calls and function pointers
+        """
+        project_profile, created = Project.objects.get_or_create(
+            name = self._Project,
+            defaults = {}
+        )
+
+        written = self._WriteFunctions(project_profile, Linked.Functions)
+
+        # function relations, and function pointer relations (at the line of the function record)
+        relations = [(written[call_from], written[call_to], line, file) for call_from, call_to, line, file in Linked.Calls]
+        relations += [(None, written[func], int(written[func].line), written[func].file) for func in Linked.Pointers]
+
+        registered = self._FetchRelations(project_profile, list(set(call_to.pk for call_from, call_to, line, file in relations)))
+        create_relation = []
+        for call_from, call_to, line, file in relations:
+            key = (call_from.pk if call_from is not None else None, call_to.pk, line)
+            if key in registered:
+                continue
+
+            registered.add(key)
+            create_relation.append(FunctionRelation(
+                project     = project_profile,
+                call_from   = call_from,
+                call_to     = call_to,
+                line        = line,
+                file        = file,
+            ))
+
+        self._BulkCreate(FunctionRelation, create_relation, IgnoreConflicts = True)
+
+        # variables in batches
+        self._VariableFiles = set()
+        for start in range(0, len(Linked.Variables), self._BatchSize):
+            self._WriteVariables(project_profile, [
+                (written[scope] if scope is not None else None, var)
+                for scope, var in Linked.Variables[start:start + self._BatchSize]
+            ])
+
+        self._Instrument.Count("functions", len(written))
+        self._Instrument.Count("relations", len(create_relation))
+        self._Instrument.Count("calls", len(Linked.Calls) + Linked.Unresolved)
+        self._Instrument.Count("unresolved", Linked.Unresolved)
+        self._Instrument.Count("variable_rows", len(Linked.Variables))
+        logger.info(f" link: {len(written)} function(s), {len(create_relation)} new relation(s), {len(Linked.Variables)} variable(s), {Linked.Unresolved} unresolved call(s)")
+
+    def _BulkCreate(self, Model, Objects:list, IgnoreConflicts:bool=False):
+        """create records by multi-row INSERT in batches of _BatchSize
+
+        Args:
+            Model (_type_): model class
+            Objects (list): model instances
+            IgnoreConflicts (bool, optional): ignore the records violating unique constraints (Defaults to False).
+        """
+        Model.objects.bulk_create(Objects, batch_size = self._BatchSize, ignore_conflicts = IgnoreConflicts)
+
+    def _ReferFunction(self, Name:str) -> bool:
+        """add a called or referred function to the next batch
+
+        Args:
+            Name (str): function name
+
+        Returns:
+            bool: False when the function is not declared in the file nor the headers of this run
+        """
+        func = self._Functions.get(Name)
+        if func is None:
+            func = self._HeaderFunction(Name)
+            if func is None:
+                return False
+
+            self._Functions[Name] = func
+
+        if Name not in self._Written:
+            self._PendingFunctions.setdefault(Name, func)
+
+        return True
+
+    def _HeaderFunction(self, Name:str) -> FunctionDecl:
+        """get the function declared in the headers extracted by the former files
+
+        A static function is taken only from the headers included by the file, which
+        are known at the end of the record stream (see _WriteRecords).
+
+        Args:
+            Name (str): function name
+
+        Returns:
+            FunctionDecl: function (None: not declared)
+        """
+        func = self._HeaderFunctions.get(FunctionKey(Name, False, ""))
+        if func is not None:
+            return func
+
+        for include in self._Includes:
+            func = self._HeaderFunctions.get(FunctionKey(Name, True, include))
+            if func is not None:
+                return func
+
+        return None
+
+    def _WriteBatch(self, ProjectProfile:Project):
+        """write pending functions and calls
+
+        Args:
+            ProjectProfile (Project): project record
+        """
+        functions, self._PendingFunctions = self._PendingFunctions, {}
+        calls, self._PendingCalls = self._PendingCalls, []
+        variables, self._PendingVariables = self._PendingVariables, []
+
+        # write function table
+        written = self._WriteFunctions(ProjectProfile, {FunctionKey(name, func.IsStatic, func.File): func for name, func in functions.items()})
+        self._Written.update({key[0]: record for key, record in written.items()})
+        self._WriteCount[0] += len(functions)
+
+        # write function relation table
+        #  - due to db textfield compare unexpected , file name isn't include compare keywords
+        registered = self._FetchRelations(ProjectProfile, list(set(self._Written[call_to].pk for call_from, call_to, line in calls)))
+        create_relation = []
+        for call_from, call_to, line in calls:
+            key = (self._Written[call_from].pk, self._Written[call_to].pk, line)
+            if key in registered:
+                continue
+
+            registered.add(key)
+            create_relation.append(FunctionRelation(
+                project     = ProjectProfile,
+                call_from   = self._Written[call_from],
+                call_to     = self._Written[call_to],
+                line        = line,
+                file        = self._Functions[call_from].File,
+            ))
+
+        # the relations written by another process are ignored by unique constraint
+        self._BulkCreate(FunctionRelation, create_relation, IgnoreConflicts = True)
+        self._WriteCount[1] += len(create_relation)
+
+        # write variable table (the scope functions are written above)
+        self._WriteVariables(ProjectProfile, [(self._Written[scope] if scope is not None else None, var) for scope, var in variables])
+        self._WriteCount[2] += len(variables)
+
+    def _WriteVariables(self, ProjectProfile:Project, Variables:list):
+        """write variable records
+
+        The variables are replaced per declaring file: the registered variables of a file
+        are deleted when the first variable of the file is written (see _VariableFiles),
+        so a header surveyed by many files or a surveyed file again doesn't duplicate them.
+
+        Args:
+            ProjectProfile (Project): project record
+            Variables (list): (scope function record or None: global, VarDecl)
+        """
+        files = list(set(var.File for scope, var in Variables) - self._VariableFiles)
+        self._VariableFiles.update(files)
+        for start in range(0, len(files), self._DeleteChunkSize):
+            Variable.objects.filter(project = ProjectProfile, file__in = files[start:start + self._DeleteChunkSize]).delete()
+
+        self._BulkCreate(Variable, [
+            Variable(
+                project     = ProjectProfile,
+                scope       = scope,
+                type        = var.Type,
+                name        = var.Name,
+                file        = var.File,
+                line        = var.Line,
+                static      = var.IsStatic,
+                const       = var.IsConst,
+                is_pointer  = var.IsPointer,
+                is_prototype= var.IsExtern,
+            )
+            for scope, var in Variables
+        ])
+
+    def _WriteFunctions(self, ProjectProfile:Project, Functions:dict) -> dict:
+        """write function records
+
+        A registered function is updated when the written function is a definition,
+        and a declaration never rewrites the registered record.
+
+        Args:
+            ProjectProfile (Project): project record
+            Functions (dict): {function key: FunctionDecl}
+
+        Returns:
+            dict: {function key: function record}
+        """
+        # get registered records from function table
+        registered_func = self._FetchFunctions(ProjectProfile, list(dict.fromkeys(key[0] for key in Functions)))
+
+        # write function table
+        written = {}
+        create_func = []
+        update_func = []
+        now = timezone.now()
+        for key, func in Functions.items():
+            # set value
+            value = {
+                "return_type"   : func.ReturnType,
+                "arguments"     : [arg._asdict() for arg in func.Args],
+                "file"          : func.File,
+                "file_key"      : Function.FileKey(func.IsStatic, func.File),
+                "line"          : func.Line,
+                "end_line"      : func.EndLine,
+                "static"        : func.IsStatic,
+                "const"         : func.IsConst,
+                "is_prototype"  : func.IsPrototype,
+                "include_for"   : func.IncludeFor,
+                "include_if"    : func.IncludeIf,
+                "include_switch": func.IncludeSwitch,
+                "include_while" : func.IncludeWhile,
+                "include_do"    : func.IncludeDo,
+            }
+
+            # The function is not registered. In this case, it create record.
+            if key not in registered_func:
+                create_func.append(Function(project = ProjectProfile, name = func.Name, **value))
+                continue
+
+            written[key] = registered_func[key]
+
+            # The written function is NOT a prototype. In this case, it update record.
+            if func.IsPrototype == False:
+                for field, field_value in value.items():
+                    setattr(written[key], field, field_value)
+                written[key].created = now
+                update_func.append(written[key])
+
+        Function.objects.bulk_update(update_func, fields = self._UpdateFields, batch_size = self._BatchSize)
+        self._BulkCreate(Function, create_func)
+
+        # some backends (e.g. MySQL) don't return the ids of created records
+        if any(func.pk is None for func in create_func):
+            created_func = self._FetchFunctions(ProjectProfile, [func.name for func in create_func])
+            create_func = [created_func[FunctionKey(func.name, func.static, func.file)] for func in create_func]
+
+        written.update({FunctionKey(func.name, func.static, func.file): func for func in create_func})
+        return written
+
+    def _AdjustPath(self, FilePath:str, RemovePathPrefix:Path) -> str:
+        """remove path prefix from file path
+
+        Args:
+            FilePath (str): file path
+            RemovePathPrefix (Path): path prefix removed from file path
+
+        Returns:
+            str: adjusted file path
+        """
+        filepath = Path(FilePath)
+
+        # When the path prefix matches exactly
+        if filepath.is_relative_to(RemovePathPrefix):
+            return str(filepath.relative_to(RemovePathPrefix))
+
+        # When the path prefix is included in the path
+        rm_prefix = RemovePathPrefix.parent
+        while str(rm_prefix) != ".":
+            if filepath.is_relative_to(rm_prefix):
+                return str(filepath.relative_to(rm_prefix))
+
+            rm_prefix = rm_prefix.parent
+
+        return FilePath
+
+    def _MergeHeaderFunctions(self, HeaderFunctions:dict, RemovePathPrefix:Path):
+        """remember the functions declared in headers extracted by the file
+
+        A survey result doesn't have the declarations of the headers extracted
+        by the former files in the same worker. The functions called or referred
+        by the following files are taken from the header functions of this run
+        (_ReferFunction). They are written as prototypes, so the records are not rewritten.
+        They are keyed as the function records, so the static functions of the same
+        name in different headers are kept.
+
+        Args:
+            HeaderFunctions (dict): functions declared in the headers extracted by this file
+            RemovePathPrefix (Path): path prefix removed from file path
+        """
+        for name, func in HeaderFunctions.items():
+            file = self._AdjustPath(func.File, RemovePathPrefix)
+            key = FunctionKey(name, func.IsStatic, file)
+            if key not in self._HeaderFunctions:
+                header_func = func.Copy(
+                    File = file,
+                    IsPrototype = True)
+                header_func.ClearCallFunctions()
+                self._HeaderFunctions[key] = header_func
+
+    def _IsFileChanged(self, FilePath:str, MTime:float, Hash:str) -> bool:
+        """check whether the file is changed from the last survey
+
+        The hash is checked only when mtime is changed.
+
+        Args:
+            FilePath (str): file path
+            MTime (float): mtime of the last survey
+            Hash (str): hash of the last survey
+
+        Returns:
+            bool: True when the file is changed or deleted
+        """
+        try:
+            return os.stat(FilePath).st_mtime != MTime and FileHash(FilePath) != Hash
+
+        except OSError:
+            return True
+
+    def _IsChanged(self, Record:SourceFile, TargetSourceFile:str, ClangArgs:str, Headers:dict=None) -> bool:
+        """check whether the source file must be surveyed again
+
+        Args:
+            Record (SourceFile): record of the last survey (None: not surveyed)
+            TargetSourceFile (str): source file
+            ClangArgs (str): command-line option to clang
+            Headers (dict, optional): changed state of the headers {path: changed} (Defaults to None: check the headers).
+
+        Returns:
+            bool: True when the file, its included headers or the clang args are changed
+        """
+        if Record is None or Record.clang_args != ClangArgs:
+            return True
+
+        if self._IsFileChanged(TargetSourceFile, Record.mtime, Record.hash):
+            return True
+
+        for include, (mtime, sha, *_) in Record.includes.items():
+            changed = Headers[include] if Headers is not None and include in Headers else self._IsFileChanged(include, mtime, sha)
+            if changed:
+                logger.debug(f"  {include} changed")
+                return True
+
+        return False
+
+    def _ClearFunctions(self, Functions, FilePath:str=None) -> set:
+        """delete function records and the records referring them
+
+        The relations and variables referring the functions are deleted explicitly
+        instead of the cascade of the ORM. The calls to the deleted functions from the
+        other files must be linked again to the remaining declarations (e.g. prototype
+        in a header), so the files of those relations are returned to be surveyed again.
+
+        Args:
+            Functions (QuerySet): function records to delete
+            FilePath (str, optional): file whose relations are rewritten by the caller (Defaults to None).
+
+        Returns:
+            set: files (path prefix removed) of the relations from the other files
+        """
+        ids = list(Functions.values_list("pk", flat = True))
+        dependents = set()
+        for start in range(0, len(ids), self._DeleteChunkSize):
+            chunk = ids[start:start + self._DeleteChunkSize]
+            incoming = FunctionRelation.objects.filter(call_to_id__in = chunk, call_from__isnull = False).exclude(call_from_id__in = chunk)
+            if FilePath is not None:
+                incoming = incoming.exclude(file = FilePath)
+            dependents.update(incoming.values_list("file", flat = True).distinct())
+
+            FunctionRelation.objects.filter(Q(call_from_id__in = chunk) | Q(call_to_id__in = chunk)).delete()
+            Variable.objects.filter(scope_id__in = chunk).delete()
+            Function.objects.filter(pk__in = chunk).delete()
+
+        return dependents
+
+    def _ClearSourceFile(self, FilePath:str) -> set:
+        """delete records which came from the source file (or header)
+
+        Args:
+            FilePath (str): source file (path prefix removed)
+
+        Returns:
+            set: files of the relations to the deleted functions (see _ClearFunctions)
+        """
+        FunctionRelation.objects.filter(project__name = self._Project, file = FilePath).delete()
+        Variable.objects.filter(project__name = self._Project, file = FilePath).delete()
+        return self._ClearFunctions(Function.objects.filter(project__name = self._Project, file = FilePath), FilePath)
+
+    def _RecordFile(self, FilePath:str, File:str, RemovePathPrefix:Path) -> str:
+        """get the path written to the records of a file recorded by incremental survey
+
+        Args:
+            FilePath (str): absolute path
+            File (str): recorded path (path prefix removed, empty: recorded by former version)
+            RemovePathPrefix (Path): path prefix removed from file path
+
+        Returns:
+            str: path written to the records
+        """
+        return File if File != "" else self._AdjustPath(FilePath, RemovePathPrefix)
+
+    def _DependentSourceFiles(self, Files:set, RemovePathPrefix:Path) -> dict:
+        """get the surveyed source files which are or include the files
+
+        Args:
+            Files (set): files (path prefix removed)
+            RemovePathPrefix (Path): path prefix removed from file path
+
+        Returns:
+            dict: command-line option to clang of each source file {source file: clang args}
+        """
+        if len(Files) == 0:
+            return {}
+
+        dependents = {}
+        for record in SourceFile.objects.filter(project__name = self._Project):
+            if not os.path.exists(record.path):
+                continue
+
+            paths = [self._RecordFile(record.path, record.file, RemovePathPrefix)]
+            paths += [self._RecordFile(include, "".join(file), RemovePathPrefix) for include, (mtime, sha, *file) in record.includes.items()]
+            if any(path in Files for path in paths):
+                dependents[record.path] = record.clang_args
+
+        return dependents
+
+    def _WriteIncremental(self, TargetSourceFile:str, RemovePathPrefix:Path, Records, ClangArgs:str):
+        """rewrite records of the source file and save its dependency
+
+        Args:
+            TargetSourceFile (str): source file
+            RemovePathPrefix (Path): path prefix removed from file path
+            Records (iterable): record stream of the source file
+            ClangArgs (str): command-line option to clang
+        """
+        file_path = self._AdjustPath(TargetSourceFile, RemovePathPrefix)
+
         with transaction.atomic():
-            # write & get record from function table
-            func_profile = {}
-            for func in write_func:
-                # set value
-                value = {
-                    "project"       : project_profile,
-                    "return_type"   : self._Functions[func]["ReturnType"],
-                    "arguments"     : self._Functions[func]["Args"],
-                    "file"          : self._Functions[func]["File"],
-                    "line"          : self._Functions[func]["Line"],
-                    "end_line"      : self._Functions[func]["EndLine"],
-                    "static"        : self._Functions[func]["IsStatic"],
-                    "const"         : self._Functions[func]["IsConst"],
-                    "is_prototype"  : self._Functions[func]["IsPrototype"],
-                    "include_for"   : self._Functions[func]["IncludeFor"],
-                    "include_if"    : self._Functions[func]["IncludeIf"],
-                    "include_switch": self._Functions[func]["IncludeSwitch"],
-                    "include_while" : self._Functions[func]["IncludeWhile"],
-                    "include_do"    : self._Functions[func]["IncludeDo"],
+            # relations and variables are written again, functions are updated by _WriteRecords
+            FunctionRelation.objects.filter(project__name = self._Project, file = file_path).delete()
+            Variable.objects.filter(project__name = self._Project, file = file_path).delete()
+
+            summary = self._WriteRecords(Records, RemovePathPrefix)
+
+            # delete functions which were removed from the source file (the files calling them are surveyed again)
+            self._Dependents |= self._ClearFunctions(Function.objects.filter(project__name = self._Project, file = file_path).exclude(
+                name__in = [name for name, func in self._Functions.items() if func.File == file_path]
+            ), file_path)
+
+            # the paths are absolute, so the next survey may run in another directory
+            includes = {}
+            for include in summary.Includes:
+                try:
+                    includes[os.path.abspath(include)] = [os.stat(include).st_mtime, FileHash(include), self._AdjustPath(include, RemovePathPrefix)]
+                except OSError:
+                    pass
+
+            SourceFile.objects.update_or_create(
+                project = Project.objects.get(name = self._Project),
+                path = os.path.abspath(TargetSourceFile),
+                defaults = {
+                    "file"          : file_path,
+                    "mtime"         : os.stat(TargetSourceFile).st_mtime,
+                    "hash"          : FileHash(TargetSourceFile),
+                    "clang_args"    : ClangArgs,
+                    "includes"      : includes,
                 }
+            )
+
+    def _SelectIncremental(self, SourceFiles:list, RemovePathPrefix:Path, ClangArgs:dict) -> list:
+        """select the source files surveyed in incremental mode
+
+        The records of deleted source files and changed headers are removed, and the
+        surveyed files which include a changed header or call a removed function are
+        surveyed again with their clang args of the last survey (added to ClangArgs).
+
+        Args:
+            SourceFiles (list): target source files
+            RemovePathPrefix (Path): path prefix removed from file path
+            ClangArgs (dict): command-line option to clang of each source file
+
+        Returns:
+            list: changed source files
+        """
+        records = {}
+        for record in SourceFile.objects.filter(project__name = self._Project):
+            # a record of former version has the path relative to the directory of that survey
+            if not os.path.isabs(record.path):
+                logger.info(f" {record.path} is surveyed again (relative path)")
+                record.delete()
+                continue
+
+            records[record.path] = record
 
-                # The written function is NOT a prototype. In this case, it update or create record.
-                if self._Functions[func]["IsPrototype"] == False:
-                    # update or get record profile
-                    func_profile[func], created = Function.objects.update_or_create(
-                        project = project_profile,
-                        name = func,
-                        defaults = value
-                    )
-
-                # The written function is a prototype. In this case, it create record.
-                else:
-                    # append and get record profile
-                    func_profile[func], created = Function.objects.get_or_create(
-                        project = project_profile,
-                        name = func,
-                        defaults = value
-                    )
-
-            # write function relation table
-            for base_func in write_func:
-                if base_func in func_pointer:
-                    call_func_profile, created = FunctionRelation.objects.get_or_create(
-                        project = project_profile,
-                        call_from = None,
-                        call_to = func_profile[base_func],
-                        line = func_profile[base_func].line,
-                        defaults = {
-                            "project"   : project_profile,
-                            "call_from" : None,
-                            "call_to"   : func_profile[base_func],
-                            "line"      : func_profile[base_func].line,
-                            "file"      : self._Functions[base_func]["File"],
-                        }
-                    )
-
-                # scan call other funcsion from base function
-                for call_to_func in self._Functions[base_func]["CallFunctions"]:
-                    if call_to_func["Name"] not in func_profile.keys():
-                        logger.warning(f"  skip {base_func} -> {call_to_func['Name']}")    
-                        continue
-
-                    # add function relation
-                    #  - due to db textfield compare unexpected , file name isn't include compare keywords
-                    call_func_profile, created = FunctionRelation.objects.get_or_create(
-                        project = project_profile,
-                        call_from = func_profile[base_func],
-                        call_to = func_profile[call_to_func["Name"]],
-                        line = call_to_func["Line"],
-                        defaults = {
-                            "project"   : project_profile,
-                            "call_from" : func_profile[base_func],
-                            "call_to"   : func_profile[call_to_func["Name"]],
-                            "line"      : call_to_func["Line"],
-                            "file"      : self._Functions[base_func]["File"],
-                        }
-                    )
-
-        logger.info(f" {len(write_func)} function(s)")
-
-
-        pass        
+        # remove deleted source files
+        dependents = set()
+        for path, record in list(records.items()):
+            if not os.path.exists(path):
+                logger.info(f" {path} was deleted")
+                with transaction.atomic():
+                    dependents |= self._ClearSourceFile(self._RecordFile(path, record.file, RemovePathPrefix))
+                    record.delete()
+                del records[path]
+
+        # remove the records of changed headers, they are written again by the files including them
+        headers = {}
+        header_files = {}
+        for record in records.values():
+            for include, (mtime, sha, *file) in record.includes.items():
+                if include not in headers:
+                    headers[include] = self._IsFileChanged(include, mtime, sha)
+                    header_files[include] = self._RecordFile(include, "".join(file), RemovePathPrefix)
+
+        for header in [header for header, changed in headers.items() if changed]:
+            logger.info(f" {header} changed")
+            with transaction.atomic():
+                dependents |= self._ClearSourceFile(header_files[header]) | {header_files[header]}
+
+        changed = [source_file for source_file in SourceFiles if self._IsChanged(records.get(os.path.abspath(source_file)), source_file, ClangArgs[source_file], headers)]
+        logger.info(f" {len(changed)} of {len(SourceFiles)} file(s) changed")
+
+        # the surveyed files depending on the removed records
+        selected = set(os.path.abspath(source_file) for source_file in changed)
+        for source_file, clang_args in self._DependentSourceFiles(dependents, RemovePathPrefix).items():
+            if source_file not in selected:
+                logger.info(f" {source_file} depends on the removed records")
+                ClangArgs[source_file] = clang_args
+                changed.append(source_file)
+
+        return changed
+
+    def _FindSourceFiles(self, Targets:list, Pattern:str) -> list:
+        """find survey target files
+
+        Each target is a source file, a directory (searched recursively with Pattern)
+        or a glob pattern.
+
+        Args:
+            Targets (list): target files, directories or glob patterns
+            Pattern (str): file name pattern used in directories
+
+        Returns:
+            list: source files
+        """
+        source_files = []
+        for target in Targets:
+            if Path(target).is_dir():
+                source_files += sorted(str(f) for f in Path(target).rglob(Pattern) if f.is_file())
+
+            elif glob.has_magic(target):
+                source_files += sorted(f for f in glob.glob(target, recursive=True) if Path(f).is_file())
+
+            else:
+                source_files.append(target)
+
+        # remove duplicated files with keeping order
+        return list(dict.fromkeys(source_files))
+
+    def _ClangArgsOfFiles(self, SourceFiles:list, ClangArgs:str, CompileCommands:str=None) -> tuple:
+        """get command-line option to clang of each source file
+
+        With compilation database, each file is parsed with its own flags,
+        and the files which are not in the database use ClangArgs.
+        The files are ordered by their flags, so the files with the same flags
+        are surveyed one after another.
+
+        Args:
+            SourceFiles (list): target source files (empty: all files in the compilation database)
+            ClangArgs (str): command-line option to clang
+            CompileCommands (str, optional): compilation database file (Defaults to None).
+
+        Returns:
+            tuple: (ordered source files, {source file: clang args})
+        """
+        if CompileCommands is None:
+            return SourceFiles, {source_file: ClangArgs for source_file in SourceFiles}
+
+        commands = LoadCompileCommands(CompileCommands)
+        if len(SourceFiles) == 0:
+            clang_args = {command.File: command.ClangArgs for command in commands}
+
+        else:
+            database = {command.File: command.ClangArgs for command in commands}
+            clang_args = {}
+            for source_file in SourceFiles:
+                args = database.get(os.path.abspath(source_file))
+                if args is None:
+                    logger.warning(f" {source_file} is not in compilation database")
+                    args = ClangArgs
+
+                clang_args[source_file] = args
+
+        groups = GroupCompileCommands([CompileCommand(source_file, None, args) for source_file, args in clang_args.items()])
+        logger.info(f" compile commands: {len(clang_args)} file(s), {len(groups)} flag set(s)")
+
+        return [source_file for files in groups.values() for source_file in files], clang_args
+
+    def _SurveyPasses(self, SourceFiles:list, ClangArgs:dict, RemovePathPrefix:Path, *SurveyArgs):
+        """survey source files, and then the files depending on the functions removed by an incremental survey
+
+        Args:
+            SourceFiles (list): target source files
+            ClangArgs (dict): command-line option to clang of each source file (the dependent files are added)
+            RemovePathPrefix (Path): path prefix removed from file path (None: not incremental survey)
+            SurveyArgs: the other arguments of _SurveyFiles
+
+        Yields:
+            tuple: (source file, record stream or None: failed)
+        """
+        pending = SourceFiles
+        while pending:
+            self._Dependents = set()
+            yield from self._SurveyFiles(pending, ClangArgs, *SurveyArgs)
+
+            if RemovePathPrefix is None:
+                return
+
+            dependents = self._DependentSourceFiles(self._Dependents, RemovePathPrefix)
+            if len(dependents) > 0:
+                logger.info(f" {len(dependents)} file(s) depend on the removed functions")
+            ClangArgs.update(dependents)
+            pending = list(dependents)
+
+    def _SurveyFiles(self, SourceFiles:list, ClangArgs:dict, Jobs:int, CacheDir:str=None, Filter:PathFilter=None, Pch:dict=None, Profile:str="default", MaxFilesPerWorker:int=0, MaxWorkerRss:int=0, Variables:bool=True):
+        """survey source files
+
+        With Jobs <= 1, each file is surveyed while its record stream is consumed.
+        With Jobs > 1, the files are surveyed by long-lived worker processes and the
+        results are streamed back to this process in completion order. A worker is
+        replaced after MaxFilesPerWorker files or when its RSS is over MaxWorkerRss.
+
+        Args:
+            SourceFiles (list): target source files
+            ClangArgs (dict): command-line option to clang of each source file
+            Jobs (int): number of worker processes
+            CacheDir (str, optional): survey result cache directory (Defaults to None).
+            Filter (PathFilter, optional): declaration file filter (Defaults to None).
+            Pch (dict, optional): precompiled header of each source file (Defaults to None).
+            Profile (str, optional): parse profile name (Defaults to "default").
+            MaxFilesPerWorker (int, optional): files surveyed by a worker process (Defaults to 0: no limit).
+            MaxWorkerRss (int, optional): RSS limit of a worker process in MB (Defaults to 0: no limit).
+            Variables (bool, optional): survey variables (Defaults to True).
+
+        Yields:
+            tuple: (source file, record stream or None: failed)
+        """
+        pch = Pch or {}
+        tasks = [(source_file, ClangArgs[source_file], pch.get(source_file)) for source_file in SourceFiles]
+
+        # header ownership is kept per run (the pool workers are new processes)
+        ClearOwnedHeaders()
+
+        # the file is surveyed while the records are written (SurveyError is raised by the stream)
+        if Jobs <= 1 or len(SourceFiles) <= 1:
+            for source_file, clang_args, precompiled in tasks:
+                yield source_file, StreamFile(source_file, clang_args, CacheDir = CacheDir, Filter = Filter, Pch = precompiled, Profile = Profile, Variables = Variables)
+            return
+
+        # the workers don't use database connection
+        connections.close_all()
+
+        pool = SurveyWorkerPool(
+            min(Jobs, len(SourceFiles)),
+            MaxFiles = MaxFilesPerWorker,
+            MaxRss = MaxWorkerRss << 20,
+            CacheDir = CacheDir, Filter = Filter, Profile = Profile, Variables = Variables)
+        for source_file, result in pool.imap_unordered(tasks):
+            yield source_file, ResultRecords(result) if result is not None else None
 
     def handle(self, *args, **options):
         """command entry point
 
         """        
         
+        self._Instrument = Instrument.FromOptions("funcsurvey", options)
         try:
             start_time = datetime.datetime.now()
+            self._Instrument.Start()
 
             verbosity = options.get('verbosity', 1)
             if verbosity >= 2:
                 logger.setLevel(logging.DEBUG)
 
+            jobs = options["jobs"] if options["jobs"] > 0 else os.cpu_count()
+            with self._Instrument.Phase("find_files"):
+                source_files = self._FindSourceFiles(options["target-file"], options["pattern"])
+
             logger.info("Function Survey Start")
             logger.info(f" {start_time.strftime('%Y/%m/%d %H:%M:%S')}")
             logger.info(f" Project    : {options['project']}")
-            logger.info(f" target file: {options['target-file']}")
+            logger.info(f" target file: {' '.join(options['target-file'])} ({len(source_files)} file(s))")
             logger.info(f" clang args : {options['clang_args']}")
-            
-            self._Project = options['project']
+            logger.info(f" jobs       : {jobs}")
+            logger.info(f" cache dir  : {options['cache_dir']}")
+            logger.info(f" incremental: {options['incremental']}")
+            logger.info(f" include    : {' '.join(options['include_path'])}")
+            logger.info(f" exclude    : {' '.join(options['exclude_path'])}")
+            logger.info(f" skip system: {options['skip_system_headers']}")
+            logger.info(f" compile commands: {options['compile_commands']}")
+            logger.info(f" pch dir    : {options['pch_dir']}")
+            logger.info(f" profile    : {options['parse_profile']}")
+            logger.info(f" worker recycle: {options['max_files_per_worker']} file(s), {options['max_worker_rss']} MB")
+            logger.info(f" link       : {options['link']}")
+            logger.info(f" artifact dir: {options['artifact_dir']}")
+            logger.info(f" variables  : {not options['skip_variables']}")
 
-            # survey target file
-            survey = Survey(
-                TargetSourceFile = options["target-file"],
-                ClangArgs = options["clang_args"]
-            )
-            analysised = survey.Survey()
-            self._Functions = analysised["Functions"]
-            self._Variables = analysised["Variables"]
+            if options["link"] and options["incremental"]:
+                logger.error("--link can't be used with --incremental")
+                return
+
+            if options["artifact_dir"] and (options["link"] or options["incremental"]):
+                logger.error("--artifact-dir can't be used with --link nor --incremental")
+                return
 
-            # adjust self._Functions
+            with self._Instrument.Phase("compile_commands"):
+                source_files, clang_args = self._ClangArgsOfFiles(source_files, options["clang_args"], options["compile_commands"])
+
+            self._Project = options['project']
             remove_path_prefix = Path(options["remove_path_prefix"])
-            for func in self._Functions:
-                # adjust file path
-                filepath = Path(self._Functions[func]["File"])
 
-                # When the path prefix matches exactly
-                if filepath.is_relative_to(remove_path_prefix):
-                    self._Functions[func]["File"] = str(filepath.relative_to(remove_path_prefix))
+            # survey only changed files
+            if options["incremental"]:
+                with self._Instrument.Phase("select_incremental"):
+                    Project.objects.get_or_create(name = self._Project)
+                    source_files = self._SelectIncremental(source_files, remove_path_prefix, clang_args)
+
+            # precompiled headers of shared include sets
+            pch = None
+            if options["pch_dir"]:
+                pch_manager = PchManager(options["pch_dir"], SkipFunctionBodies = PARSE_PROFILES[options["parse_profile"]].SkipHeaderBodies)
+                with self._Instrument.Phase("pch"):
+                    pch = pch_manager.Prepare(source_files, clang_args)
+
+            # survey target files, and write results by this process only
+            self._HeaderFunctions = {}
+            symbols = SymbolTable() if options["link"] else None
+            failed = 0
+            path_filter = PathFilter(
+                IncludePatterns = options["include_path"],
+                ExcludePatterns = options["exclude_path"],
+                SkipSystemHeaders = options["skip_system_headers"])
+
+            for source_file, records in self._SurveyPasses(source_files, clang_args, remove_path_prefix if options["incremental"] else None,
+                                                           jobs, options["cache_dir"], path_filter, pch, options["parse_profile"],
+                                                           options["max_files_per_worker"], options["max_worker_rss"], not options["skip_variables"]):
+                self._Instrument.Count("files")
+                if records is None:
+                    failed += 1
+                    continue
+
+                logger.info(f" {source_file}")
+
+                # write db (the records of a failed survey are rolled back)
+                try:
+                    with self._Instrument.Phase("file"):
+                        if options["artifact_dir"]:
+                            artifact = ArtifactPath(options["artifact_dir"], source_file, options["compress"])
+                            self._CountSurvey(WriteArtifact(artifact, source_file, clang_args[source_file], records))
+
+                        elif symbols is not None:
+                            self._CountSurvey(symbols.Add(source_file, records, lambda path: self._AdjustPath(path, remove_path_prefix)))
+
+                        elif options["incremental"]:
+                            self._WriteIncremental(source_file, remove_path_prefix, records, clang_args[source_file])
 
-                # When the path prefix is included in the path
-                else:
-                    rm_prefix = remove_path_prefix.parent
+                        else:
+                            with transaction.atomic():
+                                self._WriteRecords(records, remove_path_prefix)
 
-                    while str(rm_prefix) != ".":
-                        if filepath.is_relative_to(rm_prefix):
-                            self._Functions[func]["File"] = filepath.relative_to(rm_prefix)
-                            break
+                except SurveyError:
+                    failed += 1
 
-                        rm_prefix = rm_prefix.parent
+            self._Instrument.Count("failed", failed)
 
+            # resolve the calls of all files, and write them at once
+            if symbols is not None:
+                with self._Instrument.Phase("link"):
+                    linked = symbols.Link(source_files)
 
-            # write db
-            self._write_db()
-            pass
+                with self._Instrument.Phase("write_linked"), transaction.atomic():
+                    self._WriteLinked(linked)
+            if failed > 0:
+                logger.warning(f" {failed} file(s) failed")
 
 
             
@@ -213,6 +999,7 @@ class Command(BaseCommand):
 
 
         finally:
+            self._Instrument.Finish()
             logger.info(f" elapsed time {(datetime.datetime.now() - start_time).total_seconds()}")
 
     def add_arguments(self, parser):
@@ -225,4 +1012,21 @@ class Command(BaseCommand):
         parser.add_argument('--project', nargs='?', default=None, type=str)
         parser.add_argument('--clang-args', nargs='?', default='target', type=str)
         parser.add_argument('--remove-path-prefix', nargs='?', default="target", type=str)
-        parser.add_argument('target-file', nargs='?', default='', type=str)
+        parser.add_argument('--jobs', '-j', nargs='?', default=1, type=int, help="number of worker processes (0: cpu count)")
+        parser.add_argument('--pattern', nargs='?', default="*.c", type=str, help="source file name pattern for directory target")
+        parser.add_argument('--cache-dir', nargs='?', default=None, type=str, help="reuse survey results of unchanged files")
+        parser.add_argument('--incremental', action='store_true', help="survey only the files changed from the last incremental survey")
+        parser.add_argument('--include-path', action='append', default=[], type=str, metavar='PATTERN', help="survey only the declarations in headers matching the pattern (repeatable)")
+        parser.add_argument('--exclude-path', action='append', default=[], type=str, metavar='PATTERN', help="don't survey the declarations in headers matching the pattern (repeatable)")
+        parser.add_argument('--skip-system-headers', action='store_true', help="don't survey the declarations in system headers")
+        parser.add_argument('--compile-commands', nargs='?', default=None, type=str, help="compilation database (compile_commands.json) for the flags of each file")
+        parser.add_argument('--pch-dir', nargs='?', default=None, type=str, help="build and use precompiled headers of the include sets shared by source files")
+        parser.add_argument('--parse-profile', nargs='?', default="default", choices=list(PARSE_PROFILES), help="libclang parse options")
+        parser.add_argument('--max-files-per-worker', nargs='?', default=0, type=int, help="replace a worker process after surveying this many files (0: no limit)")
+        parser.add_argument('--max-worker-rss', nargs='?', default=0, type=int, help="replace a worker process when its RSS is over this size in MB (0: no limit)")
+        parser.add_argument('--link', action='store_true', help="resolve the calls after all files are surveyed, and write all records at once")
+        parser.add_argument('--artifact-dir', nargs='?', default=None, type=str, help="write the survey result of each file to an artifact in this directory instead of database (see loadsurvey)")
+        parser.add_argument('--compress', action='store_true', help="gzip the artifacts")
+        parser.add_argument('--skip-variables', action='store_true', help="don't survey variables (and the function pointers in their initializers)")
+        Instrument.AddArguments(parser)
+        parser.add_argument('target-file', nargs='*', default=[], type=str, help="source files, directories or glob patterns")
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from ...models import Project, Function, FunctionRelation
+from ...callgraph import CallGraph, CallGraphSnapshot
+from ...instrument import Instrument
 
 import logging
 import datetime
@@ -15,62 +16,29 @@ class Command(BaseCommand):
     """    
 
     help = "function tree"
-    _ProjectFunction = None
-    _ProjectFunctionRelation = None
+    _CallGraph = None
+    _Instrument = Instrument("functree")
     _FunctionTree = {
         "upper" : [],
         "lower" : []
     }
 
     def _TraceFunctionTree(self, FunctionName:str="", Depth:int=1):
-        """trace function tree (upper)
+        """trace function tree
 
         Args:
             FunctionName (_type_): target function
-            Depth (_type_): trace level
+            Depth (_type_): trace level (positive: upper, negative: lower)
         """        
 
-        if Depth == 0:
-            return {
-                "name"  : FunctionName,
-                "next": [],
-            }
-        
-        elif Depth > 0:
-            # search upper functions
-            TreeElement = {
-                "name"  : FunctionName,
-                "next": [],
-            }
-
-            # get upper functions
-            upper_functions = self._ProjectFunctionRelation.filter(call_to__name = FunctionName).values_list("call_from__name", flat=True).distinct()
-            for func_name in list(upper_functions):
-                NextElement = self._TraceFunctionTree(FunctionName = func_name, Depth=Depth - 1)
-                TreeElement["next"].append(NextElement)
-        
-
-        else:
-            # search lower functions
-            TreeElement = {
-                "name"  : FunctionName,
-                "next": [],
-            }
-
-            # get lower functions
-            lower_functions = self._ProjectFunctionRelation.filter(call_from__name = FunctionName).values_list("call_to__name", flat=True).distinct()
-            for func_name in list(lower_functions):
-                NextElement = self._TraceFunctionTree(FunctionName = func_name, Depth=Depth + 1)
-                TreeElement["next"].append(NextElement)
- 
-
-
-        return TreeElement
+        return self._CallGraph.Trace(FunctionName = FunctionName, Depth = abs(Depth), Upper = Depth > 0)
         
     def _DisplayFunctionTree(self, FunctionTree:dict, depth = 0):
 
-        DisplayFunction = self._ProjectFunction.filter(name = FunctionTree['name']).first()
-        logger.info(f"{"\t" * depth} {"static " if DisplayFunction.static else ""}{DisplayFunction.return_type} {DisplayFunction.name}")
+        self._Instrument.Count("tree_nodes")
+        func_id = self._CallGraph.Id(FunctionTree['name'])
+        DisplayFunction = self._CallGraph.Attribute(func_id) if func_id is not None else {"static": False, "return_type": ""}
+        logger.info(f"{"\t" * depth} {"static " if DisplayFunction["static"] else ""}{DisplayFunction["return_type"]} {FunctionTree["name"]}{" (recursive)" if FunctionTree["recursive"] else ""}")
 
         for func in FunctionTree["next"]:
             self._DisplayFunctionTree(FunctionTree = func, depth = depth + 1)
@@ -81,8 +49,10 @@ class Command(BaseCommand):
         """command entry point
 
         """        
+        self._Instrument = Instrument.FromOptions("functree", options)
         try:
             start_time = datetime.datetime.now()
+            self._Instrument.Start()
 
 
             # display start up infomation
@@ -91,22 +61,31 @@ class Command(BaseCommand):
             logger.info(f"Target project : {options['project']}")
             logger.info(f"Target function : {options['target-function']}")
             
-            # select project data
-            self._ProjectFunction = Function.objects.filter(project__name=options["project"])
-            self._ProjectFunctionRelation = FunctionRelation.objects.filter(project__name=options["project"])
+            # load project call graph
+            with self._Instrument.Phase("load"):
+                if options["snapshot"]:
+                    self._CallGraph = CallGraph.FromSnapshot(CallGraphSnapshot(options["snapshot"]))
+
+                else:
+                    self._CallGraph = CallGraph.FromDatabase(options["project"])
+
+            self._Instrument.Count("functions", len(self._CallGraph))
+            self._Instrument.Count("edges", self._CallGraph.EdgeCount)
 
             # trace function tree
-            self._FunctionTree["upper"] = self._TraceFunctionTree(FunctionName = options["target-function"], Depth = options["upper"])
-            self._FunctionTree["lower"] = self._TraceFunctionTree(FunctionName = options["target-function"], Depth = -options["lower"])
+            with self._Instrument.Phase("trace"):
+                self._FunctionTree["upper"] = self._TraceFunctionTree(FunctionName = options["target-function"], Depth = options["upper"])
+                self._FunctionTree["lower"] = self._TraceFunctionTree(FunctionName = options["target-function"], Depth = -options["lower"])
             
             # display function tree
-            if len(self._FunctionTree["upper"]["next"]) > 0:
-                logger.info("** Upper Function Tree")
-                self._DisplayFunctionTree(FunctionTree = self._FunctionTree["upper"])
+            with self._Instrument.Phase("display"):
+                if len(self._FunctionTree["upper"]["next"]) > 0:
+                    logger.info("** Upper Function Tree")
+                    self._DisplayFunctionTree(FunctionTree = self._FunctionTree["upper"])
 
-            if len(self._FunctionTree["lower"]["next"]) > 0:
-                logger.info("** Lower Function Tree")
-                self._DisplayFunctionTree(FunctionTree = self._FunctionTree["lower"])
+                if len(self._FunctionTree["lower"]["next"]) > 0:
+                    logger.info("** Lower Function Tree")
+                    self._DisplayFunctionTree(FunctionTree = self._FunctionTree["lower"])
 
             pass
 
@@ -116,6 +95,7 @@ class Command(BaseCommand):
 
 
         finally:
+            self._Instrument.Finish()
             logger.debug(f" elapsed time {(datetime.datetime.now() - start_time).total_seconds()}")
 
 
@@ -127,6 +107,8 @@ class Command(BaseCommand):
         """        
 
         parser.add_argument('--project', nargs='?', default=None, type=str)
+        parser.add_argument('--snapshot', nargs='?', default=None, type=str, help="read call graph snapshot file instead of database")
         parser.add_argument('--upper', nargs='?', default=1, type=int)
         parser.add_argument('--lower', nargs='?', default=1, type=int)
+        Instrument.AddArguments(parser)
         parser.add_argument('target-function', nargs='?', default='', type=str)
@@ -0,0 +1,157 @@
+from django.db import transaction, connection
+from ...artifact import FindArtifacts, ReadArtifactHeader, ArtifactRecords
+from ...instrument import Instrument
+from ...linker import SymbolTable
+from .funcsurvey import Command as SurveyCommand
+
+import logging
+import datetime
+import os
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger('Survey')
+
+
+class Command(SurveyCommand):
+    """loadsurvey command class
+
+    Load the survey artifacts written by funcsurvey --artifact-dir. The calls of all
+    artifacts are linked as funcsurvey --link, and the records are written by one
+    transaction.
+
+    Args:
+        SurveyCommand (_type_): funcsurvey command class
+    """
+    help = "調査結果ロード"
+    _BatchSize = 5000
+    _Instrument = Instrument("loadsurvey")
+    _LoadData = False
+
+    def _BulkCreate(self, Model, Objects:list, IgnoreConflicts:bool=False):
+        """create records by LOAD DATA LOCAL INFILE (MySQL with --load-data) or multi-row INSERT
+
+        Args:
+            Model (_type_): model class
+            Objects (list): model instances
+            IgnoreConflicts (bool, optional): ignore the records violating unique constraints (Defaults to False).
+        """
+        if not self._LoadData or connection.vendor != "mysql" or len(Objects) == 0:
+            super()._BulkCreate(Model, Objects, IgnoreConflicts)
+            return
+
+        # the values are converted as the backend does for INSERT (auto_now, JSON, datetime)
+        fields = [field for field in Model._meta.concrete_fields if not field.primary_key]
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="utf-8", newline="", delete=False) as f:
+            for obj in Objects:
+                f.write("\t".join(self._TsvValue(field.get_db_prep_save(field.pre_save(obj, True), connection)) for field in fields) + "\n")
+
+        try:
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"LOAD DATA LOCAL INFILE %s {'IGNORE ' if IgnoreConflicts else ''}INTO TABLE {quote(Model._meta.db_table)} "
+                    "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                    f"({', '.join(quote(field.column) for field in fields)})",
+                    [f.name])
+
+        finally:
+            os.unlink(f.name)
+
+    @staticmethod
+    def _TsvValue(Value) -> str:
+        """convert database value to a field of LOAD DATA file
+
+        Args:
+            Value (_type_): value prepared for database
+
+        Returns:
+            str: escaped field (\\N: NULL)
+        """
+        if Value is None:
+            return "\\N"
+
+        if isinstance(Value, bool):
+            return "1" if Value else "0"
+
+        return str(Value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def handle(self, *args, **options):
+        """command entry point
+
+        """
+
+        self._Instrument = Instrument.FromOptions("loadsurvey", options)
+        try:
+            start_time = datetime.datetime.now()
+            self._Instrument.Start()
+
+            verbosity = options.get('verbosity', 1)
+            if verbosity >= 2:
+                logger.setLevel(logging.DEBUG)
+
+            with self._Instrument.Phase("find_files"):
+                artifacts = FindArtifacts(options["artifact"])
+
+            self._Project = options['project']
+            self._BatchSize = options["batch_size"]
+            self._LoadData = options["load_data"]
+            remove_path_prefix = Path(options["remove_path_prefix"])
+
+            logger.info("Survey Load Start")
+            logger.info(f" {start_time.strftime('%Y/%m/%d %H:%M:%S')}")
+            logger.info(f" Project    : {self._Project}")
+            logger.info(f" artifact   : {' '.join(options['artifact'])} ({len(artifacts)} file(s))")
+            logger.info(f" batch size : {self._BatchSize}")
+            logger.info(f" load data  : {self._LoadData and connection.vendor == 'mysql'}")
+
+            # read all artifacts before the database is written
+            symbols = SymbolTable()
+            source_files = []
+            failed = 0
+            for artifact in artifacts:
+                self._Instrument.Count("files")
+                try:
+                    with self._Instrument.Phase("read"):
+                        source_file = ReadArtifactHeader(artifact)["source"]
+                        symbols.Add(source_file, ArtifactRecords(artifact), lambda path: self._AdjustPath(path, remove_path_prefix))
+
+                except (OSError, EOFError, ValueError) as e:
+                    logger.warning(f" skip {artifact}: {e}")
+                    failed += 1
+                    continue
+
+                logger.debug(f" {artifact} ({source_file})")
+                source_files.append(source_file)
+
+            self._Instrument.Count("failed", failed)
+
+            with self._Instrument.Phase("link"):
+                linked = symbols.Link(source_files)
+
+            with self._Instrument.Phase("write_linked"), transaction.atomic():
+                self._WriteLinked(linked)
+
+            if failed > 0:
+                logger.warning(f" {failed} artifact(s) failed")
+
+        except Exception as e:
+            logger.error(f"exception {e}", exc_info=True)
+
+        finally:
+            self._Instrument.Finish()
+            logger.info(f" elapsed time {(datetime.datetime.now() - start_time).total_seconds()}")
+
+    def add_arguments(self, parser):
+        """regist command arguments
+
+        Args:
+            parser (_type_): argument parser
+        """
+
+        parser.add_argument('--project', nargs='?', default=None, type=str)
+        parser.add_argument('--remove-path-prefix', nargs='?', default="target", type=str)
+        parser.add_argument('--batch-size', nargs='?', default=self._BatchSize, type=int, help="records per multi-row INSERT")
+        parser.add_argument('--load-data', action='store_true', help="write the records by LOAD DATA LOCAL INFILE on MySQL (local_infile must be enabled)")
+        Instrument.AddArguments(parser)
+        parser.add_argument('artifact', nargs='+', type=str, help="artifact files or directories written by funcsurvey --artifact-dir")
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from ...callgraph import CallGraphSnapshot
+from ...instrument import Instrument
+
+import logging
+import datetime
+
+logger = logging.getLogger('Survey')
+
+
+class Command(BaseCommand):
+    """makesnapshot command class
+
+    Args:
+        BaseCommand (_type_): Django base command class
+    """    
+
+    help = "Make call graph snapshot file"
+
+    def handle(self, *args, **options):
+        """command entry point
+
+        """        
+        instrument = Instrument.FromOptions("makesnapshot", options)
+        try:
+            start_time = datetime.datetime.now()
+            instrument.Start()
+
+            logger.info("Make snapshot Start")
+            logger.info(f" {start_time.strftime('%Y/%m/%d %H:%M:%S')}")
+            logger.info(f" Project    : {options['project']}")
+
+            with instrument.Phase("write"):
+                funccnt, funcrelcnt = CallGraphSnapshot.Write(ProjectName=options["project"], SnapshotFile=options["save_as"])
+
+            instrument.Count("functions", funccnt)
+            instrument.Count("relations", funcrelcnt)
+            logger.info(f" {funccnt} functions, {funcrelcnt} function relations exported to {options['save_as']}")
+
+            
+        except Exception as e:
+            logger.error(f"exception {e}", exc_info=True)
+
+
+        finally:
+            instrument.Finish()
+            logger.info(f" elapsed time {(datetime.datetime.now() - start_time).total_seconds()}")
+
+    def add_arguments(self, parser):
+        """regist command arguments
+
+        Args:
+            parser (_type_): argument parser
+        """        
+
+        parser.add_argument('--project', nargs='?', default=None, type=str)
+        parser.add_argument('--save-as', nargs='?', default="clangAnalyzer.snapshot", type=str)
+        Instrument.AddArguments(parser)
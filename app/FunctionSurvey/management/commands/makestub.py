@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from ...models import Project, Function, FunctionRelation
+from ...callgraph import CallGraphSnapshot
+from ...instrument import Instrument
 
 import logging
 import datetime
@@ -24,10 +26,13 @@ class MakeStubFunctions():
         self.Functions = []
         self.CallFunctions = []
 
-    def GetFunctions(self, ProjectName:str=None, FunctionName:list=[]) -> list:
+    def GetFunctions(self, ProjectName:str=None, FunctionName:list=[], Snapshot:CallGraphSnapshot=None) -> list:
         # return the list of functions which are called another function.
         # This list is sorted by file and location.
 
+        if Snapshot is not None:
+            return self._GetSnapshotFunctions(Snapshot, FunctionName)
+
         if len(FunctionName) == 0:
             return sorted(list(set([
                 rel.call_to for rel in 
@@ -40,6 +45,16 @@ class MakeStubFunctions():
                     FunctionRelation.objects.filter(project__name=ProjectName, call_from__name__in=FunctionName).select_related('call_to')])),
                     key=lambda f: (f.file, f.line))
 
+    def _GetSnapshotFunctions(self, Snapshot:CallGraphSnapshot, FunctionName:list=[]) -> list:
+        # return the list of called functions from the call graph snapshot.
+
+        call_from = set(index for name in FunctionName for index in Snapshot.FunctionIndexes(name))
+        call_to = set(
+            to for fr, to in Snapshot.Relations()
+                if len(FunctionName) == 0 or fr in call_from)
+
+        return sorted([Snapshot.Function(index) for index in call_to], key=lambda f: (f.file, f.line))
+
     def GetExternString(self, ExportFunctions:list=None):
         # write the extern declaration of the functions which are called by the functions in ExportFunctions.
 
@@ -102,46 +117,57 @@ class Command(BaseCommand):
         """command entry point
 
         """        
+        instrument = Instrument.FromOptions("makestub", options)
         try:
             start_time = datetime.datetime.now()
+            instrument.Start()
 
             logger.info("Make stub file Start")
             logger.info(f" {start_time.strftime('%Y/%m/%d %H:%M:%S')}")
 
             stub = MakeStubFunctions()
+            with instrument.Phase("load"):
+                snapshot = CallGraphSnapshot(options["snapshot"]) if options["snapshot"] else None
 
-            if options["parent_func"] == "":
-                funcs = stub.GetFunctions(ProjectName=options["project"])
+                if options["parent_func"] == "":
+                    funcs = stub.GetFunctions(ProjectName=options["project"], Snapshot=snapshot)
 
-            else:
-                funcs = stub.GetFunctions(
-                    ProjectName=options["project"],
-                    FunctionName=options["parent_func"].split(","))
+                else:
+                    funcs = stub.GetFunctions(
+                        ProjectName=options["project"],
+                        FunctionName=options["parent_func"].split(","),
+                        Snapshot=snapshot)
 
-            externs = stub.GetExternString(funcs)
-            bodies = stub.GetFunctionBody(funcs)
+            instrument.Count("functions", len(funcs))
+
+            with instrument.Phase("render"):
+                externs = stub.GetExternString(funcs)
+                bodies = stub.GetFunctionBody(funcs)
+
+            instrument.Count("stubs", len(bodies))
 
 
             # read export template
-            with open("template-stub.h", "r") as f:
-                stub_h = f.read()
+            with instrument.Phase("write"):
+                with open("template-stub.h", "r") as f:
+                    stub_h = f.read()
 
-            with open("template-stub.c", "r") as f:
-                stub_c = f.read()
+                with open("template-stub.c", "r") as f:
+                    stub_c = f.read()
 
-            # expand the template
-            stub_h = stub_h.format(
-                content ="\n".join(externs)
-            )
-            stub_c = stub_c.format(
-                content ="\n".join(bodies)
-            )
+                # expand the template
+                stub_h = stub_h.format(
+                    content ="\n".join(externs)
+                )
+                stub_c = stub_c.format(
+                    content ="\n".join(bodies)
+                )
 
-            with open(options["save_as"] + ".h", "w") as f:
-                f.write(stub_h)
+                with open(options["save_as"] + ".h", "w") as f:
+                    f.write(stub_h)
 
-            with open(options["save_as"] + ".c", "w") as f:
-                f.write(stub_c)
+                with open(options["save_as"] + ".c", "w") as f:
+                    f.write(stub_c)
 
 
             
@@ -150,6 +176,7 @@ class Command(BaseCommand):
 
 
         finally:
+            instrument.Finish()
             logger.info(f" elapsed time {(datetime.datetime.now() - start_time).total_seconds()}")
 
     def add_arguments(self, parser):
@@ -161,4 +188,6 @@ class Command(BaseCommand):
 
         parser.add_argument('--project', nargs='?', default=None, type=str)
         parser.add_argument('--save-as', nargs='?', default="stub", type=str)
+        parser.add_argument('--snapshot', nargs='?', default=None, type=str, help="read call graph snapshot file instead of database")
         parser.add_argument('--parent-func', nargs='?', default="", type=str)
+        Instrument.AddArguments(parser)
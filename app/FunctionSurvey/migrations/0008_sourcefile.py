@@ -0,0 +1,31 @@
+# Generated by Django 5.1.5 on 2026-10-18 10:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FunctionSurvey', '0007_alter_functionrelation_call_from_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceFile',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('path', models.TextField()),
+                ('mtime', models.FloatField()),
+                ('hash', models.CharField(max_length=64)),
+                ('clang_args', models.TextField()),
+                ('includes', models.JSONField(default=dict)),
+                ('created', models.DateTimeField(auto_now=True)),
+                ('modified', models.DateTimeField(auto_now_add=True)),
+                ('project', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='source_file_project', to='FunctionSurvey.project')),
+            ],
+            options={
+                'db_table': 'source_file',
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.1.5 on 2026-10-18 10:47
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def set_file_key(apps, schema_editor):
+    """set the file key of static functions (sha1 of the file path) in chunks"""
+    Function = apps.get_model('FunctionSurvey', 'Function')
+    chunk_size = 1000
+    functions = []
+    for func in Function.objects.filter(static=True).only('id', 'file').iterator(chunk_size=chunk_size):
+        func.file_key = hashlib.sha1(func.file.encode()).hexdigest()
+        functions.append(func)
+        if len(functions) == chunk_size:
+            Function.objects.bulk_update(functions, ['file_key'], batch_size=chunk_size)
+            functions = []
+
+    Function.objects.bulk_update(functions, ['file_key'], batch_size=chunk_size)
+
+
+def remove_duplicated_relations(apps, schema_editor):
+    """keep the first record of duplicated function relations"""
+    FunctionRelation = apps.get_model('FunctionSurvey', 'FunctionRelation')
+    keep = FunctionRelation.objects.values('project', 'call_from', 'call_to', 'line').annotate(keep_id=Min('id')).values_list('keep_id', flat=True)
+    FunctionRelation.objects.exclude(call_from=None).exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FunctionSurvey', '0008_sourcefile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='function',
+            index=models.Index(fields=['project', 'name'], name='function_project_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='functionrelation',
+            index=models.Index(fields=['project', 'call_to'], name='relation_project_call_to_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='variable',
+            index=models.Index(fields=['project', 'name'], name='variable_project_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='variable',
+            index=models.Index(fields=['project', 'scope'], name='variable_project_scope_idx'),
+        ),
+        migrations.AddField(
+            model_name='function',
+            name='file_key',
+            field=models.CharField(default='', max_length=40),
+        ),
+        migrations.RunPython(set_file_key, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='function',
+            constraint=models.UniqueConstraint(fields=('project', 'name', 'file_key'), name='function_unique_name'),
+        ),
+        migrations.RunPython(remove_duplicated_relations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='functionrelation',
+            constraint=models.UniqueConstraint(fields=('project', 'call_from', 'call_to', 'line'), name='function_relation_unique_call'),
+        ),
+    ]
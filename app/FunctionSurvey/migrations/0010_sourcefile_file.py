@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FunctionSurvey', '0009_function_constraints_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sourcefile',
+            name='file',
+            field=models.TextField(default=''),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import hashlib
+
 from django.db import models
 
 class Project(models.Model):
@@ -37,6 +39,11 @@ class Function(models.Model):
         )
     arguments = models.JSONField()
     file = models.TextField()
+    # file of static function for the unique constraint (see FileKey)
+    file_key = models.CharField(
+        max_length = 40,
+        default = ""
+        )
     line = models.IntegerField()
     end_line = models.IntegerField(null=True)
 
@@ -55,10 +62,35 @@ class Function(models.Model):
 
     class Meta:
         db_table = 'function'
+        constraints = [
+            # global function is unique in project, static function is unique in file
+            models.UniqueConstraint(
+                fields=["project", "name", "file_key"],
+                name="function_unique_name"),
+        ]
+        indexes = [
+            models.Index(fields=["project", "name"], name="function_project_name_idx"),
+        ]
 
     def __str__(self):
         return f"{self.name}"
 
+    @staticmethod
+    def FileKey(Static:bool, File:str) -> str:
+        """get file key of function record
+
+        The key is the hash of the file path, so the unique constraint is indexed
+        by a short column on every backend (no conditional constraint on MySQL).
+
+        Args:
+            Static (bool): static function
+            File (str): file path
+
+        Returns:
+            str: sha1 of the file path of static function, or "" for global function
+        """
+        return hashlib.sha1(File.encode()).hexdigest() if Static else ""
+
 class FunctionRelation(models.Model):
     """Function Relation Model
     """
@@ -90,6 +122,14 @@ class FunctionRelation(models.Model):
 
     class Meta:
         db_table = 'function_relation'
+        constraints = [
+            models.UniqueConstraint(
+                fields=["project", "call_from", "call_to", "line"],
+                name="function_relation_unique_call"),
+        ]
+        indexes = [
+            models.Index(fields=["project", "call_to"], name="relation_project_call_to_idx"),
+        ]
 
     def __str__(self):
         return f"{self.call_from} -> {self.call_to}"
@@ -134,6 +174,45 @@ class Variable(models.Model):
 
     class Meta:
         db_table = 'variable'
+        indexes = [
+            models.Index(fields=["project", "name"], name="variable_project_name_idx"),
+            models.Index(fields=["project", "scope"], name="variable_project_scope_idx"),
+        ]
 
     def __str__(self):
         return f"{self.scope}::{self.name}"
+
+
+class SourceFile(models.Model):
+    """Source File Model
+    surveyed source file and its include dependencies (for incremental survey)
+    """
+
+    id = models.AutoField(primary_key=True)
+
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.CASCADE,
+        related_name='source_file_project',
+        null=True)
+
+    # absolute path, and the path written to the records (path prefix removed)
+    path = models.TextField()
+    file = models.TextField(default="")
+    mtime = models.FloatField()
+    hash = models.CharField(
+        max_length = 64
+        )
+    clang_args = models.TextField()
+
+    # included headers {absolute path: [mtime, hash, path prefix removed]}
+    includes = models.JSONField(default=dict)
+
+    created = models.DateTimeField(auto_now=True)
+    modified = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'source_file'
+
+    def __str__(self):
+        return f"{self.path}"
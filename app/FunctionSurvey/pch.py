@@ -0,0 +1,254 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shlex
+from collections import namedtuple
+from pathlib import Path
+
+import clang.cindex
+
+from .cache import FileHash, NormalizeClangArgs
+
+logger = logging.getLogger('Survey')
+
+
+# precompiled header of a source file
+#  File: precompiled header file (given to clang by -include-pch)
+#  Includes: headers in the precompiled header
+PrecompiledHeader = namedtuple("PrecompiledHeader", ["File", "Includes"])
+
+_IncludePattern = re.compile(r'^\s*#\s*include\s*([<"][^>"]+[>"])')
+_CommentPattern = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+_PragmaOncePattern = re.compile(r'^\s*#\s*pragma\s+once\b')
+_IfndefPattern = re.compile(r'^\s*#\s*(?:ifndef\s+(\w+)|if\s+!\s*defined\s*\(?\s*(\w+)\s*\)?)\s*$')
+_DefinePattern = re.compile(r'^\s*#\s*define\s+(\w+)')
+_IfPattern = re.compile(r'^\s*#\s*if')
+_EndifPattern = re.compile(r'^\s*#\s*endif\b')
+
+
+def LeadingIncludes(SourceFile:str) -> list:
+    """get the include directives at the top of the source file
+
+    Only the include block before any other code or preprocessor directive
+    is taken, since a define or a condition between them may change the headers.
+
+    Args:
+        SourceFile (str): source file
+
+    Returns:
+        list: included headers (e.g. '"foo.h"', '<stdio.h>')
+    """
+    includes = []
+    with open(SourceFile, "r", errors="replace") as f:
+        text = f.read(1 << 16)
+
+    for line in _CommentPattern.sub("", text).splitlines():
+        if line.strip() == "":
+            continue
+
+        m = _IncludePattern.match(line)
+        if m is None:
+            break
+
+        includes.append(m.group(1))
+
+    return includes
+
+
+def HasIncludeGuard(Header:str) -> bool:
+    """check the header has an include guard
+
+    The header is guarded by #pragma once, or by #ifndef (or #if !defined) of a
+    macro around the whole header which defines the macro.
+
+    Args:
+        Header (str): header file
+
+    Returns:
+        bool: the header has an include guard (False: can't be read)
+    """
+    try:
+        with open(Header, "r", errors="replace") as f:
+            text = f.read()
+
+    except OSError:
+        return False
+
+    lines = [line for line in _CommentPattern.sub("", text).splitlines() if line.strip() != ""]
+    if len(lines) == 0:
+        return True
+
+    if _PragmaOncePattern.match(lines[0]):
+        return True
+
+    m = _IfndefPattern.match(lines[0])
+    if m is None:
+        return False
+
+    # the condition closes at the end of the header, and defines the macro
+    macro = m.group(1) or m.group(2)
+    defined = False
+    depth = 0
+    for index, line in enumerate(lines):
+        if _IfPattern.match(line):
+            depth += 1
+
+        elif _EndifPattern.match(line):
+            depth -= 1
+            if depth == 0:
+                return index == len(lines) - 1 and defined
+
+        else:
+            define = _DefinePattern.match(line)
+            defined = defined or (define is not None and define.group(1) == macro)
+
+    return False
+
+
+class PchManager():
+    """precompiled headers of shared include sets
+
+    A precompiled header is built once per distinct (leading includes, clang args)
+    used by two or more source files. It is kept in PchDir and rebuilt when a
+    header in it is changed. The source file includes the headers again after
+    the precompiled header, so an include set with a header without include
+    guard is not precompiled.
+    """
+
+    def __init__(self, PchDir:str, MinFiles:int=2, SkipFunctionBodies:bool=False):
+        """initialize
+
+        Args:
+            PchDir (str): precompiled header directory
+            MinFiles (int, optional): minimum number of source files sharing an include set (Defaults to 2).
+            SkipFunctionBodies (bool, optional): function bodies in headers are skipped (Defaults to False).
+        """
+        self._PchDir = Path(PchDir)
+        self._PchDir.mkdir(parents=True, exist_ok=True)
+        self._MinFiles = MinFiles
+        self._SkipFunctionBodies = SkipFunctionBodies
+
+    def _Key(self, SourceFile:str, ClangArgs:str, Includes:list) -> str:
+        """get key of include set
+
+        The quoted includes are searched from the directory of the source file first,
+        so the directory is a part of the key.
+        """
+        key = [Includes, NormalizeClangArgs(ClangArgs)]
+        if self._SkipFunctionBodies:
+            key.append("SkipFunctionBodies")
+
+        if any(include.startswith('"') for include in Includes):
+            key.append(os.path.dirname(os.path.abspath(SourceFile)))
+
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+    def Prepare(self, SourceFiles:list, ClangArgs:dict) -> dict:
+        """build precompiled headers of the shared include sets
+
+        Args:
+            SourceFiles (list): target source files
+            ClangArgs (dict): command-line option to clang of each source file
+
+        Returns:
+            dict: {source file: PrecompiledHeader} (the files without shared include set are not in it)
+        """
+        groups = {}
+        for source_file in SourceFiles:
+            try:
+                includes = LeadingIncludes(source_file)
+            except OSError:
+                continue
+
+            if len(includes) == 0:
+                continue
+
+            key = self._Key(source_file, ClangArgs[source_file], includes)
+            groups.setdefault(key, (source_file, includes, []))[2].append(source_file)
+
+        precompiled = {}
+        for key, (source_file, includes, files) in groups.items():
+            if len(files) < self._MinFiles:
+                continue
+
+            pch = self._Build(key, source_file, ClangArgs[source_file], includes)
+            if pch is None:
+                continue
+
+            for file in files:
+                precompiled[file] = pch
+
+        logger.info(f" precompiled header: {len(set(pch.File for pch in precompiled.values()))} include set(s), {len(precompiled)} of {len(SourceFiles)} file(s)")
+        return precompiled
+
+    def _Build(self, Key:str, SourceFile:str, ClangArgs:str, Includes:list) -> PrecompiledHeader:
+        """build precompiled header (or reuse the built one)
+
+        Args:
+            Key (str): key of include set
+            SourceFile (str): a source file which uses the include set
+            ClangArgs (str): command-line option to clang
+            Includes (list): included headers
+
+        Returns:
+            PrecompiledHeader: precompiled header (None: failed to build)
+        """
+        pch_path = self._PchDir / f"{Key}.pch"
+        info_path = self._PchDir / f"{Key}.json"
+
+        # reuse while the headers are not changed
+        try:
+            with open(info_path, "r") as f:
+                info = json.load(f)
+
+            if pch_path.exists() and all(FileHash(include) == sha for include, sha in info["Includes"].items()):
+                return PrecompiledHeader(str(pch_path), list(info["Includes"]))
+
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # umbrella header of the include set
+        header_path = self._PchDir / f"{Key}.h"
+        with open(header_path, "w") as f:
+            f.writelines(f"#include {include}\n" for include in Includes)
+
+        args = shlex.split(ClangArgs) + ["-x", "c-header", "-iquote", os.path.dirname(os.path.abspath(SourceFile))]
+        index = clang.cindex.Index.create()
+        options = clang.cindex.TranslationUnit.PARSE_INCOMPLETE
+        if self._SkipFunctionBodies:
+            options |= clang.cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+
+        translation_unit = index.parse(str(header_path), args=args, options=options)
+
+        # a fatal error (e.g. missing header) stops the parse, and the result can't be saved
+        errors = [diagnostic for diagnostic in translation_unit.diagnostics if diagnostic.severity >= clang.cindex.Diagnostic.Fatal]
+        if len(errors) != 0:
+            logger.warning(f"  precompiled header of {SourceFile} is not used: {errors[0].spelling}")
+            return None
+
+        headers = list(dict.fromkeys(include.include.name for include in translation_unit.get_includes()))
+
+        # the source file includes the headers of the include set again (the nested headers are skipped by their guards)
+        unguarded = [include.include.name for include in translation_unit.get_includes() if include.depth == 1 and not HasIncludeGuard(include.include.name)]
+        if len(unguarded) != 0:
+            logger.warning(f"  precompiled header of {SourceFile} is not used: {unguarded[0]} has no include guard")
+            return None
+
+        # save to temporary file and replace, since the other process may use the same directory
+        temp_path = pch_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            translation_unit.save(str(temp_path))
+
+        except clang.cindex.TranslationUnitSaveError as e:
+            logger.warning(f"  precompiled header of {SourceFile} is not used: {e}")
+            return None
+
+        os.replace(temp_path, pch_path)
+
+        with open(info_path, "w") as f:
+            json.dump({"Includes": {header: FileHash(header) for header in headers}}, f)
+
+        logger.info(f"  build precompiled header {pch_path.name} ({len(headers)} header(s))")
+        return PrecompiledHeader(str(pch_path), headers)
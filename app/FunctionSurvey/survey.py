@@ -1,21 +1,241 @@
+import fnmatch
 import logging
+import operator
+import os
 import shlex
+import sys
+import time
 import clang.cindex
 import re
+from array import array
+from collections import namedtuple
+
+from .cache import ParseCache, NormalizeClangArgs
+from .pch import PrecompiledHeader
 
 logger = logging.getLogger('Survey')
 
+CursorKind = clang.cindex.CursorKind
+TypeKind = clang.cindex.TypeKind
+
+# libclang parse profile
+#  Options: parse options of the source file
+#  SkipHeaderBodies: function bodies in headers are skipped
+#      (libclang skips only the bodies in preamble, so it is applied to the precompiled header)
+#  KeepTranslationUnit: the translation unit is kept after the walk (Survey.TranslationUnit)
+ParseProfile = namedtuple("ParseProfile", ["Options", "SkipHeaderBodies", "KeepTranslationUnit"])
+
+PARSE_PROFILES = {
+    # full parse, the translation unit is discarded after the walk
+    "default"   : ParseProfile(0, False, False),
+    # with detailed preprocessing record (macro expansions etc.), the translation unit is kept
+    "detailed"  : ParseProfile(clang.cindex.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD, False, True),
+    # no error on incomplete input
+    "incomplete": ParseProfile(clang.cindex.TranslationUnit.PARSE_INCOMPLETE, False, False),
+    # incomplete and no function bodies in precompiled headers (the calls in inline functions of headers are not surveyed)
+    "lean"      : ParseProfile(clang.cindex.TranslationUnit.PARSE_INCOMPLETE, True, False),
+}
+
+# headers whose declarations were extracted in this process {normalized clang args: set(header path)}
+_OwnedHeaders = {}
+
+
+# clang index shared by the surveys in this process (process id, index)
+_SharedIndex = (None, None)
+
+
+def ClearOwnedHeaders():
+    """forget the header ownership of this process (start of a survey run)"""
+    _OwnedHeaders.clear()
+
+
+def SharedIndex() -> clang.cindex.Index:
+    """get clang index shared by the surveys in this process
+
+    The index is created once per process (a forked process creates its own).
+
+    Returns:
+        clang.cindex.Index: clang index
+    """
+    global _SharedIndex
+
+    pid, index = _SharedIndex
+    if pid != os.getpid():
+        index = clang.cindex.Index.create()
+        _SharedIndex = (os.getpid(), index)
+
+    return index
+
+
+def DisposeTranslationUnit(TranslationUnit:clang.cindex.TranslationUnit):
+    """dispose translation unit now instead of waiting for garbage collection
+
+    The cursors of the translation unit must not be used after this.
+
+    Args:
+        TranslationUnit (clang.cindex.TranslationUnit): translation unit
+    """
+    clang.cindex.conf.lib.clang_disposeTranslationUnit(TranslationUnit)
+    TranslationUnit.obj = TranslationUnit._as_parameter_ = None
+
+
+def IsInSystemHeader(Location:clang.cindex.SourceLocation) -> bool:
+    """check the location is in a system header
+
+    SourceLocation.is_in_system_header is not in the older python bindings,
+    so libclang is called directly in that case.
+
+    Args:
+        Location (clang.cindex.SourceLocation): source location
+
+    Returns:
+        bool: True: in a system header
+    """
+    if hasattr(clang.cindex.SourceLocation, "is_in_system_header"):
+        return Location.is_in_system_header
+
+    return bool(clang.cindex.conf.lib.clang_Location_isInSystemHeader(Location))
+
+
+class PathFilter():
+    """declaration file filter
+
+    The top-level declarations in the excluded files are pruned before
+    their children are traversed. The target source file is never excluded.
+    """
+    def __init__(self, IncludePatterns:list=None, ExcludePatterns:list=None, SkipSystemHeaders:bool=False):
+        """initialize
+
+        Args:
+            IncludePatterns (list, optional): only the files matching one of these patterns are surveyed (Defaults to None: all files).
+            ExcludePatterns (list, optional): the files matching one of these patterns are not surveyed (Defaults to None).
+            SkipSystemHeaders (bool, optional): system headers are not surveyed (Defaults to False).
+        """
+        self.IncludePatterns = list(IncludePatterns or [])
+        self.ExcludePatterns = list(ExcludePatterns or [])
+        self.SkipSystemHeaders = SkipSystemHeaders
+
+        # decision of each file {file name: excluded}
+        self._Excluded = {}
+
+    def IsEmpty(self) -> bool:
+        """check the filter excludes nothing"""
+        return not (self.IncludePatterns or self.ExcludePatterns or self.SkipSystemHeaders)
+
+    def Key(self) -> list:
+        """get filter options (a part of cache key)"""
+        return [self.IncludePatterns, self.ExcludePatterns, self.SkipSystemHeaders]
+
+    def IsExcluded(self, FileName:str, Location:clang.cindex.SourceLocation) -> bool:
+        """check the file is excluded
+
+        The decision is made once per file.
+
+        Args:
+            FileName (str): file of the declaration
+            Location (clang.cindex.SourceLocation): location of the declaration
+
+        Returns:
+            bool: True: excluded
+        """
+        excluded = self._Excluded.get(FileName)
+        if excluded is None:
+            paths = (FileName, os.path.abspath(FileName))
+            excluded = (
+                (len(self.IncludePatterns) != 0 and not any(fnmatch.fnmatchcase(path, pattern) for path in paths for pattern in self.IncludePatterns))
+                or any(fnmatch.fnmatchcase(path, pattern) for path in paths for pattern in self.ExcludePatterns)
+                or (self.SkipSystemHeaders and IsInSystemHeader(Location))
+            )
+            self._Excluded[FileName] = excluded
+
+        return excluded
+
+
+# function argument (an element of Function.arguments)
+Argument = namedtuple("Argument", ["Type", "CanonicalType", "Declear", "IsPointer", "IsConst", "Name"])
+
+# function call in function body (FunctionDecl.CallFunctions)
+CallSite = namedtuple("CallSite", ["Name", "Line"])
+
+
+class _Record:
+    """base class of survey record
+
+    The attributes are in __slots__, and the record is pickled (sent from worker
+    process) and cached as the tuple of slot values.
+    """
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # getter of all slot values and setters of each slot (both run in C)
+        cls._GetState = operator.attrgetter(*cls.__slots__)
+        cls._SetState = tuple(getattr(cls, name).__set__ for name in cls.__slots__)
+
+    def __getstate__(self) -> tuple:
+        return self._GetState(self)
+
+    def __setstate__(self, State:tuple):
+        for setter, value in zip(self._SetState, State):
+            setter(self, value)
+
+    def __eq__(self, Other) -> bool:
+        return isinstance(Other, _Record) and self.__slots__ == Other.__slots__ and self.__getstate__() == Other.__getstate__()
+
+    def Copy(self, **Changes) -> "_Record":
+        """copy record
+
+        Args:
+            Changes: attributes changed in the copy
+
+        Returns:
+            _Record: copied record
+        """
+        record = type(self).__new__(type(self))
+        record.__setstate__(self.__getstate__())
+        for name, value in Changes.items():
+            setattr(record, name, value)
+
+        return record
+
+    def ToJson(self) -> list:
+        """get JSON value of record (slot values)"""
+        return list(self.__getstate__())
+
+    @classmethod
+    def FromJson(cls, Values:list) -> "_Record":
+        """make record from JSON value
+
+        Args:
+            Values (list): slot values
+
+        Returns:
+            _Record: record
+        """
+        record = cls.__new__(cls)
+        record.__setstate__(Values)
+        return record
+
 
-class FunctionDecl:
+class FunctionDecl(_Record):
     """関数解析クラス
-    """    
+    """
+    __slots__ = (
+        "Name", "File", "Line", "EndLine", "IsPrototype", "IsStatic", "IsConst",
+        "IncludeFor", "IncludeIf", "IncludeSwitch", "IncludeWhile", "IncludeDo",
+        "Args", "ReturnType", "CallNames", "CallLines",
+    )
+
     def __init__(self, FunctionName:str):
         """初期化
 
         Args:
             FunctionName (str): 関数名
         """        
-        self.Name = FunctionName
+        self.Name = sys.intern(FunctionName)
+        self.File = ""
+        self.Line = 0
+        self.EndLine = 0
         self.IsPrototype = True
         self.IsStatic = False
         self.IsConst = False
@@ -25,30 +245,57 @@ class FunctionDecl:
         self.IncludeWhile = False
         self.IncludeDo = False
         self.Args = []
-        self.ReturnType = {}
-        self.CallFunctions = []
+        self.ReturnType = ""
+        # call sites in columns (called function names and lines)
+        self.CallNames = []
+        self.CallLines = array("I")
+
+    def ToJson(self) -> list:
+        values = super().ToJson()
+        values[self.__slots__.index("CallLines")] = self.CallLines.tolist()
+        return values
+
+    @classmethod
+    def FromJson(cls, Values:list) -> "FunctionDecl":
+        record = super().FromJson(Values)
+        record.Args = [Argument(*arg) for arg in record.Args]
+        record.CallNames = [sys.intern(name) for name in record.CallNames]
+        record.CallLines = array("I", record.CallLines)
+        return record
+
+    @property
+    def CallFunctions(self) -> list:
+        """関数呼び出しリスト
 
+        Returns:
+            list: CallSite list
+        """
+        return list(map(CallSite._make, zip(self.CallNames, self.CallLines)))
 
-    def AddArg(self, cursor:clang.cindex.Cursor, Void:bool = False):
+    def AddArg(self, cursor:clang.cindex.Cursor, Void:bool = False, Var:"VarDecl" = None):
         """関数引数追加
 
         Args:
             cursor (clang.cindex.Cursor): 要素カーソル
+            Var (VarDecl, optional): 解析済みの引数 (Defaults to None: cursorから解析する)
         """        
-        if Void == False:
+        if Var is not None:
+            var = Var
+
+        elif Void == False:
             var = VarDecl(cursor=cursor)
 
         else:
             var = VarDecl(cursor=cursor, Void=True)
  
-        self.Args.append({
-            "Type"  : var.Type,
-            "CanonicalType"  : cursor.type.get_canonical().spelling,
-            "Declear"  : var.Declear,
-            "IsPointer"  : var.IsPointer,
-            "IsConst"   : var.IsConst,
-            "Name"  : var.Name
-        })
+        self.Args.append(Argument(
+            Type            = var.Type,
+            CanonicalType   = sys.intern(cursor.type.get_canonical().spelling),
+            Declear         = var.Declear,
+            IsPointer       = var.IsPointer,
+            IsConst         = var.IsConst,
+            Name            = var.Name,
+        ))
 
     def GetArgs(self) -> list:
         """関数引数取得
@@ -64,29 +311,38 @@ class FunctionDecl:
         Args:
             cursor (clang.cindex.Cursor): 関数呼び出し要素カーソル
         """        
-        if cursor.spelling not in self.CallFunctions:
-            self.CallFunctions.append({
-                "Name"  : cursor.spelling,
-                "Line"  : cursor.location.line,
-                })
+        self.CallNames.append(sys.intern(cursor.spelling))
+        self.CallLines.append(cursor.location.line)
+
+    def ClearCallFunctions(self):
+        """関数呼び出しをクリア"""
+        self.CallNames = []
+        self.CallLines = array("I")
 
 
     def __str__(self):
         """文字列化
         """
 
-        return f"{self.Name}({','.join([f'{ArgName}:{ArgType}' for ArgName, ArgType in self.Args])})"
+        return f"{self.Name}({','.join([f'{arg.Name}:{arg.Type}' for arg in self.Args])})"
 
 
 
-class VarDecl:
+class VarDecl(_Record):
     """変数解析クラス
-    """    
-    def __init__(self, cursor:clang.cindex.Cursor, Scope:str = None, Void:bool = False):
+    """
+    __slots__ = (
+        "Scope", "Type", "Name", "File", "Line", "IsArray", "ArraySize", "FunctionPointer",
+        "IsPointer", "IsExtern", "IsStatic", "IsArgument", "IsConst", "Declear",
+    )
+
+    def __init__(self, cursor:clang.cindex.Cursor, Scope:str = None, Void:bool = False, SearchChildren:bool = True):
         """初期化
 
         Args:
             cursor (clang.cindex.Cursor): 要素カーソル
+            SearchChildren (bool, optional): 子ノードから関数ポインタを探す (Defaults to True).
+                Falseの時は呼び出し側の走査でFunctionPointerを追加する。
         """        
 
         # return void
@@ -94,12 +350,12 @@ class VarDecl:
             self.Scope = Scope
             self.Type = "void"
             self.Name = ""
-            self.File = cursor.location.file.name
+            self.File = sys.intern(cursor.location.file.name)
             self.Line = cursor.location.line
 
             self.IsArray = False
             self.ArraySize = False
-            self.FunctionPointer = []
+            self.FunctionPointer = ()
 
             self.IsPointer = False
             self.IsExtern = False
@@ -112,14 +368,14 @@ class VarDecl:
         # set variable
         else:
             self.Scope = Scope
-            self.Type = self._get_type_name(cursor.type)
+            self.Type = sys.intern(self._get_type_name(cursor.type))
             self.Name = cursor.spelling
-            self.File = cursor.location.file.name
+            self.File = sys.intern(cursor.location.file.name)
             self.Line = cursor.location.line
 
             self.IsArray = "ARRAY" in cursor.type.kind.name
             self.ArraySize = cursor.type.get_array_size()
-            self.FunctionPointer = []
+            self.FunctionPointer = ()
 
             self.IsPointer = self.IsArray or cursor.type.kind.name  == "POINTER"
             self.IsExtern = cursor.storage_class.name == "EXTERN"
@@ -135,7 +391,22 @@ class VarDecl:
             if m != None:
                 self.Declear = f"{m.group(1) if m.group(1) != None else ''} {m.group(2).strip()} {cursor.spelling}{m.group(3) if m.group(3) != None else ''}"
 
-            self._ProcParse(cursor)
+            if SearchChildren:
+                self._ProcParse(cursor)
+
+    @classmethod
+    def FromJson(cls, Values:list) -> "VarDecl":
+        record = super().FromJson(Values)
+        record.FunctionPointer = tuple(record.FunctionPointer)
+        return record
+
+    def AddFunctionPointer(self, FunctionName:str):
+        """関数ポインタ追加 (ほとんどの変数は持たないので空のタプルを共有する)
+
+        Args:
+            FunctionName (str): 関数名
+        """
+        self.FunctionPointer += (sys.intern(FunctionName),)
 
 
     def _get_type_name(self, cursor:clang.cindex.Cursor):
@@ -159,15 +430,18 @@ class VarDecl:
 
         return ret
 
-    def _ProcParse(self, cursor:clang.cindex.Cursor, depth:int=0):
+    def _ProcParse(self, cursor:clang.cindex.Cursor):
 
-        # check function pointer
-        if cursor.type.kind.name == "FUNCTIONPROTO":
-            self.FunctionPointer.append(cursor.spelling)
+        # search the subtree in pre-order by explicit stack
+        stack = [cursor]
+        while stack:
+            node = stack.pop()
 
-        # search children
-        for child in cursor.get_children():
-            self._ProcParse(cursor=child, depth = depth + 1)
+            # check function pointer
+            if node.type.kind is TypeKind.FUNCTIONPROTO:
+                self.AddFunctionPointer(node.spelling)
+
+            stack.extend(reversed(list(node.get_children())))
 
 
     def __str__(self):
@@ -177,20 +451,102 @@ class VarDecl:
         return f"{self.Name}({','.join([f'{ArgName}:{ArgType}' for ArgName, ArgType in self.Args])})"
 
 
+# summary of a survey (the last record of the stream of Survey.Iterate())
+#  Includes: transitively included headers
+#  HeaderFunctions: functions declared in the headers extracted by this survey (with OwnedHeaders)
+#  Stats: {"parse": seconds, "walk": seconds, "nodes": AST nodes visited, "cache_hit": 0 or 1}
+SurveySummary = namedtuple("SurveySummary", ["Includes", "HeaderFunctions", "Stats"])
+
+
+class SurveyError(Exception):
+    """survey of a source file failed (raised by the record stream of StreamFile)"""
+    pass
+
+
+def ResultRecords(Result:dict):
+    """make record stream of survey result
+
+    Args:
+        Result (dict): survey result
+
+    Yields:
+        FunctionDecl | VarDecl | SurveySummary: records and summary
+    """
+    yield from Result["Functions"].values()
+    yield from Result["Variables"]
+    yield SurveySummary(Result["Includes"], Result["HeaderFunctions"], Result.get("Stats", {}))
+
+
+def ResultToJson(Result:dict) -> dict:
+    """convert survey result to JSON value
+
+    Args:
+        Result (dict): survey result
+
+    Returns:
+        dict: survey result of JSON value (the records are lists of slot values)
+    """
+    return {
+        "Functions"  : {name: func.ToJson() for name, func in Result["Functions"].items()},
+        "Variables"  : [var.ToJson() for var in Result["Variables"]],
+        "Includes"   : Result["Includes"],
+        "HeaderFunctions" : {name: func.ToJson() for name, func in Result["HeaderFunctions"].items()},
+    }
+
+
+def ResultFromJson(Data:dict) -> dict:
+    """convert JSON value to survey result
+
+    Args:
+        Data (dict): survey result of JSON value (ResultToJson)
+
+    Returns:
+        dict: survey result
+    """
+    return {
+        "Functions"  : {sys.intern(name): FunctionDecl.FromJson(func) for name, func in Data["Functions"].items()},
+        "Variables"  : [VarDecl.FromJson(var) for var in Data["Variables"]],
+        "Includes"   : Data["Includes"],
+        "HeaderFunctions" : {sys.intern(name): FunctionDecl.FromJson(func) for name, func in Data["HeaderFunctions"].items()},
+    }
+
+
 class Survey():
     help = "survey source file"
 
-    def __init__(self, TargetSourceFile:str="", ClangArgs:str=""):
+    def __init__(self, TargetSourceFile:str="", ClangArgs:str="", Cache:ParseCache=None, OwnedHeaders:set=None, Filter:PathFilter=None, Pch:PrecompiledHeader=None, Profile:str="default", Index:clang.cindex.Index=None, Variables:bool=True):
         """initialize
 
         Args:
             TargetSourceFile (str, optional): Analyzing target file (Defaults to "").
             ClangArgs (str, optional): command-line option to clang (Defaults to "").
-        """        
+            Cache (ParseCache, optional): survey result cache (Defaults to None).
+            OwnedHeaders (set, optional): headers whose declarations were already extracted
+                under the same clang args (Defaults to None: extract all headers).
+                The top-level declarations of these headers are skipped, and the headers
+                extracted by this survey are added to the set.
+            Filter (PathFilter, optional): declaration file filter (Defaults to None: no filter).
+            Pch (PrecompiledHeader, optional): precompiled header of the leading includes (Defaults to None).
+            Profile (str, optional): parse profile name in PARSE_PROFILES (Defaults to "default").
+            Index (clang.cindex.Index, optional): clang index (Defaults to None: create for this survey).
+            Variables (bool, optional): survey variables (Defaults to True). Without variables,
+                no VarDecl is yielded and the function pointers in the initializers are not surveyed.
+        """
         self._TargetSourceFile = TargetSourceFile
         self._ClangArgs = ClangArgs
+        self._Cache = Cache
+        self._OwnedHeaders = OwnedHeaders
+        self._Filter = Filter if Filter is not None and not Filter.IsEmpty() else None
+        self._Pch = Pch
+        self._Profile = Profile
+        self._Index = Index
+        self._SurveyVariables = Variables
+        self.TranslationUnit = None
+        self._ExtractedHeaders = set()
+        self._HeaderFunctions = {}
         self._Functions = {}
         self._Variables = []
+        self._NodeCount = 0
 
     def Survey(self) -> dict:
         """function survey
@@ -198,70 +554,222 @@ class Survey():
         make AST and dump it.
 
         """
+        functions = {}
+        variables = []
+        for record in self.Iterate():
+            if isinstance(record, FunctionDecl):
+                functions[record.Name] = record
 
-        index = clang.cindex.Index.create()
-        translation_unit = index.parse(self._TargetSourceFile, args=shlex.split(self._ClangArgs))
-        self._dump_node(translation_unit.cursor)
+            elif isinstance(record, VarDecl):
+                variables.append(record)
+
+            else:
+                summary = record
 
         return {
-            "Functions"  :self._Functions,
-            "Variables"  :self._Variables,
+            "Functions"  :functions,
+            "Variables"  :variables,
+            "Includes"   :summary.Includes,
+            "HeaderFunctions" :summary.HeaderFunctions,
+            "Stats"      :summary.Stats,
         }
 
+    def Iterate(self):
+        """function survey (record stream)
+
+        The records are yielded while the AST is walked: each function is followed
+        by its argument and local variables, and a global variable is yielded by itself.
+        A function of the same name may be yielded again (e.g. prototype and definition);
+        the later one replaces the former. The translation unit is disposed even if the
+        stream is not consumed to the end.
+
+        Yields:
+            FunctionDecl | VarDecl | SurveySummary: records, and the summary at the end
+        """
+
+        # reuse the result when the source, headers and clang args are not changed
+        if self._Cache is not None:
+            cached = self._Cache.Get(self._TargetSourceFile, self._ClangArgs, self._CacheOptions())
+            if cached is not None:
+                result = ResultFromJson(cached)
+                result["Stats"] = {"parse": 0.0, "walk": 0.0, "nodes": 0, "cache_hit": 1}
+                yield from ResultRecords(result)
+                return
+
+        profile = PARSE_PROFILES[self._Profile]
+        index = self._Index if self._Index is not None else clang.cindex.Index.create()
+        args = shlex.split(self._ClangArgs)
+        if self._Pch is not None:
+            args += ["-include-pch", self._Pch.File]
+
+        start = time.perf_counter()
+        translation_unit = index.parse(self._TargetSourceFile, args=args, options=profile.Options)
+        parse = time.perf_counter() - start
+        try:
+            # a cached result must be complete
+            functions = {}
+            variables = []
+
+            # the walk time excludes the time of the consumer
+            walk = 0.0
+            start = time.perf_counter()
+            for record in self._IterateNodes(translation_unit.cursor):
+                walk += time.perf_counter() - start
+                if self._Cache is not None:
+                    if isinstance(record, FunctionDecl):
+                        functions[record.Name] = record
+                    else:
+                        variables.append(record)
+
+                yield record
+                start = time.perf_counter()
+
+            walk += time.perf_counter() - start
+
+            # the headers are owned after the survey succeeded
+            if self._OwnedHeaders is not None:
+                self._OwnedHeaders.update(self._ExtractedHeaders)
+
+            summary = SurveySummary(
+                # the headers in precompiled header are not reported by get_includes()
+                Includes = list(dict.fromkeys((self._Pch.Includes if self._Pch is not None else []) + [include.include.name for include in translation_unit.get_includes()])),
+                HeaderFunctions = self._HeaderFunctions,
+                Stats = {"parse": parse, "walk": walk, "nodes": self._NodeCount, "cache_hit": 0},
+            )
+
+        finally:
+            if profile.KeepTranslationUnit:
+                self.TranslationUnit = translation_unit
+
+            else:
+                DisposeTranslationUnit(translation_unit)
+
+        if self._Cache is not None:
+            result = {"Functions": functions, "Variables": variables, "Includes": summary.Includes, "HeaderFunctions": summary.HeaderFunctions}
+            self._Cache.Put(
+                self._TargetSourceFile,
+                self._ClangArgs,
+                Options = self._CacheOptions(),
+                Includes = summary.Includes,
+                Result = ResultToJson(result))
+
+        yield summary
+
+    def _CacheOptions(self) -> list:
+        """get survey options which change the result (a part of cache key)"""
+        options = []
+        if self._Filter is not None:
+            options.append(self._Filter.Key())
+
+        if PARSE_PROFILES[self._Profile].SkipHeaderBodies and self._Pch is not None:
+            options.append("SkipHeaderBodies")
+
+        if not self._SurveyVariables:
+            options.append("NoVariables")
+
+        return options or None
+
     def _show_node_tree(self, cursor:clang.cindex.Cursor, depth:int=0):
         for child in cursor.get_children():
                 self._show_node_tree(child, depth + 1)
 
-    def _dump_node(self, cursor:clang.cindex.Cursor):
-        """ファイル全体を解析する
+    def _IterateNodes(self, cursor:clang.cindex.Cursor):
+        """ファイル全体を解析し、解析したレコードを順に返す
 
         Args:
             cursor (clang.cindex.Cursor): カーソル
+
+        Yields:
+            FunctionDecl | VarDecl: 関数 (引数と局所変数が続く) または大域変数
         """
 
+        owned_headers = self._OwnedHeaders
+        path_filter = self._Filter
+
         # 関数ノード取得
         for child in cursor.get_children():
-#            if child.location.file.name != self._TargetSourceFile:
-#                continue
+            self._NodeCount += 1
+            kind = child.kind
+            if kind is not CursorKind.FUNCTION_DECL and kind is not CursorKind.VAR_DECL:
+                continue
+
+            if owned_headers is not None or path_filter is not None:
+                location = child.location
+                file = location.file
+                file_name = file.name if file is not None else None
+                if file_name != self._TargetSourceFile:
+                    # prune excluded files
+                    if path_filter is not None and file_name is not None and path_filter.IsExcluded(file_name, location):
+                        continue
+
+                    # skip the declarations of headers extracted by the former translation units
+                    if owned_headers is not None:
+                        if file_name in owned_headers:
+                            continue
+
+                        self._ExtractedHeaders.add(file_name)
+
+                        # keep the header declaration, the definition in the target file may replace it
+                        if kind is CursorKind.FUNCTION_DECL:
+                            func = self._ProcFunctionDecl(child)
+                            self._HeaderFunctions[func.Name] = func.Copy()
+                            yield func
+                            yield from self._FlushVariables()
+                            continue
 
             # declear function
-            if child.kind.name == "FUNCTION_DECL":
-                self._ProcFunctionDecl(child)
+            if kind is CursorKind.FUNCTION_DECL:
+                yield self._ProcFunctionDecl(child)
+                yield from self._FlushVariables()
+
+            elif kind is CursorKind.VAR_DECL and self._SurveyVariables:
+                yield VarDecl(cursor=child, Scope = None)
 
-            elif child.kind.name == "VAR_DECL":
-                self._Variables.append(vars(VarDecl(cursor=child, Scope = None)))
+    def _FlushVariables(self) -> list:
+        """解析中の関数の変数を取り出す"""
+        variables = self._Variables
+        self._Variables = []
+        return variables
 
 
-    def _ProcFunctionDecl(self, cursor:clang.cindex.Cursor):
+    def _ProcFunctionDecl(self, cursor:clang.cindex.Cursor) -> FunctionDecl:
         """関数ノード内処理
         ソース内の関数プロトタイプ部分と関数本体部分の2回呼び出される。
         child.kind.name == "COMPOUND_STMT"の時、本体部分になる
+        引数と局所変数は_Variablesに追加される。
 
         Args:
             cursor (clang.cindex.Cursor): 関数ノードへのカーソル
+
+        Returns:
+            FunctionDecl: 解析した関数
         """    
         
         AnalysisedFunction = FunctionDecl(FunctionName=cursor.spelling)
-        AnalysisedFunction.File = f"{cursor.location.file.name}"
-        AnalysisedFunction.Line = f"{cursor.location.line}"
-        AnalysisedFunction.EndLine = f"{cursor.extent.end.line}"
+        AnalysisedFunction.File = sys.intern(cursor.location.file.name)
+        AnalysisedFunction.Line = cursor.location.line
+        AnalysisedFunction.EndLine = cursor.extent.end.line
         AnalysisedFunction.IsPrototype = True
         AnalysisedFunction.IsStatic = cursor.storage_class.name=="STATIC"
         AnalysisedFunction.IsConst = cursor.is_const_method()
-        AnalysisedFunction.ReturnType = cursor.type.get_result().spelling
+        AnalysisedFunction.ReturnType = sys.intern(cursor.type.get_result().spelling)
         
 
         logger.debug(f"analysing {AnalysisedFunction.Name} ...")
 
         # 子ノードを解析
         for child in cursor.get_children():
+            kind = child.kind
+
             # 引数の解析
-            if child.kind.name == "PARM_DECL":
-                AnalysisedFunction.AddArg(child)
-                self._Variables.append(vars(VarDecl(cursor=child, Scope = AnalysisedFunction.Name)))
+            if kind is CursorKind.PARM_DECL:
+                var = VarDecl(cursor=child, Scope = AnalysisedFunction.Name)
+                AnalysisedFunction.AddArg(child, Var=var)
+                if self._SurveyVariables:
+                    self._Variables.append(var)
 
             # 関数内処理の解析
-            elif child.kind.name == "COMPOUND_STMT":
+            elif kind is CursorKind.COMPOUND_STMT:
                 self._ProcCompoundStmt(
                     cursor=child,
                     AnalysisedFunction=AnalysisedFunction)
@@ -271,65 +779,84 @@ class Survey():
         if len(AnalysisedFunction.GetArgs()) == 0:
             AnalysisedFunction.AddArg(cursor, Void=True)
                 
-        # 関数定義登録
-        self._Functions[AnalysisedFunction.Name] = vars(AnalysisedFunction)
+        return AnalysisedFunction
 
 
     def _ProcCompoundStmt(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
         """関数内処理抽出
+        関数本体の各ノードを1回だけ前順で走査する。
+        深いネストでも再帰しないように明示的なスタックを使い、
+        ノード種別ごとの処理は_Handlersから引く。
 
         Args:
             cursor (clang.cindex.Cursor): 関数へのカーソル
-            FunctionName (str): 関数名
-        """    
-        for child in cursor.get_children():
-            self._ProcParse(cursor=child, AnalysisedFunction=AnalysisedFunction)
+            AnalysisedFunction (FunctionDecl): 解析中の関数
+        """
+        handlers = self._Handlers
 
-    def _ProcParse(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
-        """関数内処理ごとの解析
+        # (cursor, variable declarations which contain the cursor)
+        stack = [(child, ()) for child in reversed(list(cursor.get_children()))]
+        nodes = 0
+        while stack:
+            node, owners = stack.pop()
+            nodes += 1
 
-        Args:
-            cursor (clang.cindex.Cursor): 処理へのカーソル
-            FunctionName (str): 関数名
-        """    
+            handler = handlers.get(node.kind)
+            if handler is not None:
+                var = handler(self, node, AnalysisedFunction)
 
-        # check using statements
-        if cursor.kind.name == "FOR_STMT":
-            AnalysisedFunction.IncludeFor = True
+                # the subtree of variable declaration is searched for function pointer
+                if var is not None:
+                    owners = owners + (var,)
 
-        if cursor.kind.name == "IF_STMT":
-            AnalysisedFunction.IncludeIf = True
+            # check function pointer
+            if owners and node.type.kind is TypeKind.FUNCTIONPROTO:
+                for var in owners:
+                    var.AddFunctionPointer(node.spelling)
 
-        if cursor.kind.name == "SWITCH_STMT":
-            AnalysisedFunction.IncludeSwitch = True
+            # search children
+            stack.extend((child, owners) for child in reversed(list(node.get_children())))
 
-        if cursor.kind.name == "WHILE_STMT":
-            AnalysisedFunction.IncludeWhile = True
+        self._NodeCount += nodes
 
-        if cursor.kind.name == "DO_STMT":
-            AnalysisedFunction.IncludeDo = True
+    def _ProcFor(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
+        AnalysisedFunction.IncludeFor = True
 
-        # 関数呼び出しの判定
-        if cursor.kind.name == "CALL_EXPR":
-            AnalysisedFunction.AddCallFunction(cursor)
+    def _ProcIf(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
+        AnalysisedFunction.IncludeIf = True
 
-        # analyze variable declaration
-        elif cursor.kind.name == "VAR_DECL":
-            self._Variables.append(vars(VarDecl(cursor=cursor, Scope = AnalysisedFunction.Name)))
+    def _ProcSwitch(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
+        AnalysisedFunction.IncludeSwitch = True
 
-        # analyze binary operation
-#        elif cursor.kind.name == "BINARY_OPERATOR":
-#            self._show_node_tree(cursor, 0)
-#            ref, write = self._ProcBinaryOperator(cursor=cursor, AnalysisedFunction = AnalysisedFunction)
+    def _ProcWhile(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
+        AnalysisedFunction.IncludeWhile = True
 
-        # get struct member
-#        elif cursor.kind.name == "MEMBER_REF_EXPR":
-#            struct_member = ".".join(self._ProcMemberRefExpr(cursor=cursor, AnalysisedFunction = AnalysisedFunction))
-#            skip_children = True
+    def _ProcDo(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
+        AnalysisedFunction.IncludeDo = True
 
-        # search children
-        for child in cursor.get_children():
-            self._ProcParse(cursor=child, AnalysisedFunction=AnalysisedFunction)
+    def _ProcCallExpr(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
+        # 関数呼び出し
+        AnalysisedFunction.AddCallFunction(cursor)
+
+    def _ProcVarDecl(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl) -> VarDecl:
+        # analyze variable declaration (function pointers are added by the caller's traversal)
+        if not self._SurveyVariables:
+            return None
+
+        var = VarDecl(cursor=cursor, Scope = AnalysisedFunction.Name, SearchChildren = False)
+        self._Variables.append(var)
+        return var
+
+    # handler of each cursor kind in function body
+    _Handlers = {
+        CursorKind.FOR_STMT     : _ProcFor,
+        CursorKind.IF_STMT      : _ProcIf,
+        CursorKind.SWITCH_STMT  : _ProcSwitch,
+        CursorKind.WHILE_STMT   : _ProcWhile,
+        CursorKind.DO_STMT      : _ProcDo,
+        CursorKind.CALL_EXPR    : _ProcCallExpr,
+        CursorKind.VAR_DECL     : _ProcVarDecl,
+    }
 
     def _ProcBinaryOperator(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
         pass
@@ -370,6 +897,71 @@ class Survey():
         return names
 
 
+def _FileSurvey(TargetSourceFile:str, ClangArgs:str, CacheDir:str, Filter:PathFilter, Pch:PrecompiledHeader, Profile:str, Variables:bool) -> Survey:
+    """make Survey of one source file in this process (see SurveyFile)"""
+    return Survey(
+        TargetSourceFile = TargetSourceFile,
+        ClangArgs = ClangArgs,
+        Cache = ParseCache(CacheDir) if CacheDir else None,
+        OwnedHeaders = None if CacheDir else _OwnedHeaders.setdefault(tuple(NormalizeClangArgs(ClangArgs)), set()),
+        Filter = Filter,
+        Pch = Pch,
+        Profile = Profile,
+        Index = SharedIndex(),
+        Variables = Variables,
+    )
+
+
+def SurveyFile(TargetSourceFile:str, ClangArgs:str="", CacheDir:str=None, Filter:PathFilter=None, Pch:PrecompiledHeader=None, Profile:str="default", Variables:bool=True) -> tuple:
+    """survey one source file (process pool worker)
+
+    This function does not touch the database, so it can run in a worker process.
+    The clang index is shared by the surveys in the process.
+    An exception is logged and reported as an empty result so that one broken file
+    doesn't stop a whole tree survey.
+
+    Args:
+        TargetSourceFile (str): Analyzing target file
+        ClangArgs (str, optional): command-line option to clang (Defaults to "").
+        CacheDir (str, optional): survey result cache directory (Defaults to None: no cache).
+            Without cache, the declarations of a header are extracted once per process and clang args,
+            by the first surveyed file which includes it. A cached result must be complete,
+            so every header is extracted with cache.
+        Filter (PathFilter, optional): declaration file filter (Defaults to None: no filter).
+        Pch (PrecompiledHeader, optional): precompiled header of the leading includes (Defaults to None).
+        Profile (str, optional): parse profile name in PARSE_PROFILES (Defaults to "default").
+        Variables (bool, optional): survey variables (Defaults to True).
+
+    Returns:
+        tuple: (TargetSourceFile, survey result or None)
+    """
+    try:
+        return TargetSourceFile, _FileSurvey(TargetSourceFile, ClangArgs, CacheDir, Filter, Pch, Profile, Variables).Survey()
+
+    except Exception as e:
+        logger.error(f"survey failed {TargetSourceFile}: {e}", exc_info=True)
+        return TargetSourceFile, None
+
+
+def StreamFile(TargetSourceFile:str, ClangArgs:str="", CacheDir:str=None, Filter:PathFilter=None, Pch:PrecompiledHeader=None, Profile:str="default", Variables:bool=True):
+    """survey one source file as record stream (in this process)
+
+    The source file is parsed when the stream is consumed, so the records can be
+    written while the AST is walked. The arguments are the same as SurveyFile.
+    An exception of the survey is logged and raised as SurveyError, so the consumer
+    can discard the records of the file.
+
+    Yields:
+        FunctionDecl | VarDecl | SurveySummary: records, and the summary at the end
+    """
+    try:
+        yield from _FileSurvey(TargetSourceFile, ClangArgs, CacheDir, Filter, Pch, Profile, Variables).Iterate()
+
+    except Exception as e:
+        logger.error(f"survey failed {TargetSourceFile}: {e}", exc_info=True)
+        raise SurveyError(TargetSourceFile) from e
+
+
 if __name__ == "__main__":
     survey = Survey(
         TargetSourceFile="target/usv/prm/paxcmp.c",
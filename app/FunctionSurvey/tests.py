@@ -1,3 +1,867 @@
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection, transaction, IntegrityError, DatabaseError
+from django.db.backends.utils import CursorWrapper
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import clang.cindex
+from openpyxl import load_workbook
+
+from .models import Project, Function, FunctionRelation, Variable, SourceFile
+from .management.commands.exportdb import Command as ExportDbCommand
+from .management.commands.funcsurvey import Command as FuncSurveyCommand
+from .exporter import ExportTables, CsvWriter
+from .survey import Survey, PathFilter, VarDecl, SurveySummary
+from .compdb import LoadCompileCommands, GroupCompileCommands
+from .pch import PchManager, LeadingIncludes, HasIncludeGuard
+from .worker import SurveyWorkerPool
+from .instrument import Instrument, MergeReports
+from .callgraph import CallGraph
+from .artifact import FindArtifacts
+from benchmark.corpus import CorpusConfig, GenerateCorpus
+
+
+def make_project(ProjectName:str, FunctionCount:int) -> Project:
+    """make project which has FunctionCount functions calling the next function
+
+    Args:
+        ProjectName (str): project name
+        FunctionCount (int): number of functions
+
+    Returns:
+        Project: project record
+    """
+    project = Project.objects.create(name=ProjectName)
+    Function.objects.bulk_create([
+        Function(
+            project=project,
+            name=f"func{index}",
+            return_type="int",
+            arguments=[{"Type": "int", "Name": "a"}],
+            file=f"src/file{index % 3}.c",
+            line=index * 10 + 1,
+            end_line=index * 10 + 5)
+        for index in range(FunctionCount)
+    ])
+    functions = list(Function.objects.filter(project=project).order_by("id"))
+    FunctionRelation.objects.bulk_create(
+        [
+            FunctionRelation(project=project, call_from=functions[index], call_to=functions[index + 1], file=functions[index].file, line=functions[index].line + 1)
+            for index in range(FunctionCount - 1)
+        ] + [
+            # function pointer
+            FunctionRelation(project=project, call_from=None, call_to=functions[0], file=functions[0].file, line=functions[0].line)
+        ])
+
+    return project
+
+
+class SourceTreeMixin:
+    """source files in a temporary directory surveyed by funcsurvey
+
+    setUp() writes _Sources ({path relative to _Root: source}) in a new temporary directory _Root,
+    which is removed after the test.
+    """
+
+    _Sources = {}
+
+    def setUp(self):
+        super().setUp()
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self._Root = Path(tempdir.name)
+        self._WriteSources(self._Sources)
+
+    def _WriteSources(self, Sources:dict):
+        for name, source in Sources.items():
+            (self._Root / name).parent.mkdir(parents=True, exist_ok=True)
+            (self._Root / name).write_text(source)
+
+    def _FuncSurvey(self, *Targets, Options:list=(), ProjectName:str="project"):
+        """survey the targets (relative to _Root) with the paths relative to _Root"""
+        call_command("funcsurvey", "--project", ProjectName, "--remove-path-prefix", str(self._Root), *Options, *[str(self._Root / target) for target in Targets])
+
+
+class SurveyTargetTest(SourceTreeMixin, TestCase):
+    """funcsurvey surveys directories and glob patterns, with and without worker processes"""
+
+    _Sources = {
+        "src/a.c": "int helper(int n);\nint main(void) { return helper(1); }\n",
+        "src/lib/b.c": "int helper(int n) { return n; }\n",
+        "src/lib/b.h": "static inline int unused(void) { return 0; }\n",
+    }
+
+    def _Survey(self, ProjectName:str, Targets:list, *Options) -> set:
+        self._FuncSurvey(*Targets, Options=Options, ProjectName=ProjectName)
+        return set(Function.objects.filter(project__name=ProjectName).values_list("name", "file"))
+
+    def test_directory(self):
+        self.assertEqual(self._Survey("project", ["src"]), {("main", "src/a.c"), ("helper", "src/lib/b.c")})
+
+    def test_pattern(self):
+        self.assertEqual(self._Survey("project", ["src"], "--pattern", "*.h"), {("unused", "src/lib/b.h")})
+
+    def test_glob(self):
+        self.assertEqual(self._Survey("project", ["src/*.c"]), {("main", "src/a.c"), ("helper", "src/a.c")})
+
+    def test_jobs(self):
+        self.assertEqual(self._Survey("jobs", ["src"], "--jobs", "2"), self._Survey("project", ["src"]))
+
+
+class SurveyCacheTest(SourceTreeMixin, TestCase):
+    """survey result is reused while the source, included headers and clang args are not changed"""
+
+    _Sources = {
+        "inc/a.h": "int helper(int n);\n",
+        "src/a.c": "#include \"a.h\"\nint main(void) { return helper(1); }\n",
+    }
+
+    def _Survey(self, ClangArgs:str="") -> int:
+        with mock.patch.object(clang.cindex.Index, "parse", autospec=True, side_effect=clang.cindex.Index.parse) as parse:
+            self._FuncSurvey("src", Options=[f"--clang-args=-I{self._Root / 'inc'} {ClangArgs}", "--cache-dir", str(self._Root / "cache")])
+
+        # number of parsed files
+        return parse.call_count
+
+    def test_cache(self):
+        self.assertEqual(self._Survey(), 1)
+        self.assertEqual(self._Survey(), 0)
+        self.assertEqual(self._Survey("-DDEBUG"), 1)
+
+        self._WriteSources({"inc/a.h": "int helper(int n);\nstatic inline int extra(void) { return helper(0); }\n"})
+        self.assertEqual(self._Survey(), 1)
+        self.assertTrue(Function.objects.filter(name="extra").exists())
+
+
+class IncrementalTest(SourceTreeMixin, TestCase):
+    """incremental survey parses only the changed files, and rewrites the records depending on deleted files and changed headers"""
+
+    _Sources = {
+        "inc/a.h": (
+            "int shared(int n);\n"
+            "int api(int n);\n"
+            "static inline int wrap(int n) { return api(n); }\n"
+        ),
+        "src/a.c": (
+            "#include \"a.h\"\n"
+            "int api(int n) { return n; }\n"
+            "int main(void) { return shared(wrap(1)); }\n"
+        ),
+        "src/b.c": (
+            "int shared(int n) { return n; }\n"
+        ),
+    }
+
+    def _Survey(self):
+        self._FuncSurvey("src", Options=[f"--clang-args=-I{self._Root / 'inc'}", "--incremental"])
+
+    def _Relations(self) -> set:
+        return set(FunctionRelation.objects.filter(project__name="project", call_from__isnull=False).values_list("call_from__name", "call_to__name", "call_to__file"))
+
+    def test_unchanged_file(self):
+        self._Survey()
+        functions = set(Function.objects.values_list("pk", "name", "file"))
+
+        with mock.patch.object(clang.cindex.Index, "parse", autospec=True, side_effect=clang.cindex.Index.parse) as parse:
+            self._Survey()
+
+        self.assertEqual(parse.call_count, 0)
+        self.assertEqual(set(Function.objects.values_list("pk", "name", "file")), functions)
+
+    def test_changed_file(self):
+        self._Survey()
+
+        # the function removed from the file is deleted
+        self._WriteSources({"src/b.c": "int renamed(int n) { return n; }\n"})
+        self._Survey()
+        functions = set(Function.objects.values_list("name", "file"))
+        self.assertIn(("renamed", "src/b.c"), functions)
+        self.assertNotIn(("shared", "src/b.c"), functions)
+
+    def test_deleted_file(self):
+        self._Survey()
+        self.assertIn(("main", "shared", "src/b.c"), self._Relations())
+
+        # the call from the unchanged file is linked to the prototype
+        (self._Root / "src" / "b.c").unlink()
+        self._Survey()
+        self.assertIn(("main", "shared", "inc/a.h"), self._Relations())
+        self.assertEqual(SourceFile.objects.count(), 1)
+
+    def test_changed_header(self):
+        self._Survey()
+        self.assertIn(("wrap", "api", "src/a.c"), self._Relations())
+
+        self._WriteSources({"inc/a.h": self._Sources["inc/a.h"].replace("return api(n);", "return n;")})
+        self._Survey()
+        self.assertNotIn(("wrap", "api", "src/a.c"), self._Relations())
+        self.assertIn(("main", "wrap", "inc/a.h"), self._Relations())
+
+    def test_working_directory(self):
+        cwd = os.getcwd()
+        try:
+            os.chdir(self._Root)
+            call_command("funcsurvey", "--project", "project", f"--clang-args=-I{self._Root / 'inc'}", "--remove-path-prefix", ".", "--incremental", "src")
+            functions = set(Function.objects.values_list("pk", flat=True))
+
+            # nothing is surveyed again from another directory
+            os.chdir(self._Root / "inc")
+            self._Survey()
+
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(set(Function.objects.values_list("pk", flat=True)), functions)
+        self.assertEqual(SourceFile.objects.count(), 2)
+
+
+class BatchWriteTest(SourceTreeMixin, TestCase):
+    """funcsurvey writes the functions and relations of a file by a fixed number of queries"""
+
+    def _SurveyQueries(self, ProjectName:str, FunctionCount:int) -> list:
+        # each function calls the previous one
+        self._WriteSources({"a.c": "int func0(void) { return 0; }\n" + "".join(f"int func{index}(void) {{ return func{index - 1}(); }}\n" for index in range(1, FunctionCount))})
+
+        # the second survey updates the records
+        queries = []
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as context:
+                self._FuncSurvey("a.c", ProjectName=ProjectName)
+
+            queries.append(len(context))
+
+        self.assertEqual(Function.objects.filter(project__name=ProjectName).count(), FunctionCount)
+        self.assertEqual(FunctionRelation.objects.filter(project__name=ProjectName).count(), FunctionCount - 1)
+        return queries
+
+    def test_query_count_does_not_depend_on_functions(self):
+        self.assertEqual(self._SurveyQueries("small", 5), self._SurveyQueries("large", 40))
+
+
+class FunctionConstraintTest(SourceTreeMixin, TestCase):
+    """global function is unique in project, static function is unique in file"""
+
+    def _Create(self, ProjectProfile:Project, Static:bool, File:str) -> Function:
+        return Function.objects.create(project=ProjectProfile, name="helper", return_type="int", arguments=[], file=File, line=1,
+                                       static=Static, file_key=Function.FileKey(Static, File))
+
+    def test_static(self):
+        project = Project.objects.create(name="project")
+        self._Create(project, True, "a.c")
+        self._Create(project, True, "b.c")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self._Create(project, True, "a.c")
+
+    def test_global(self):
+        project = Project.objects.create(name="project")
+        self._Create(project, False, "a.c")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self._Create(project, False, "b.c")
+
+    def test_survey_static_functions(self):
+        self._WriteSources({f"{name}.c": f"static int helper(void) {{ return 0; }}\nint {name}(void) {{ return helper(); }}\n" for name in ("a", "b")})
+        self._FuncSurvey(".")
+
+        self.assertEqual(set(Function.objects.filter(name="helper").values_list("file", flat=True)), {"a.c", "b.c"})
+        self.assertEqual(set(FunctionRelation.objects.values_list("call_from__name", "call_to__file")), {("a", "a.c"), ("b", "b.c")})
+
+
+class CallGraphTraceTest(TestCase):
+    """function tree of the call graph is same as the tree traced without memo"""
+
+    def _Graph(self, Edges:list) -> CallGraph:
+        names = sorted(set(name for edge in Edges for name in edge))
+        ids = {name: index for index, name in enumerate(names)}
+        return CallGraph(names, [{"static": False, "return_type": "int"}] * len(names), [(ids[fr], ids[to]) for fr, to in Edges])
+
+    def _Expected(self, Graph:CallGraph, Name:str, Depth:int, Upper:bool, Path:tuple=()) -> dict:
+        func_id = Graph.Id(Name)
+        element = {"name": Name, "recursive": False, "next": []}
+        if Depth > 0:
+            for next_id in (Graph.Callers if Upper else Graph.Callees)(func_id):
+                next_name = Graph.Name(next_id)
+                if next_name in Path + (Name,):
+                    element["next"].append({"name": next_name, "recursive": True, "next": []})
+                else:
+                    element["next"].append(self._Expected(Graph, next_name, Depth - 1, Upper, Path + (Name,)))
+
+        return element
+
+    def test_recursion(self):
+        # B calls A back, and C calls itself
+        graph = self._Graph([("A", "B"), ("B", "A"), ("B", "C"), ("C", "C")])
+        for name in ("A", "B", "C"):
+            for depth in range(4):
+                for upper in (False, True):
+                    self.assertEqual(graph.Trace(name, depth, upper), self._Expected(graph, name, depth, upper))
+
+    def test_cycle(self):
+        # X is reached from A and from Y, and Y is on the path of the second one
+        graph = self._Graph([("R", "A"), ("R", "Y"), ("A", "X"), ("Y", "X"), ("X", "Y"), ("Y", "Z"), ("Z", "X")])
+        for name in ("R", "X", "Y"):
+            for depth in range(5):
+                for upper in (False, True):
+                    self.assertEqual(graph.Trace(name, depth, upper), self._Expected(graph, name, depth, upper))
+
+        tree = graph.Trace("R", 3, False)
+        self.assertEqual(tree["next"][1]["next"][0]["next"], [{"name": "Y", "recursive": True, "next": []}])
+
+    def test_shared_subtree(self):
+        # the diamond below B and C is traced once and shared
+        graph = self._Graph([("A", "B"), ("A", "C"), ("B", "D"), ("C", "D"), ("D", "E"), ("E", "D")])
+        tree = graph.Trace("A", 4, False)
+        self.assertEqual(tree, self._Expected(graph, "A", 4, False))
+        self.assertIs(tree["next"][0]["next"][0], tree["next"][1]["next"][0])
+
+
+class SnapshotTest(TestCase):
+    """functree and makestub give the same output from snapshot as from database"""
+
+    def setUp(self):
+        project = make_project("project", 10)
+        Function.objects.filter(project=project).update(is_prototype=False, arguments=[{"Type": "int", "Name": "a", "Declear": "int a"}])
+        functions = list(Function.objects.filter(project=project).order_by("id"))
+        FunctionRelation.objects.create(project=project, call_from=functions[9], call_to=functions[3], file=functions[9].file, line=functions[9].line + 2)
+
+    def _FunctionTree(self, *Options) -> list:
+        with self.assertLogs("Survey", level="INFO") as logs:
+            call_command("functree", "--project", "project", "--upper", "4", "--lower", "4", *Options, "func5")
+
+        messages = [record.getMessage() for record in logs.records]
+        return messages[messages.index("** Upper Function Tree"):]
+
+    def _MakeStub(self, SaveAs:Path, *Options) -> tuple:
+        call_command("makestub", "--project", "project", "--save-as", str(SaveAs), *Options)
+        return Path(f"{SaveAs}.h").read_text(), Path(f"{SaveAs}.c").read_text()
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            snapshot = str(Path(tempdir) / "project.snapshot")
+            call_command("makesnapshot", "--project", "project", "--save-as", snapshot)
+
+            tree = self._FunctionTree()
+            self.assertIn("** Lower Function Tree", tree)
+            self.assertEqual(self._FunctionTree("--snapshot", snapshot), tree)
+
+            stub = self._MakeStub(Path(tempdir) / "database")
+            self.assertIn("func9", stub[1])
+            self.assertEqual(self._MakeStub(Path(tempdir) / "snapshot", "--snapshot", snapshot), stub)
+            self.assertEqual(
+                self._MakeStub(Path(tempdir) / "snapshot", "--snapshot", snapshot, "--parent-func", "func2,func9"),
+                self._MakeStub(Path(tempdir) / "database", "--parent-func", "func2,func9"))
+
+
+class ExcelExportTest(TestCase):
+    """exportdb writes the function and relation sheets of the project"""
+
+    def test_export(self):
+        make_project("project", 10)
+        make_project("other", 3)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            call_command("exportdb", "--project", "project", "--save-as", str(Path(tempdir) / "export.xlsx"))
+
+            wb = load_workbook(Path(tempdir) / "export.xlsx")
+            # list rows (the list starts at the second column)
+            functions = [row[1:] for row in wb["関数一覧"].iter_rows(values_only=True) if isinstance(row[1], int)]
+            relations = [row[1:] for row in wb["呼び出し一覧"].iter_rows(values_only=True) if isinstance(row[1], int)]
+
+        self.assertEqual([row[5] for row in functions], [f"func{index}" for index in range(10)])
+        # function pointer has no caller
+        self.assertEqual(
+            sorted((row[5] or "", row[9]) for row in relations),
+            sorted([(f"func{index}", f"func{index + 1}") for index in range(9)] + [("", "func0")]))
+
+
+class ExportDbQueryCountTest(TestCase):
+    """exportdb must read each sheet by a fixed number of queries"""
+
+    def _ExportQueries(self, ProjectName:str) -> int:
+        with tempfile.TemporaryDirectory() as tempdir:
+            with CaptureQueriesContext(connection) as queries:
+                ExportDbCommand()._ToExcel(ProjectName=ProjectName, SaveAs=str(Path(tempdir) / "export.xlsx"))
+
+            wb = load_workbook(Path(tempdir) / "export.xlsx")
+            self.Exported = (wb["関数一覧"].max_row, wb["呼び出し一覧"].max_row)
+
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_rows(self):
+        make_project("small", 5)
+        make_project("large", 200)
+
+        small = self._ExportQueries("small")
+        small_rows = self.Exported
+        large = self._ExportQueries("large")
+        large_rows = self.Exported
+
+        self.assertEqual(small, large)
+        self.assertEqual(large_rows[0] - small_rows[0], 195)
+        self.assertEqual(large_rows[1] - small_rows[1], 195)
+
+    def test_query_count(self):
+        make_project("project", 50)
+
+        # summary and rows of function list and function relation list
+        with self.assertNumQueries(4):
+            command = ExportDbCommand()
+            command._FunctionSummary("project")
+            list(command._FunctionRows("project"))
+            command._FunctionRelationSummary("project")
+            list(command._FunctionRelationRows("project"))
+
+    def test_function_pointer_relation(self):
+        make_project("project", 3)
+
+        rows = list(ExportDbCommand()._FunctionRelationRows("project"))
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[-1][5], "")
+        self.assertEqual(rows[-1][9], "func0")
+
+
+class ExportTablesTest(TestCase):
+    """exportdb --format other than Excel"""
+
+    def test_csv(self):
+        make_project("project", 5)
+        with tempfile.TemporaryDirectory() as tempdir:
+            counts = ExportTables("project", "CSV", str(Path(tempdir) / "export.xlsx"), ChunkSize=2)
+
+            with open(Path(tempdir) / "export.function_relation.csv", newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+
+        self.assertEqual(counts, {"function": 5, "function_relation": 5, "variable": 0})
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]["call_from"], "func0")
+        self.assertEqual(rows[-1]["call_from"], "")
+
+    def test_jsonl(self):
+        make_project("project", 5)
+        make_project("other", 3)
+        with tempfile.TemporaryDirectory() as tempdir:
+            ExportTables("project", "jsonl", str(Path(tempdir) / "export"), ChunkSize=2)
+
+            with open(Path(tempdir) / "export.function.jsonl", encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f]
+
+        self.assertEqual([row["name"] for row in rows], [f"func{index}" for index in range(5)])
+        self.assertEqual(rows[0]["arguments"], [{"Type": "int", "Name": "a"}])
+
+    def test_sqlite(self):
+        make_project("project", 5)
+        with tempfile.TemporaryDirectory() as tempdir:
+            ExportTables("project", "SQLite", str(Path(tempdir) / "export.xlsx"), ChunkSize=2)
+
+            db = sqlite3.connect(Path(tempdir) / "export.sqlite3")
+            functions = db.execute("SELECT COUNT(*) FROM function").fetchone()[0]
+            relations = db.execute("SELECT call_from, call_to FROM function_relation ORDER BY id").fetchall()
+            db.close()
+
+        self.assertEqual(functions, 5)
+        self.assertEqual(relations[0], ("func0", "func1"))
+        self.assertEqual(relations[-1], (None, "func0"))
+
+    def test_close_aborted_table(self):
+        make_project("project", 5)
+        with tempfile.TemporaryDirectory() as tempdir, mock.patch.object(CsvWriter, "Write", autospec=True, side_effect=RuntimeError) as write:
+            with self.assertRaises(RuntimeError):
+                ExportTables("project", "CSV", str(Path(tempdir) / "export"))
+
+            self.assertTrue(write.call_args.args[0]._File.closed)
+
+
+class HeaderOwnershipTest(SourceTreeMixin, TestCase):
+    """the declarations of a header are extracted by the first translation unit only"""
+
+    def test_owned_header_is_skipped(self):
+        self._WriteSources({"common.h": "int api(int a);\nextern int counter;\n"})
+        self._WriteSources({name: f'#include "common.h"\nint {name[0]}(int x) {{ return api(x); }}\n' for name in ("a.c", "b.c")})
+
+        owned = set()
+        first = Survey(str(self._Root / "a.c"), OwnedHeaders=owned).Survey()
+        second = Survey(str(self._Root / "b.c"), OwnedHeaders=owned).Survey()
+
+        self.assertEqual(owned, {str(self._Root / "common.h")})
+        self.assertEqual(sorted(first["Functions"]), ["a", "api"])
+        self.assertEqual(list(first["HeaderFunctions"]), ["api"])
+        self.assertEqual([var.Name for var in first["Variables"] if var.Scope is None], ["counter"])
+
+        self.assertEqual(sorted(second["Functions"]), ["b"])
+        self.assertEqual(second["HeaderFunctions"], {})
+        self.assertEqual([var.Name for var in second["Variables"] if var.Scope is None], [])
+        self.assertEqual(second["Functions"]["b"].CallFunctions[0].Name, "api")
+
+    def test_static_header_function(self):
+        # c.c calls the static function of second.h, which was extracted by b.c
+        self._WriteSources({header: "static inline int helper(void) { return 1; }\n" for header in ("first.h", "second.h")})
+        self._WriteSources({name: f'#include "{header}"\nint {name[0]}_main(void) {{ return helper(); }}\n' for name, header in (("a.c", "first.h"), ("b.c", "second.h"), ("c.c", "second.h"))})
+        self._FuncSurvey("a.c", "b.c", "c.c")
+
+        self.assertEqual(set(FunctionRelation.objects.filter(project__name="project", call_to__name="helper").values_list("call_from__name", "call_to__file")), {
+            ("a_main", "first.h"),
+            ("b_main", "second.h"),
+            ("c_main", "second.h"),
+        })
+
+
+class PathFilterTest(SourceTreeMixin, TestCase):
+    """the declarations in excluded headers are not surveyed"""
+
+    _Sources = {
+        "vendor.h": "int vendor_api(int a);\n",
+        "main.c": '#include <stdlib.h>\n#include "vendor.h"\nint main(void) { return vendor_api(abs(-1)); }\n',
+    }
+
+    def _Survey(self, Filter:PathFilter) -> dict:
+        return Survey(str(self._Root / "main.c"), Filter=Filter).Survey()
+
+    def test_no_filter(self):
+        functions = self._Survey(PathFilter())["Functions"]
+
+        self.assertIn("abs", functions)
+        self.assertIn("vendor_api", functions)
+
+    def test_skip_system_headers(self):
+        functions = self._Survey(PathFilter(SkipSystemHeaders=True))["Functions"]
+
+        self.assertEqual(sorted(functions), ["main", "vendor_api"])
+
+    def test_exclude_path(self):
+        functions = self._Survey(PathFilter(ExcludePatterns=["*/vendor.h"], SkipSystemHeaders=True))["Functions"]
+
+        self.assertEqual(sorted(functions), ["main"])
+
+    def test_include_path(self):
+        functions = self._Survey(PathFilter(IncludePatterns=["*/vendor.h"]))["Functions"]
+
+        self.assertEqual(sorted(functions), ["main", "vendor_api"])
+
+
+class CompileCommandsTest(TestCase):
+    """compilation database is converted to the flags of each file"""
+
+    def test_load_and_group(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            database = Path(tempdir) / "compile_commands.json"
+            database.write_text(json.dumps([
+                {"directory": "/work", "file": "src/a.c", "arguments": ["ccache", "gcc", "-c", "-I", "inc", "-DX=1", "-o", "a.o", "src/a.c"]},
+                {"directory": "/work/src", "file": "b.c", "command": "gcc -I../inc -DX=1 -MD -MF b.d -c b.c -o b.o"},
+                {"directory": "/work", "file": "src/c.c", "command": "gcc -Iinc -isystem /sdk/include -c src/c.c"},
+            ]))
+            commands = LoadCompileCommands(str(database))
+
+        self.assertEqual([command.File for command in commands], ["/work/src/a.c", "/work/src/b.c", "/work/src/c.c"])
+        self.assertEqual(commands[0].ClangArgs, "-I/work/inc -DX=1")
+        self.assertEqual(commands[2].ClangArgs, "-I/work/inc -isystem/sdk/include")
+        self.assertEqual(GroupCompileCommands(commands), {
+            "-I/work/inc -DX=1": ["/work/src/a.c", "/work/src/b.c"],
+            "-I/work/inc -isystem/sdk/include": ["/work/src/c.c"],
+        })
+
+
+class PrecompiledHeaderTest(TestCase):
+    """the shared include set is precompiled and gives the same survey result"""
+
+    def test_precompiled_header(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            (Path(tempdir) / "common.h").write_text("#ifndef COMMON_H\n#define COMMON_H\ntypedef struct { int a; } item_t;\nint api(item_t *p);\n#endif\n")
+            files = []
+            for name in ("a", "b", "c"):
+                (Path(tempdir) / f"{name}.c").write_text(f'// {name}\n#include "common.h"\n\nint {name}(void) {{ item_t v; return api(&v); }}\n')
+                files.append(str(Path(tempdir) / f"{name}.c"))
+
+            # c.c has another include set (the include after the define is not a part of it)
+            (Path(tempdir) / "c.c").write_text('#define X 1\n#include "common.h"\nint c(void) { return X; }\n')
+
+            self.assertEqual(LeadingIncludes(files[0]), ['"common.h"'])
+
+            precompiled = PchManager(str(Path(tempdir) / "pch")).Prepare(files, {file: "" for file in files})
+            self.assertEqual(sorted(precompiled), files[:2])
+            self.assertEqual(precompiled[files[0]].Includes, [str(Path(tempdir) / "common.h")])
+
+            without_pch = Survey(files[1]).Survey()
+            with_pch = Survey(files[1], Pch=precompiled[files[1]]).Survey()
+
+        self.assertEqual(with_pch["Functions"], without_pch["Functions"])
+        self.assertEqual(with_pch["Includes"], without_pch["Includes"])
+
+    def test_include_guard(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            headers = {
+                "once.h": "#pragma once\nint once(void);\n",
+                "guard.h": "/* guard */\n#ifndef GUARD_H\n#include \"once.h\"\n#define GUARD_H 1\n#ifdef X\nint x(void);\n#endif\n#endif /* GUARD_H */\n",
+                "partial.h": "#ifndef PARTIAL_H\n#define PARTIAL_H\n#endif\nint partial(void);\n",
+                "plain.h": "typedef struct { int a; } item_t;\n",
+            }
+            for name, source in headers.items():
+                (Path(tempdir) / name).write_text(source)
+
+            self.assertEqual({name: HasIncludeGuard(str(Path(tempdir) / name)) for name in headers}, {"once.h": True, "guard.h": True, "partial.h": False, "plain.h": False})
+
+            # the include set with a header without include guard is not precompiled
+            files = []
+            for name in ("a", "b"):
+                (Path(tempdir) / f"{name}.c").write_text(f'#include "guard.h"\n#include "plain.h"\nint {name}(void) {{ item_t v; return v.a; }}\n')
+                files.append(str(Path(tempdir) / f"{name}.c"))
+
+            self.assertEqual(PchManager(str(Path(tempdir) / "pch")).Prepare(files, {file: "" for file in files}), {})
+
+
+class SurveyWorkerPoolTest(TestCase):
+    """the recycled workers survey every file"""
+
+    def test_recycle(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            tasks = []
+            for index in range(5):
+                (Path(tempdir) / f"f{index}.c").write_text(f"int f{index}(int a) {{ return a + {index}; }}\n")
+                tasks.append((str(Path(tempdir) / f"f{index}.c"), "", None))
+
+            results = list(SurveyWorkerPool(2, MaxFiles=2).imap_unordered(tasks))
+
+        self.assertEqual(sorted(file for file, result in results), [task[0] for task in tasks])
+        self.assertEqual(sorted(name for file, result in results for name in result["Functions"]), [f"f{index}" for index in range(5)])
+
+
+class SurveyStreamTest(SourceTreeMixin, TestCase):
+    """the record stream is written in batches with the same result"""
+
+    _Sources = {
+        "main.c": (
+            "int later(int a);\n"
+            "static int twice(int a) { return later(a) + later(a + 1); }\n"
+            "int (*handler)(int) = twice;\n"
+            "int later(int a) { return a; }\n"
+            "int main(void) { int (*f)(int) = later; return twice(f(1)); }\n"
+        ),
+    }
+
+    def test_iterate(self):
+        records = list(Survey(str(self._Root / "main.c")).Iterate())
+        result = Survey(str(self._Root / "main.c")).Survey()
+
+        self.assertEqual([type(record).__name__ + ":" + record.Name for record in records[:-1]], [
+            "FunctionDecl:later", "VarDecl:a",
+            "FunctionDecl:twice", "VarDecl:a",
+            "VarDecl:handler",
+            "FunctionDecl:later", "VarDecl:a",
+            "FunctionDecl:main", "VarDecl:f",
+        ])
+        self.assertIsInstance(records[-1], SurveySummary)
+        self.assertEqual(list(result["Functions"].values()), [records[5], records[2], records[7]])
+        self.assertEqual(result["Variables"], [record for record in records if isinstance(record, VarDecl)])
+
+    def test_write_in_batches(self):
+        with mock.patch.object(FuncSurveyCommand, "_BatchSize", 2):
+            self._FuncSurvey("main.c")
+
+        functions = {func.name: (func.line, func.is_prototype) for func in Function.objects.filter(project__name="project")}
+        relations = set(FunctionRelation.objects.filter(project__name="project").values_list("call_from__name", "call_to__name", "line"))
+
+        self.assertEqual(functions, {"later": (4, False), "twice": (2, False), "main": (5, False)})
+        self.assertEqual(relations, {
+            ("twice", "later", 2),
+            ("main", "twice", 5),
+            (None, "twice", 2),
+            (None, "later", 4),
+        })
+
+
+class InstrumentTest(SourceTreeMixin, TestCase):
+    """phases, counters and queries are reported per run"""
+
+    _Sources = SurveyStreamTest._Sources
+
+    def test_phase_and_queries(self):
+        instrument = Instrument("test")
+        instrument.Start()
+        with instrument.Phase("outer"):
+            Project.objects.create(name="project")
+            with instrument.Phase("inner"):
+                list(Project.objects.all())
+                list(Project.objects.all())
+
+        instrument.Count("functions", 3)
+        instrument.Stop()
+        report = instrument.Report()
+
+        self.assertEqual(report["queries"], 3)
+        self.assertEqual({name: (phase["calls"], phase["queries"]) for name, phase in report["phases"].items()}, {"outer": (1, 1), "inner": (1, 2)})
+        self.assertGreaterEqual(report["phases"]["outer"]["seconds"], report["phases"]["inner"]["seconds"])
+        self.assertEqual(report["counters"], {"functions": 3})
+        self.assertEqual(MergeReports([report, report])["test"]["counters"], {"functions": 6})
+
+    def test_funcsurvey_report(self):
+        self._FuncSurvey("main.c", Options=["--report", str(self._Root / "report") + "/"])
+        reports = list((self._Root / "report").glob("funcsurvey-*.json"))
+        report = json.loads(reports[0].read_text())
+
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(report["counters"]["files"], 1)
+        self.assertEqual(report["counters"]["functions"], 3)
+        self.assertGreater(report["counters"]["nodes"], 0)
+        self.assertGreater(report["queries"], 0)
+        self.assertIn("parse", report["phases"])
+        self.assertIn("write_batch", report["phases"])
+
+
+class BenchmarkCorpusTest(SourceTreeMixin, TestCase):
+    """the synthetic corpus is reproducible and surveyed without failure"""
+
+    def test_survey_corpus(self):
+        config = CorpusConfig(Files=4, Functions=5, FanOut=2, HeaderDepth=3, Globals=2, FunctionPointers=0.5, Seed=1)
+        files = GenerateCorpus(str(self._Root), config)
+        GenerateCorpus(str(self._Root / "b"), config)
+        same = all(Path(file).read_text() == (self._Root / "b" / "src" / Path(file).name).read_text() for file in files)
+
+        self._FuncSurvey("src", Options=[f"--clang-args=-I {self._Root / 'inc'}"])
+
+        defined = Function.objects.filter(project__name="project", file__startswith="src/", is_prototype=False)
+
+        self.assertTrue(same)
+        self.assertEqual(len(files), 4)
+        self.assertEqual(defined.count(), 4 * (5 + 1))
+        self.assertEqual(defined.filter(name="helper", static=True).count(), 4)
+        self.assertGreater(FunctionRelation.objects.filter(project__name="project").count(), 4 * 5)
+
+
+class LinkTest(SourceTreeMixin, TestCase):
+    """calls are linked across files after all files are surveyed"""
+
+    _Sources = {
+        "a.c": (
+            "static int helper(int n) { return n; }\n"
+            "int main(void)\n"
+            "{\n"
+            "\textern int counted(int n);\n"
+            "\treturn counted(helper(1));\n"
+            "}\n"
+        ),
+        "b.c": (
+            "static int helper(int n) { return n + 1; }\n"
+            "int counted(int n) { return helper(n); }\n"
+        ),
+    }
+
+    def _Survey(self, *Options) -> set:
+        self._FuncSurvey(*self._Sources, Options=Options)
+        return set(FunctionRelation.objects.filter(project__name="project").values_list("call_from__name", "call_to__name", "call_to__file", "line"))
+
+    def test_link(self):
+        self.assertEqual(self._Survey("--link"), {
+            ("main", "helper", "a.c", 5),
+            ("main", "counted", "b.c", 5),
+            ("counted", "helper", "b.c", 2),
+        })
+        self.assertEqual(Function.objects.filter(project__name="project", name="helper").count(), 2)
+
+    def test_without_link(self):
+        # the call to the function declared in the block scope is not written
+        self.assertNotIn(("main", "counted", "b.c", 5), self._Survey())
+
+
+class ArtifactTest(SourceTreeMixin, TestCase):
+    """funcsurvey writes artifacts without database, and loadsurvey loads them"""
+
+    _Sources = LinkTest._Sources
+
+    def test_artifact_and_load(self):
+        artifact_dir = self._Root / "artifact"
+        call_command("funcsurvey", "--artifact-dir", str(artifact_dir), "--compress", *[str(self._Root / name) for name in self._Sources])
+        self.assertEqual(Function.objects.count(), 0)
+        self.assertEqual(len(FindArtifacts([artifact_dir])), 2)
+
+        call_command("loadsurvey", "--project", "project", "--remove-path-prefix", str(self._Root), str(artifact_dir))
+
+        self.assertEqual(set(FunctionRelation.objects.filter(project__name="project").values_list("call_from__name", "call_to__name", "call_to__file", "line")), {
+            ("main", "helper", "a.c", 5),
+            ("main", "counted", "b.c", 5),
+            ("counted", "helper", "b.c", 2),
+        })
+
+
+class VariableTest(SourceTreeMixin, TestCase):
+    """variables are written with their scope function"""
+
+    _Sources = {
+        "a.c": (
+            "int counter;\n"
+            "static int scale(int n);\n"
+            "static int scale(int n) { int twice = n * 2; return twice; }\n"
+            "int main(void) { int value = scale(counter); return value; }\n"
+        ),
+    }
+
+    def _Survey(self, *Options) -> list:
+        self._FuncSurvey("a.c", Options=Options)
+        return list(Variable.objects.filter(project__name="project").values_list("scope__name", "name", "line", "file"))
+
+    def test_variables(self):
+        expected = [
+            (None, "counter", 1, "a.c"),
+            ("scale", "n", 3, "a.c"),
+            ("scale", "twice", 3, "a.c"),
+            ("main", "value", 4, "a.c"),
+        ]
+        self.assertCountEqual(self._Survey(), expected)
+
+        # the variables of the file are replaced by the next survey
+        self.assertCountEqual(self._Survey(), expected)
+        self.assertCountEqual(self._Survey("--link"), expected)
+
+    def test_skip_variables(self):
+        self.assertEqual(self._Survey("--skip-variables"), [])
+
+
+class ClearDbTest(TransactionTestCase):
+    """cleardb deletes a project by chunks, or all records (TRUNCATE commits on MySQL)"""
+
+    def setUp(self):
+        for name in ("a", "b"):
+            project = Project.objects.create(name=name)
+            funcs = [Function.objects.create(project=project, name=f"f{index}", return_type="int", arguments=[], file="a.c", line=index) for index in range(5)]
+            FunctionRelation.objects.bulk_create(FunctionRelation(project=project, call_from=funcs[index], call_to=funcs[index + 1], file="a.c", line=index) for index in range(4))
+            Variable.objects.bulk_create(Variable(project=project, scope=func, type="int", name="n", file="a.c", line=func.line) for func in funcs)
+
+    def test_clear_project(self):
+        call_command("cleardb", "--project", "a", "--chunk-size", "2")
+        self.assertEqual(list(Project.objects.values_list("name", flat=True)), ["b"])
+        self.assertEqual(Function.objects.count(), 5)
+        self.assertEqual(FunctionRelation.objects.count(), 4)
+        self.assertEqual(Variable.objects.filter(project__name="b").count(), Variable.objects.count())
+
+    def test_rollback_table(self):
+        execute = CursorWrapper.execute
+        deletes = []
+
+        def fail_second_delete(Cursor, Sql, Params=None):
+            if Sql.startswith("DELETE"):
+                deletes.append(Sql)
+                if len(deletes) == 2:
+                    raise DatabaseError("failed")
+
+            return execute(Cursor, Sql, Params)
+
+        # the first chunk of the relations is rolled back
+        with mock.patch.object(CursorWrapper, "execute", autospec=True, side_effect=fail_second_delete):
+            call_command("cleardb", "--project", "a", "--chunk-size", "2")
+
+        self.assertEqual(FunctionRelation.objects.count(), 8)
+
+        # the clear is completed by running it again
+        call_command("cleardb", "--project", "a", "--chunk-size", "2")
+        self.assertEqual(list(Project.objects.values_list("name", flat=True)), ["b"])
+        self.assertEqual(FunctionRelation.objects.count(), 4)
+
+    def test_clear_all(self):
+        call_command("cleardb")
+        self.assertEqual(Project.objects.count() + Function.objects.count() + FunctionRelation.objects.count() + Variable.objects.count(), 0)
@@ -0,0 +1,175 @@
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+
+from .survey import SurveyFile
+
+logger = logging.getLogger('Survey')
+
+
+def CurrentRss() -> int:
+    """get resident set size of this process
+
+    Returns:
+        int: resident set size in bytes (the peak size where /proc is not available)
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _WorkerMain(TaskQueue:multiprocessing.Queue, ResultQueue:multiprocessing.Queue, MaxFiles:int, MaxRss:int, SurveyOptions:dict):
+    """survey worker process
+
+    The worker surveys the given files until it gets None, or retires after
+    MaxFiles files or when its RSS is over MaxRss. The retirement is told with
+    the last result, so the parent never gives a task to a retired worker.
+
+    Args:
+        TaskQueue (multiprocessing.Queue): (task number, (source file, clang args, precompiled header)) of this worker
+        ResultQueue (multiprocessing.Queue): (pid, task number, survey result, retire, RSS) of all workers
+        MaxFiles (int): files surveyed by a worker (0: no limit)
+        MaxRss (int): RSS limit in bytes (0: no limit)
+        SurveyOptions (dict): keyword arguments to SurveyFile
+    """
+    pid = os.getpid()
+    count = 0
+    while True:
+        task = TaskQueue.get()
+        if task is None:
+            break
+
+        number, (source_file, clang_args, pch) = task
+        result = SurveyFile(source_file, clang_args, Pch = pch, **SurveyOptions)
+
+        count += 1
+        rss = CurrentRss()
+        retire = (MaxFiles > 0 and count >= MaxFiles) or (MaxRss > 0 and rss > MaxRss)
+        ResultQueue.put((pid, number, result, retire, rss))
+        if retire:
+            logger.debug(f"survey worker {pid} retired ({count} file(s), RSS {rss >> 20} MB)")
+            break
+
+
+class SurveyWorkerPool():
+    """pool of long-lived survey workers
+
+    Each worker surveys many files with one clang index, and is replaced by a new
+    worker after MaxFiles files or when its RSS is over MaxRss, so the memory
+    growth of libclang is bounded. The tasks are given one by one, so the file of
+    a worker which died (e.g. crash in libclang) is reported as failed, and the
+    worker is replaced.
+    """
+    _PollInterval = 1.0
+
+    def __init__(self, Processes:int, MaxFiles:int=0, MaxRss:int=0, **SurveyOptions):
+        """initialize
+
+        Args:
+            Processes (int): number of worker processes
+            MaxFiles (int, optional): files surveyed by a worker (Defaults to 0: no limit).
+            MaxRss (int, optional): RSS limit of a worker in bytes (Defaults to 0: no limit).
+            SurveyOptions: keyword arguments to SurveyFile (CacheDir, Filter, Profile, Variables)
+        """
+        self._Processes = Processes
+        self._MaxFiles = MaxFiles
+        self._MaxRss = MaxRss
+        self._SurveyOptions = SurveyOptions
+
+    def _Start(self):
+        """start a worker and give a task"""
+        task_queue = multiprocessing.Queue()
+        worker = multiprocessing.Process(
+            target = _WorkerMain,
+            args = (task_queue, self._ResultQueue, self._MaxFiles, self._MaxRss, self._SurveyOptions),
+            daemon = True)
+        worker.start()
+        self._Workers[worker.pid] = (worker, task_queue)
+        self._Dispatch(worker.pid)
+
+    def _Dispatch(self, Pid:int):
+        """give next task to the worker (or stop it if no task is left)"""
+        worker, task_queue = self._Workers[Pid]
+        task = next(self._Pending, None)
+        if task is None:
+            task_queue.put(None)
+            return
+
+        self._Running[Pid] = task[0]
+        task_queue.put(task)
+
+    def _Stop(self, Pid:int):
+        """wait for the worker to exit"""
+        worker, task_queue = self._Workers.pop(Pid)
+        worker.join(timeout = self._PollInterval)
+        if worker.is_alive():
+            worker.terminate()
+            worker.join()
+
+        task_queue.close()
+
+    def imap_unordered(self, Tasks:list):
+        """survey files
+
+        Args:
+            Tasks (list): (source file, clang args, precompiled header)
+
+        Yields:
+            tuple: (source file, survey result or None) in completion order
+        """
+        self._ResultQueue = multiprocessing.Queue()
+        self._Pending = iter(enumerate(Tasks))
+        # {worker pid: (process, task queue)}, {worker pid: task number in progress}
+        self._Workers = {}
+        self._Running = {}
+
+        remaining = len(Tasks)
+        recycled = 0
+        try:
+            for _ in range(min(self._Processes, remaining)):
+                self._Start()
+
+            while remaining > 0:
+                try:
+                    pid, number, result, retire, rss = self._ResultQueue.get(timeout = self._PollInterval)
+
+                except queue.Empty:
+                    # replace the workers which died while surveying
+                    for pid, (worker, task_queue) in list(self._Workers.items()):
+                        if worker.is_alive() or pid not in self._Running:
+                            continue
+
+                        number = self._Running.pop(pid)
+                        logger.error(f"survey worker {pid} died (exit code {worker.exitcode}) in {Tasks[number][0]}")
+                        self._Stop(pid)
+                        self._Start()
+                        remaining -= 1
+                        yield Tasks[number][0], None
+                    continue
+
+                del self._Running[pid]
+                remaining -= 1
+                if retire:
+                    self._Stop(pid)
+                    self._Start()
+                    recycled += 1
+
+                else:
+                    self._Dispatch(pid)
+
+                yield result
+
+            if recycled > 0:
+                logger.info(f" {recycled} survey worker(s) recycled")
+
+        finally:
+            for pid in list(self._Workers):
+                self._Workers[pid][1].put(None)
+                self._Stop(pid)
+
+            self._ResultQueue.close()
@@ -0,0 +1,163 @@
+"""synthetic C corpus generator
+
+Generate a C source tree for benchmarks. The tree is reproducible by the seed,
+and tuned by the file count, functions per file, call fan-out, header depth,
+global variables per file and the ratio of functions using function pointers.
+
+    src/m<i>.c        functions m<i>_f<j>, a static helper, globals and callback table
+    inc/m<i>.h        prototypes and extern globals of m<i>.c (includes inc/layer0.h)
+    inc/layer<d>.h    types, prototypes and a static inline function (includes layer<d+1>.h)
+
+usage (in app directory):
+    python -m benchmark.corpus OUTPUT [--files N] [--functions N] [--fan-out N] [--header-depth N] [--globals N] [--function-pointers RATIO] [--seed N]
+"""
+import argparse
+import os
+import random
+from collections import namedtuple
+
+
+# corpus parameters (the defaults are a small tree surveyed in seconds)
+CorpusConfig = namedtuple(
+    "CorpusConfig",
+    ["Files", "Functions", "FanOut", "HeaderDepth", "Globals", "FunctionPointers", "Seed"],
+    defaults = [50, 20, 3, 4, 10, 0.2, 0])
+
+
+def _Function(File:int, Index:int) -> str:
+    """function name"""
+    return f"m{File}_f{Index}"
+
+
+def _Body(Rand:random.Random, Config:CorpusConfig, File:int, Index:int, Callees:list) -> list:
+    """lines of a function body calling the callees"""
+    lines = ["{", "\tint r = n;"]
+    if Rand.random() < Config.FunctionPointers:
+        lines.append(f"\tint (*fp)(int) = {Callees[0] if Callees else 'helper'};")
+        lines.append("\tr += fp(n);")
+
+    for number, callee in enumerate(Callees):
+        # vary the statements for the control flow flags
+        kind = (Index + number) % 4
+        if kind == 0:
+            lines.append(f"\tif (r > {number}) {{ r += {callee}(r - 1); }}")
+        elif kind == 1:
+            lines.append(f"\tfor (int i = 0; i < {number + 1}; i++) {{ r ^= {callee}(i); }}")
+        elif kind == 2:
+            lines.append(f"\twhile (r > 100) {{ r = {callee}(r / 2); }}")
+        else:
+            lines.append(f"\tswitch (r & 3) {{ case 0: r = {callee}(r); break; default: break; }}")
+
+    if Config.Globals > 0:
+        lines.append(f"\tm{File}_g{Index % Config.Globals} += r;")
+
+    lines.append("\treturn helper(r);")
+    lines.append("}")
+    return lines
+
+
+def GenerateCorpus(Directory:str, Config:CorpusConfig=CorpusConfig()) -> list:
+    """generate C source tree
+
+    Each function calls Config.FanOut functions chosen from the whole tree, and
+    the source file includes the headers of the called files. A function uses
+    a function pointer with the probability Config.FunctionPointers, and a file
+    has a callback table of its functions when the ratio is not 0.
+    Every file has a static function of the same name (helper).
+
+    Args:
+        Directory (str): output directory
+        Config (CorpusConfig, optional): corpus parameters (Defaults to CorpusConfig()).
+
+    Returns:
+        list: source files
+    """
+    rand = random.Random(Config.Seed)
+    os.makedirs(os.path.join(Directory, "src"), exist_ok=True)
+    os.makedirs(os.path.join(Directory, "inc"), exist_ok=True)
+
+    # nested layer headers
+    for depth in range(Config.HeaderDepth):
+        with open(os.path.join(Directory, "inc", f"layer{depth}.h"), "w") as f:
+            f.write(f"#ifndef LAYER{depth}_H\n#define LAYER{depth}_H\n")
+            if depth + 1 < Config.HeaderDepth:
+                f.write(f'#include "layer{depth + 1}.h"\n')
+            f.write(f"typedef struct layer{depth}_s {{ int a; int b[{depth + 1}]; }} layer{depth}_t;\n")
+            f.write(f"int layer{depth}_api(layer{depth}_t *p, int n);\n")
+            f.write(f"static inline int layer{depth}_inline(int n) {{ return layer{depth}_api(0, n) + n; }}\n")
+            f.write("#endif\n")
+
+    files = []
+    for file in range(Config.Files):
+        callees = [
+            [(rand.randrange(Config.Files), rand.randrange(Config.Functions)) for _ in range(Config.FanOut)]
+            for _ in range(Config.Functions)
+        ]
+
+        # header of the file
+        with open(os.path.join(Directory, "inc", f"m{file}.h"), "w") as f:
+            f.write(f"#ifndef M{file}_H\n#define M{file}_H\n")
+            if Config.HeaderDepth > 0:
+                f.write('#include "layer0.h"\n')
+            f.writelines(f"extern int m{file}_g{index};\n" for index in range(Config.Globals))
+            f.writelines(f"int {_Function(file, index)}(int n);\n" for index in range(Config.Functions))
+            f.write("#endif\n")
+
+        # source file
+        lines = [f'#include "m{file}.h"']
+        lines += [f'#include "m{other}.h"' for other in sorted(set(other for calls in callees for other, index in calls) - {file})]
+        lines += [f"int m{file}_g{index};" for index in range(Config.Globals)]
+        lines += [
+            "static int helper(int n)",
+            "{",
+            f"\treturn {'layer0_inline(n)' if Config.HeaderDepth > 0 else 'n'} + 1;",
+            "}",
+        ]
+        for index in range(Config.Functions):
+            lines.append(f"int {_Function(file, index)}(int n)")
+            lines += _Body(rand, Config, file, index, [_Function(other, callee) for other, callee in callees[index]])
+
+        if Config.FunctionPointers > 0:
+            lines.append(f"int (*m{file}_table[])(int) = {{ {', '.join(_Function(file, index) for index in range(Config.Functions))} }};")
+
+        path = os.path.join(Directory, "src", f"m{file}.c")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        files.append(path)
+
+    return files
+
+
+def AddArguments(parser):
+    """regist corpus arguments
+
+    Args:
+        parser (_type_): argument parser
+    """
+    default = CorpusConfig()
+    parser.add_argument('--files', default=default.Files, type=int, help="number of source files")
+    parser.add_argument('--functions', default=default.Functions, type=int, help="functions per file")
+    parser.add_argument('--fan-out', default=default.FanOut, type=int, help="calls per function")
+    parser.add_argument('--header-depth', default=default.HeaderDepth, type=int, help="depth of nested headers")
+    parser.add_argument('--globals', default=default.Globals, type=int, help="global variables per file")
+    parser.add_argument('--function-pointers', default=default.FunctionPointers, type=float, help="ratio of functions using function pointer")
+    parser.add_argument('--seed', default=default.Seed, type=int, help="random seed")
+
+
+def ConfigFromArguments(args) -> CorpusConfig:
+    """make corpus parameters from parsed arguments (see AddArguments)"""
+    return CorpusConfig(args.files, args.functions, args.fan_out, args.header_depth, args.globals, args.function_pointers, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output')
+    AddArguments(parser)
+    args = parser.parse_args()
+
+    files = GenerateCorpus(args.output, ConfigFromArguments(args))
+    print(f"{len(files)} file(s) in {args.output} (clang args: -I {os.path.join(args.output, 'inc')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""parse profile benchmark
+
+Survey a generated header-heavy tree with each parse profile, with and without
+precompiled header, and compare the timing and the results with the default profile.
+The header declarations are extracted once per run as funcsurvey does.
+
+usage (in app directory):
+    python -m benchmark.profile [--files N] [--headers N] [--declarations N] [--repeat N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import clang.cindex
+
+from FunctionSurvey.pch import PchManager
+from FunctionSurvey.survey import Survey, PARSE_PROFILES
+
+
+def GenerateTree(Directory:str, Files:int, Headers:int, Declarations:int) -> list:
+    """generate source files which include the same headers
+
+    Each header has prototypes, structs and static inline functions calling the prototypes.
+
+    Args:
+        Directory (str): output directory
+        Files (int): number of source files
+        Headers (int): number of headers
+        Declarations (int): number of declarations per header
+
+    Returns:
+        list: source files
+    """
+    os.makedirs(os.path.join(Directory, "inc"), exist_ok=True)
+    for header in range(Headers):
+        with open(os.path.join(Directory, "inc", f"h{header}.h"), "w") as f:
+            f.write(f"#ifndef H{header}_H\n#define H{header}_H\n")
+            for index in range(Declarations):
+                f.write(f"typedef struct h{header}_s{index} {{ int a; double b[{index % 5 + 1}]; }} h{header}_s{index}_t;\n")
+                f.write(f"int h{header}_api{index}(h{header}_s{index}_t *p, int n);\n")
+                if index % 10 == 0:
+                    f.write(f"static inline int h{header}_inl{index}(int n) {{ return h{header}_api{index}(0, n) + h{header}_api{(index + 1) % Declarations}(0, n); }}\n")
+            f.write("#endif\n")
+
+    files = []
+    for file in range(Files):
+        path = os.path.join(Directory, f"f{file}.c")
+        with open(path, "w") as f:
+            f.writelines(f'#include "inc/h{header}.h"\n' for header in range(Headers))
+            for index in range(20):
+                api = (file + index) % Declarations
+                f.write(f"int f{file}_{index}(int n) {{ h0_s{api}_t v; if (n) return h0_api{api}(&v, n) + h0_inl{api // 10 * 10}(n); return f{file}_{max(index - 1, 0)}(n - 1); }}\n")
+        files.append(path)
+
+    return files
+
+
+def CallGraph(Result:dict) -> set:
+    """get (caller, callee) of the survey result"""
+    return set(
+        (name, call.Name)
+        for name, func in Result["Functions"].items()
+        if func.IsPrototype == False
+        for call in func.CallFunctions
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', default=20, type=int)
+    parser.add_argument('--headers', default=4, type=int)
+    parser.add_argument('--declarations', default=1000, type=int)
+    parser.add_argument('--repeat', default=1, type=int)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        files = GenerateTree(tempdir, args.files, args.headers, args.declarations)
+
+        baseline = None
+        print(f"{'profile':<12}{'pch':<6}{'build s':>10}{'parse ms/file':>15}{'survey ms/file':>16}  same result  same call graph")
+        for use_pch in (False, True):
+            for profile_name, profile in PARSE_PROFILES.items():
+                build = 0.0
+                pch = {}
+                if use_pch:
+                    start = time.perf_counter()
+                    pch = PchManager(os.path.join(tempdir, f"pch_{profile.SkipHeaderBodies}"), SkipFunctionBodies = profile.SkipHeaderBodies).Prepare(files, {file: "" for file in files})
+                    build = time.perf_counter() - start
+
+                # parse only
+                index = clang.cindex.Index.create()
+                parse = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    for file in files:
+                        index.parse(file, args = ["-include-pch", pch[file].File] if file in pch else [], options = profile.Options)
+                    elapsed = time.perf_counter() - start
+                    parse = elapsed if parse is None else min(parse, elapsed)
+
+                # parse and walk
+                best = None
+                for _ in range(args.repeat):
+                    results = {}
+                    owned_headers = set()
+                    start = time.perf_counter()
+                    for file in files:
+                        results[file] = Survey(file, OwnedHeaders = owned_headers, Pch = pch.get(file), Profile = profile_name).Survey()
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+
+                if baseline is None:
+                    baseline = results
+
+                same_result = all(results[file]["Functions"] == baseline[file]["Functions"] and results[file]["Variables"] == baseline[file]["Variables"] for file in files)
+                same_graph = all(CallGraph(results[file]) == CallGraph(baseline[file]) for file in files)
+                print(f"{profile_name:<12}{'yes' if use_pch else 'no':<6}{build:>10.3f}{parse / len(files) * 1000:>15.1f}{best / len(files) * 1000:>16.1f}  {str(same_result):<11}  {same_graph}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""survey record benchmark
+
+Survey a large generated translation unit, and compare the memory and the
+pickled size (sent from worker process) of the survey records with the former
+dict records (vars() of the declarations, a dict per argument and call site,
+no interned strings). The peak memory of the record stream (the records are
+dropped after use, as funcsurvey writes them in batches) is also measured.
+
+usage (in app directory):
+    python -m benchmark.records [--functions N] [--depth N]
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+import clang.cindex
+
+from FunctionSurvey.survey import Survey
+from benchmark.walker import GenerateSource, WalkRecords
+
+
+def _Copy(Text:str) -> str:
+    """make a separate string object (not interned)"""
+    return Text.encode().decode() if isinstance(Text, str) else Text
+
+
+def DictResult(Result:dict) -> dict:
+    """convert survey result to the former dict records"""
+    functions = {}
+    for name, func in Result["Functions"].items():
+        functions[name] = {
+            "Name"          : func.Name,
+            "IsPrototype"   : func.IsPrototype,
+            "IsStatic"      : func.IsStatic,
+            "IsConst"       : func.IsConst,
+            "IncludeFor"    : func.IncludeFor,
+            "IncludeIf"     : func.IncludeIf,
+            "IncludeSwitch" : func.IncludeSwitch,
+            "IncludeWhile"  : func.IncludeWhile,
+            "IncludeDo"     : func.IncludeDo,
+            "Args"          : [{key: _Copy(value) for key, value in arg._asdict().items()} for arg in func.Args],
+            "ReturnType"    : _Copy(func.ReturnType),
+            "CallFunctions" : [{"Name": _Copy(call.Name), "Line": call.Line} for call in func.CallFunctions],
+            "File"          : _Copy(func.File),
+            "Line"          : str(func.Line),
+            "EndLine"       : str(func.EndLine),
+        }
+
+    variables = [
+        {name: (list(value) if name == "FunctionPointer" else _Copy(value)) for name, value in zip(var.__slots__, var.__getstate__())}
+        for var in Result["Variables"]
+    ]
+
+    return {"Functions": functions, "Variables": variables}
+
+
+def Measure(Build) -> tuple:
+    """measure memory of the built object
+
+    Returns:
+        tuple: (object, allocated bytes, peak bytes)
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = Build()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, after - before, peak - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--functions', default=1000, type=int)
+    parser.add_argument('--depth', default=12, type=int)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        source = os.path.join(tempdir, "generated.c")
+        with open(source, "w") as f:
+            f.write(GenerateSource(args.functions, args.depth))
+
+        with open(source, "r") as f:
+            lines = sum(1 for _ in f)
+
+        translation_unit = clang.cindex.Index.create().parse(source)
+
+        def Walk() -> dict:
+            return WalkRecords(Survey(source), translation_unit)
+
+        def Stream() -> int:
+            return sum(1 for record in Survey(source)._IterateNodes(translation_unit.cursor))
+
+        records, records_bytes, records_peak = Measure(Walk)
+        dicts, dicts_bytes, dicts_peak = Measure(lambda: DictResult(records))
+        count, stream_bytes, stream_peak = Measure(Stream)
+
+    print(f"lines {lines}, functions {len(records['Functions'])}, variables {len(records['Variables'])}, "
+          f"call sites {sum(len(func.CallFunctions) for func in records['Functions'].values())}")
+    print(f"stream  peak {stream_peak / 2**20:.2f} MB ({count} records)")
+    print(f"{'':<8}{'memory MB':>12}{'pickle MB':>12}{'pickle ms':>12}{'unpickle ms':>14}")
+    for name, result, size in (("dict", dicts, dicts_bytes), ("record", records, records_bytes)):
+        start = time.perf_counter()
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        dump = time.perf_counter() - start
+        start = time.perf_counter()
+        pickle.loads(data)
+        load = time.perf_counter() - start
+        print(f"{name:<8}{size / 2**20:>12.2f}{len(data) / 2**20:>12.2f}{dump * 1000:>12.1f}{load * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""benchmark suite
+
+Generate a synthetic C tree (benchmark.corpus) and measure
+    survey      Survey.Survey() of every file in this process
+    funcsurvey  funcsurvey of the tree into an empty SQLite database
+    functree    functree of a function in the middle of the call graph
+    exportdb    exportdb of each format
+    makestub    makestub of all called functions
+The median of the runs is reported. The results can be saved as JSON and compared
+with a baseline saved by a former run; a benchmark slower than the baseline by more
+than the threshold is reported as regression (exit status 1).
+
+usage (in app directory):
+    python -m benchmark.suite [corpus options] [--jobs N] [--repeat N] [--save FILE] [--baseline FILE] [--threshold RATIO]
+"""
+import argparse
+import datetime
+import importlib.metadata
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Project.settings")
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+
+from benchmark.corpus import AddArguments, ConfigFromArguments, GenerateCorpus
+
+
+def Environment() -> dict:
+    """get environment of the run"""
+    # version of the clang bindings (libclang wheel or clang package)
+    libclang = None
+    for package in ("libclang", "clang"):
+        try:
+            libclang = f"{package} {importlib.metadata.version(package)}"
+            break
+
+        except importlib.metadata.PackageNotFoundError:
+            pass
+
+    return {
+        "python"    : platform.python_version(),
+        "platform"  : platform.platform(),
+        "cpu_count" : os.cpu_count(),
+        "libclang"  : libclang,
+    }
+
+
+def Measure(Run, Repeat:int, Setup=None) -> dict:
+    """measure the run
+
+    Args:
+        Run (callable): measured function
+        Repeat (int): number of runs
+        Setup (callable, optional): function called before each run (not measured)
+
+    Returns:
+        dict: {"seconds": [seconds of each run], "median", "min"}
+    """
+    seconds = []
+    for _ in range(Repeat):
+        if Setup is not None:
+            Setup()
+
+        start = time.perf_counter()
+        Run()
+        seconds.append(time.perf_counter() - start)
+
+    return {"seconds": seconds, "median": statistics.median(seconds), "min": min(seconds)}
+
+
+def Compare(Results:dict, Baseline:dict, Threshold:float) -> list:
+    """compare results with baseline
+
+    Args:
+        Results (dict): results of this run
+        Baseline (dict): results of the baseline run
+        Threshold (float): allowed slowdown ratio (e.g. 0.1: 10%)
+
+    Returns:
+        list: names of the regressed benchmarks
+    """
+    if Baseline["corpus"] != Results["corpus"]:
+        print(f"warning: corpus differs from baseline {Baseline['corpus']}")
+
+    regressed = []
+    print(f"{'benchmark':<20}{'baseline s':>12}{'current s':>12}{'ratio':>8}")
+    for name, result in Results["results"].items():
+        if name not in Baseline["results"]:
+            print(f"{name:<20}{'-':>12}{result['median']:>12.3f}{'-':>8}")
+            continue
+
+        base = Baseline["results"][name]["median"]
+        ratio = result["median"] / base if base > 0 else float("inf")
+        mark = ""
+        if ratio > 1 + Threshold:
+            regressed.append(name)
+            mark = "  slower"
+        elif ratio < 1 - Threshold:
+            mark = "  faster"
+
+        print(f"{name:<20}{base:>12.3f}{result['median']:>12.3f}{ratio:>8.2f}{mark}")
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    AddArguments(parser)
+    parser.add_argument('--jobs', default=1, type=int, help="funcsurvey worker processes")
+    parser.add_argument('--repeat', default=3, type=int)
+    parser.add_argument('--depth', default=3, type=int, help="functree depth")
+    parser.add_argument('--export-format', action='append', default=None, type=str.lower, help="exportdb format (repeatable, default: excel and csv)")
+    parser.add_argument('--save', default=None, type=str, help="save results as JSON")
+    parser.add_argument('--baseline', default=None, type=str, help="compare with results saved by --save")
+    parser.add_argument('--threshold', default=0.1, type=float, help="allowed slowdown from baseline")
+    args = parser.parse_args()
+
+    config = ConfigFromArguments(args)
+    results = {
+        "created"       : datetime.datetime.now().isoformat(),
+        "environment"   : Environment(),
+        "corpus"        : config._asdict(),
+        "options"       : {"jobs": args.jobs, "repeat": args.repeat, "depth": args.depth},
+        "results"       : {},
+        "details"       : {},
+    }
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        corpus = os.path.join(tempdir, "corpus")
+        files = GenerateCorpus(corpus, config)
+        clang_args = f"-I {os.path.join(corpus, 'inc')}"
+        print(f"corpus: {len(files)} file(s), {sum(1 for file in files for _ in open(file))} line(s)")
+
+        # empty SQLite database (the commands use the default database)
+        settings.DATABASES["default"] = {"ENGINE": "django.db.backends.sqlite3", "NAME": os.path.join(tempdir, "benchmark.sqlite3")}
+        django.setup()
+        logging.getLogger('Survey').setLevel(logging.ERROR)
+        call_command("migrate", verbosity=0)
+
+        from FunctionSurvey.survey import Survey, SharedIndex
+
+        def SurveyAll():
+            for file in files:
+                Survey(TargetSourceFile=file, ClangArgs=clang_args, Index=SharedIndex()).Survey()
+
+        report = os.path.join(tempdir, "funcsurvey.json")
+
+        def FuncSurvey():
+            call_command("funcsurvey", "--project", "benchmark", f"--clang-args={clang_args}", "--remove-path-prefix", corpus,
+                         "--jobs", str(args.jobs), "--report", report, os.path.join(corpus, "src"))
+
+        benchmarks = [
+            ("survey", SurveyAll, None),
+            ("funcsurvey", FuncSurvey, lambda: call_command("flush", interactive=False, verbosity=0)),
+            ("functree", lambda: call_command("functree", "--project", "benchmark", "--upper", str(args.depth), "--lower", str(args.depth),
+                                              f"m{config.Files // 2}_f{config.Functions // 2}"), None),
+        ]
+        for format in args.export_format or ["excel", "csv"]:
+            save_as = os.path.join(tempdir, f"export.{format}")
+            benchmarks.append((f"exportdb_{format}", lambda save_as=save_as, format=format: call_command(
+                "exportdb", "--project", "benchmark", "--format", format, "--save-as", save_as), None))
+        benchmarks.append(("makestub", lambda: call_command("makestub", "--project", "benchmark", "--save-as", os.path.join(tempdir, "stub")), None))
+
+        # the commands after funcsurvey use the database of its last run
+        for name, run, setup in benchmarks:
+            results["results"][name] = Measure(run, args.repeat, setup)
+            print(f"{name:<20}{results['results'][name]['median']:>10.3f} s")
+
+        with open(report, "r") as f:
+            results["details"]["funcsurvey"] = json.load(f)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+        print(f"saved {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressed = Compare(results, json.load(f), args.threshold)
+
+        if regressed:
+            print(f"regression: {' '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
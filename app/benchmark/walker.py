@@ -0,0 +1,175 @@
+"""AST walker benchmark
+
+Compare the function body walker of Survey with the former recursive walker
+(kind.name comparisons, VarDecl re-walking its subtree) on a large generated
+translation unit.
+
+usage (in app directory):
+    python -m benchmark.walker [--functions N] [--depth N] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import clang.cindex
+
+from FunctionSurvey.survey import Survey, VarDecl, FunctionDecl
+
+
+def GenerateSource(Functions:int, Depth:int) -> str:
+    """generate C source
+
+    Each function has local variables (with function pointers), loops, branches
+    and calls, nested Depth levels.
+
+    Args:
+        Functions (int): number of functions
+        Depth (int): nesting level of statements in a function
+
+    Returns:
+        str: C source
+    """
+    lines = ["typedef int (*handler_t)(int);", "static int leaf(int x) { return x + 1; }"]
+    for index in range(Functions):
+        lines.append(f"int func{index}(int a, int (*cb)(int)) {{")
+        lines.append("    handler_t h = leaf;")
+        lines.append("    int total = 0;")
+        for level in range(Depth):
+            statement = ("if (a > %d) {", "for (int i%d = 0; i%d < a; i%d++) {", "while (a-- > %d) {", "switch (a) { case %d: {")[level % 4]
+            lines.append("    " * (level + 1) + statement.replace("%d", str(level)))
+            lines.append("    " * (level + 2) + f"int v{level} = h(cb(leaf(a + {level})));")
+            lines.append("    " * (level + 2) + f"total += v{level} + func{max(index - 1, 0)}(v{level}, leaf);")
+        for level in reversed(range(Depth)):
+            lines.append("    " * (level + 1) + ("} }" if level % 4 == 3 else "}"))
+        lines.append("    return total;")
+        lines.append("}")
+
+    return "\n".join(lines) + "\n"
+
+
+class LegacyVarDecl(VarDecl):
+    """variable declaration which re-walks its subtree recursively (former implementation)"""
+
+    def _ProcParse(self, cursor:clang.cindex.Cursor, depth:int=0):
+        if cursor.type.kind.name == "FUNCTIONPROTO":
+            self.AddFunctionPointer(cursor.spelling)
+
+        for child in cursor.get_children():
+            self._ProcParse(cursor=child, depth = depth + 1)
+
+
+class LegacySurvey(Survey):
+    """survey with the former recursive function body walker"""
+
+    def _ProcCompoundStmt(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
+        for child in cursor.get_children():
+            self._ProcParse(cursor=child, AnalysisedFunction=AnalysisedFunction)
+
+    def _ProcParse(self, cursor:clang.cindex.Cursor, AnalysisedFunction:FunctionDecl):
+        if cursor.kind.name == "FOR_STMT":
+            AnalysisedFunction.IncludeFor = True
+
+        if cursor.kind.name == "IF_STMT":
+            AnalysisedFunction.IncludeIf = True
+
+        if cursor.kind.name == "SWITCH_STMT":
+            AnalysisedFunction.IncludeSwitch = True
+
+        if cursor.kind.name == "WHILE_STMT":
+            AnalysisedFunction.IncludeWhile = True
+
+        if cursor.kind.name == "DO_STMT":
+            AnalysisedFunction.IncludeDo = True
+
+        if cursor.kind.name == "CALL_EXPR":
+            AnalysisedFunction.AddCallFunction(cursor)
+
+        elif cursor.kind.name == "VAR_DECL":
+            self._Variables.append(LegacyVarDecl(cursor=cursor, Scope = AnalysisedFunction.Name))
+
+        for child in cursor.get_children():
+            self._ProcParse(cursor=child, AnalysisedFunction=AnalysisedFunction)
+
+
+def CountBodyNodes(TranslationUnit:clang.cindex.TranslationUnit) -> int:
+    """count cursors in function bodies of the main file"""
+    count = 0
+    for function in TranslationUnit.cursor.get_children():
+        if function.kind is not clang.cindex.CursorKind.FUNCTION_DECL:
+            continue
+
+        stack = [child for child in function.get_children() if child.kind is clang.cindex.CursorKind.COMPOUND_STMT]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.get_children())
+
+    return count
+
+
+def WalkRecords(SurveyObject:Survey, TranslationUnit:clang.cindex.TranslationUnit) -> dict:
+    """walk the translation unit and gather the records
+
+    Returns:
+        dict: {"Functions": {name: FunctionDecl}, "Variables": [VarDecl]}
+    """
+    functions = {}
+    variables = []
+    for record in SurveyObject._IterateNodes(TranslationUnit.cursor):
+        if isinstance(record, FunctionDecl):
+            functions[record.Name] = record
+        else:
+            variables.append(record)
+
+    return {"Functions": functions, "Variables": variables}
+
+
+def Measure(SurveyClass:type, TranslationUnit:clang.cindex.TranslationUnit, Repeat:int) -> tuple:
+    """walk the translation unit and get the best elapsed time
+
+    Returns:
+        tuple: (best elapsed time, survey result)
+    """
+    best = None
+    for _ in range(Repeat):
+        survey = SurveyClass()
+        start = time.perf_counter()
+        result = WalkRecords(survey, TranslationUnit)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--functions', default=300, type=int)
+    parser.add_argument('--depth', default=40, type=int)
+    parser.add_argument('--repeat', default=3, type=int)
+    args = parser.parse_args()
+
+    # the former walker recurses twice per nesting level
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), args.depth * 20 + 1000))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        source = os.path.join(tempdir, "generated.c")
+        with open(source, "w") as f:
+            f.write(GenerateSource(args.functions, args.depth))
+
+        translation_unit = clang.cindex.Index.create().parse(source)
+        nodes = CountBodyNodes(translation_unit)
+
+        before, before_result = Measure(LegacySurvey, translation_unit, args.repeat)
+        after, after_result = Measure(Survey, translation_unit, args.repeat)
+
+    print(f"functions {args.functions}, depth {args.depth}, body nodes {nodes}")
+    print(f"before  {before:8.3f} s  {nodes / before:12.0f} nodes/s")
+    print(f"after   {after:8.3f} s  {nodes / after:12.0f} nodes/s")
+    print(f"speedup {before / after:8.2f} x")
+    print(f"same result: {before_result == after_result}")
+
+
+if __name__ == "__main__":
+    main()